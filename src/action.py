@@ -5,13 +5,20 @@ from sendgrid.helpers.mail import Mail, Email, To, Content
 from datetime import date
 
 import argparse
+import bisect
+from concurrent.futures import ThreadPoolExecutor
 import yaml
 from dotenv import load_dotenv
 import openai
-from relevancy import generate_relevance_score, process_subject_fields
+import usage_ledger
+from prefilter import prefilter_papers
+from relevancy import RelevanceScoreStream, generate_relevance_score
+from run_checkpoint import RunCheckpoint
+from score_cache import DEFAULT_MAX_ENTRIES, DEFAULT_TTL_DAYS, ScoreCache
+from subjects import attach_subjects, first_matching_category, matches_any, subject_names
 from download_new_papers import get_papers
-from discord_notifier import send_to_discord, send_error_to_discord
-from summarizer import generate_summaries_batch
+from discord_notifier import send_to_discord, send_error_to_discord, send_usage_to_discord
+from summarizer import FAILED_SUMMARY, generate_summaries_batch, generate_summary
 
 # Hackathon quality code. Don't judge too harshly.
 # Feel free to submit pull requests to improve the code.
@@ -272,11 +279,10 @@ def distribute_papers_by_category(papers, categories, max_total=300):
     papers_by_category = {cat: [] for cat in categories}
     
     for paper in papers:
-        processed_subjects = process_subject_fields(paper["subjects"])
-        for cat in categories:
-            if cat in processed_subjects:
-                papers_by_category[cat].append(paper)
-                break  # 最初にマッチしたカテゴリに割り当て
+        # 最初にマッチしたカテゴリに割り当て
+        cat = first_matching_category(paper, categories)
+        if cat is not None:
+            papers_by_category[cat].append(paper)
     
     # 各カテゴリの論文数を表示
     print(f"\n=== Category Distribution (Before Balancing) ===")
@@ -318,7 +324,7 @@ def distribute_papers_by_category(papers, categories, max_total=300):
     return balanced_papers
 
 
-def generate_body(categories, interest, threshold, max_papers=300, evaluation_model="gpt-4o-mini", summary_model="gpt-3.5-turbo"):
+def generate_body(categories, interest, threshold, max_papers=300, evaluation_model="gpt-4o-mini", summary_model="gpt-3.5-turbo", download_workers=4, listing_parser="bs4", llm_workers=8, score_cache=None, scoring_mode="sync", batch_poll_interval=60, prefilter_top_n=None, prefilter_min_score=None, input_token_budget=None, output_tokens_per_paper=128, max_papers_per_prompt=16, debug_prompts=False, structured_output=False, max_scoring_attempts=6, checkpoint=None, streaming_scoring=False, triage_model=None, escalation_band=1, two_phase_scoring=False):
     """
     カテゴリリストに基づいて論文を取得し、LLM評価を実行
     
@@ -329,6 +335,28 @@ def generate_body(categories, interest, threshold, max_papers=300, evaluation_mo
         max_papers: LLM評価にかける最大論文数
         evaluation_model: LLM評価に使用するモデル名
         summary_model: 要約生成に使用するモデル名
+        download_workers: arXivリスティングを並列取得する最大トピック数
+        listing_parser: リスティングHTMLのパーサ（"bs4" または "stream"）
+        llm_workers: LLM評価で同時に送信するリクエスト数の上限
+        score_cache: ScoreCache（指定した場合は評価済みの論文をLLMに送らない）
+        scoring_mode: "sync"（同期のchat.completions）または "batch"（Batch API）
+        batch_poll_interval: Batch APIの完了を確認する間隔（秒）
+        prefilter_top_n: LLM評価の前にBM25で上位何件に絞るか（Noneなら絞らない）
+        prefilter_min_score: LLM評価に回すBM25スコアの下限（Noneなら下限なし）
+        input_token_budget: 1リクエストの入力トークン数の予算（Noneならmax_papers_per_prompt件ずつ固定で分割）
+        output_tokens_per_paper: 論文1件あたりの出力トークン数（max_tokens = この値×論文数）
+        max_papers_per_prompt: 1リクエストに入れる論文数の上限
+        debug_prompts: Trueなら評価リクエストのプロンプト全文を出力する
+        structured_output: TrueならarXiv IDをキーにしたJSONスキーマで評価結果を受け取る
+        max_scoring_attempts: 失敗したリクエストを二分して再リクエストする最大回数（初回を含む）
+        checkpoint: RunCheckpoint（指定した場合は各段階の出力を保存し、完了済みの段階は保存した出力を使う）
+        streaming_scoring: Trueなら評価をストリーミングで受け取り、閾値を超えた論文の要約を評価の完了を待たずに始める
+            （scoring_mode="sync" のときのみ）
+        triage_model: 指定した場合は全論文をまずこの安価なモデルで評価し、閾値付近の論文だけevaluation_modelで評価し直す
+            （カスケード評価。streaming_scoringより優先する）
+        escalation_band: evaluation_modelで評価し直すトリアージのスコアの範囲（閾値の±この値）
+        two_phase_scoring: Trueならまず全論文のスコアだけを評価し、閾値以上の論文の理由だけを後から生成する
+            （streaming_scoringより優先する）
     
     Returns:
         body: HTML形式の論文リスト
@@ -337,7 +365,13 @@ def generate_body(categories, interest, threshold, max_papers=300, evaluation_mo
     """
     from download_new_papers import get_papers_from_multiple_topics
     
-    if categories:
+    usage_ledger.start_stage("download")
+    papers = checkpoint.load_stage("papers") if checkpoint is not None else None
+    if papers is not None:
+        # 前回の実行で取得・フィルタ済みの論文（subject_namesはJSONではリストになるため付け直す）
+        papers = [attach_subjects(paper) for paper in papers]
+        print(f"Papers after filtering: {len(papers)}")
+    elif categories:
         # カテゴリから必要なトピックのabbreviationを取得
         topic_abbreviations = get_topic_abbreviations_for_categories(categories)
         print(f"\n=== Topic Detection ===")
@@ -346,62 +380,184 @@ def generate_body(categories, interest, threshold, max_papers=300, evaluation_mo
             print(f"  - {topic_name} ({abbr})")
         
         # 複数トピックから論文を取得
-        papers = get_papers_from_multiple_topics(topic_abbreviations)
+        papers = get_papers_from_multiple_topics(
+            topic_abbreviations, max_workers=download_workers, parser=listing_parser
+        )
         print(f"\n=== Paper Acquisition Results ===")
         print(f"Total papers: {len(papers)}")
         
+        category_set = frozenset(categories)
+        
         # Log category information for first 5 papers
         print(f"\nCategory info for first 5 papers:")
         for i, paper in enumerate(papers[:5]):
             print(f"\nPaper {i+1}:")
             print(f"  Title: {paper['title'][:80]}...")
             print(f"  Raw subjects: {paper['subjects']}")
-            processed = process_subject_fields(paper['subjects'])
-            print(f"  Processed: {processed}")
-            matches = set(processed) & set(categories)
+            processed = subject_names(paper)
+            print(f"  Processed: {sorted(processed)}")
+            matches = processed & category_set
             print(f"  Matches: {matches if matches else 'None'}")
         
         print(f"\nFilter criteria: {categories}")
-        papers = [
-            t
-            for t in papers
-            if bool(set(process_subject_fields(t["subjects"])) & set(categories))
-        ]
+        papers = [t for t in papers if matches_any(t, category_set)]
         print(f"Papers after filtering: {len(papers)}")
+        if checkpoint is not None:
+            checkpoint.save_stage("papers", papers)
     else:
         # カテゴリ指定なしの場合はエラー
         raise RuntimeError("Categories must be specified")
     
     if interest:
         # LLM評価を実行（フィルタ後の全論文を評価）
+        usage_ledger.start_stage("scoring")
         print(f"\n=== LLM Evaluation ===")
         print(f"Using evaluation model: {evaluation_model}")
-        print(f"Evaluating {len(papers)} papers...")
-        relevancy, hallucination = generate_relevance_score(
-            papers,
-            query={"interest": interest},
-            threshold_score=threshold,
-            num_paper_in_prompt=16,
-            model_name=evaluation_model,
-        )
+        # ストリーミング評価中に始めた要約（main_page -> Future）
+        early_summaries = {}
+        summary_pool = None
+        try:
+            stage = checkpoint.load_stage("scores") if checkpoint is not None else None
+            if stage is not None:
+                relevancy = [attach_subjects(paper) for paper in stage["relevancy"]]
+                hallucination = stage["hallucination"]
+            else:
+                if prefilter_top_n is not None or prefilter_min_score is not None:
+                    num_before = len(papers)
+                    papers, _ = prefilter_papers(papers, interest, top_n=prefilter_top_n, min_score=prefilter_min_score)
+                    print(f"BM25 prefilter kept {len(papers)} of {num_before} papers "
+                          f"(top_n={prefilter_top_n}, min_score={prefilter_min_score})")
+                print(f"Evaluating {len(papers)} papers...")
+                if streaming_scoring and scoring_mode == "sync" and not triage_model and not two_phase_scoring:
+                    # 閾値を超えた論文から順に、残りの評価を待たずに要約を始める。
+                    # 評価後のカテゴリ毎の均等配分（distribute_papers_by_category）で外れる論文の要約を避けるため、
+                    # 届いた論文の中でカテゴリの枠（max_papers // カテゴリ数）に入っている論文だけを要約する
+                    summary_pool = ThreadPoolExecutor(max_workers=llm_workers)
+                    category_quota = max_papers // len(categories)
+                    order = {paper["main_page"]: idx for idx, paper in enumerate(papers)}
+                    # カテゴリ毎の、届いた論文の (-スコア, 掲載順, main_page)（均等配分と同じ順序）
+                    ranked = {cat: [] for cat in categories}
+                    stream = RelevanceScoreStream(
+                        papers,
+                        query={"interest": interest},
+                        threshold_score=threshold,
+                        num_paper_in_prompt=max_papers_per_prompt,
+                        model_name=evaluation_model,
+                        max_workers=llm_workers,
+                        score_cache=score_cache,
+                        input_token_budget=input_token_budget,
+                        output_tokens_per_paper=output_tokens_per_paper,
+                        structured_output=structured_output,
+                        max_attempts=max_scoring_attempts,
+                        checkpoint=checkpoint,
+                    )
+                    relevancy = []
+                    for paper in stream:
+                        relevancy.append(paper)
+                        cat = first_matching_category(paper, categories)
+                        if cat is None:
+                            continue
+                        key = (-int(paper["Relevancy score"]), order[paper["main_page"]], paper["main_page"])
+                        rank = bisect.bisect(ranked[cat], key)
+                        ranked[cat].insert(rank, key)
+                        if rank >= category_quota:
+                            continue
+                        early_summaries[paper["main_page"]] = summary_pool.submit(generate_summary, paper, summary_model)
+                        if len(ranked[cat]) > category_quota:
+                            # 枠から押し出された論文は、この後も枠に戻らないので、まだ始まっていなければ取り消す
+                            early_summaries[ranked[cat][category_quota][2]].cancel()
+                    # 届いた順ではなく、同期評価と同じくスコア順（同点はリスティングの順）に並べる
+                    relevancy.sort(key=lambda x: (-int(x["Relevancy score"]), order[x["main_page"]]))
+                    hallucination = stream.hallucination
+                    cancelled = sum(future.cancelled() for future in early_summaries.values())
+                    print(f"Started {len(early_summaries)} summaries while scoring "
+                          f"({cancelled} cancelled after falling out of their category's quota)")
+                else:
+                    relevancy, hallucination = generate_relevance_score(
+                        papers,
+                        query={"interest": interest},
+                        threshold_score=threshold,
+                        num_paper_in_prompt=max_papers_per_prompt,
+                        model_name=evaluation_model,
+                        max_workers=llm_workers,
+                        score_cache=score_cache,
+                        scoring_mode=scoring_mode,
+                        batch_poll_interval=batch_poll_interval,
+                        input_token_budget=input_token_budget,
+                        output_tokens_per_paper=output_tokens_per_paper,
+                        debug_prompts=debug_prompts,
+                        structured_output=structured_output,
+                        max_attempts=max_scoring_attempts,
+                        checkpoint=checkpoint,
+                        triage_model=triage_model,
+                        escalation_band=escalation_band,
+                        two_phase=two_phase_scoring,
+                    )
+            
+                if checkpoint is not None:
+                    checkpoint.save_stage("scores", {"relevancy": relevancy, "hallucination": hallucination})
         
-        # デバッグ情報
-        print(f"\n[DEBUG] generate_relevance_score completed")
-        print(f"[DEBUG] relevancy type: {type(relevancy)}")
-        print(f"[DEBUG] relevancy length: {len(relevancy) if relevancy else 0}")
-        print(f"[DEBUG] hallucination: {hallucination}")
+            # デバッグ情報
+            print(f"\n[DEBUG] generate_relevance_score completed")
+            print(f"[DEBUG] relevancy type: {type(relevancy)}")
+            print(f"[DEBUG] relevancy length: {len(relevancy) if relevancy else 0}")
+            print(f"[DEBUG] hallucination: {hallucination}")
         
-        # 閾値通過後にカテゴリ毎に均等配分
-        if len(relevancy) > max_papers:
-            print(f"\n=== Category-based Distribution (After Threshold) ===")
-            relevancy = distribute_papers_by_category(relevancy, categories, max_total=max_papers)
+            # 閾値通過後にカテゴリ毎に均等配分
+            if len(relevancy) > max_papers:
+                print(f"\n=== Category-based Distribution (After Threshold) ===")
+                relevancy = distribute_papers_by_category(relevancy, categories, max_total=max_papers)
+                # 先に要約を始めたが、後から届いた論文に枠を取られて配分から外れた論文（取り消せなかった分は無駄になる）
+                selected = {paper["main_page"] for paper in relevancy}
+                wasted = sum(not future.cancel() for key, future in early_summaries.items() if key not in selected)
+                if wasted:
+                    print(f"{wasted} early summaries were generated for papers dropped by balancing")
         
-        # 閾値以上の論文に要約を生成
-        print(f"\n=== Summarization ===")
-        print(f"Generating summaries for {len(relevancy)} important papers (score >= {threshold})...")
-        print(f"Using summary model: {summary_model}")
-        from summarizer import generate_summaries_batch
-        relevancy = generate_summaries_batch(relevancy, model_name=summary_model)
+            # 閾値以上の論文に要約を生成
+            usage_ledger.start_stage("summaries")
+            print(f"\n=== Summarization ===")
+            print(f"Generating summaries for {len(relevancy)} important papers (score >= {threshold})...")
+            print(f"Using summary model: {summary_model}")
+            stage = checkpoint.load_stage("summaries") if checkpoint is not None else None
+            if stage is not None:
+                relevancy = [attach_subjects(paper) for paper in stage]
+            else:
+                on_summarized = None
+                records = {}
+                if checkpoint is not None:
+                    # 前回の実行で生成済みの要約は使い回し、残りの論文だけ要約する
+                    records = checkpoint.load_records("summaries")
+
+                    def on_summarized(paper):
+                        if paper["summary"] != FAILED_SUMMARY:
+                            checkpoint.append_records("summaries", [{"key": paper["main_page"], "summary": paper["summary"]}])
+
+                pending = []
+                for paper in relevancy:
+                    record = records.get(paper["main_page"])
+                    future = early_summaries.get(paper["main_page"])
+                    if record is not None:
+                        paper["summary"] = record["summary"]
+                    elif future is not None and not future.cancelled():
+                        paper["summary"] = future.result()
+                        if on_summarized is not None:
+                            on_summarized(paper)
+                    else:
+                        pending.append(paper)
+                if len(pending) < len(relevancy):
+                    print(f"{len(relevancy) - len(pending)} summaries already generated")
+
+                generate_summaries_batch(pending, model_name=summary_model, on_summarized=on_summarized)
+                num_failed = sum(paper["summary"] == FAILED_SUMMARY for paper in relevancy)
+                if num_failed:
+                    # 段階を完了にせず、次の実行では失敗した論文だけを要約し直す（成功分はrecordsから復元）
+                    print(f"{num_failed} summaries failed; not marking the summaries stage as done")
+                elif checkpoint is not None:
+                    checkpoint.save_stage("summaries", relevancy)
+        finally:
+            # 評価・要約の途中で例外が出ても、まだ始まっていない要約は取り消してプールを閉じる
+            if summary_pool is not None:
+                summary_pool.shutdown(cancel_futures=True)
         print(f"[DEBUG] Summarization completed for {len(relevancy)} papers")
         
         body = "<br><br>".join(
@@ -434,6 +590,10 @@ if __name__ == "__main__":
     parser.add_argument(
         "--config", help="yaml config file to use", default="config.yaml"
     )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="resume today's run with the same config, skipping completed stages and scoring batches",
+    )
     args = parser.parse_args()
     with open(args.config, "r", encoding="utf-8") as f:
         config = yaml.safe_load(f)
@@ -450,13 +610,42 @@ if __name__ == "__main__":
     max_papers = config.get("max_papers", 300)  # デフォルトは300
     evaluation_model = config.get("evaluation_model", "gpt-4o-mini")  # デフォルトはgpt-4o-mini
     summary_model = config.get("summary_model", "gpt-3.5-turbo")  # デフォルトはgpt-3.5-turbo
+    download_workers = config.get("download_workers", 4)  # arXiv取得の並列数
+    listing_parser = config.get("listing_parser", "bs4")  # リスティングHTMLのパーサ
+    llm_workers = config.get("llm_workers", 8)  # LLM評価の同時リクエスト数
+    scoring_mode = config.get("scoring_mode", "sync")  # LLM評価の方式
+    batch_poll_interval = config.get("batch_poll_interval", 60)  # Batch APIのポーリング間隔（秒）
+    prefilter_top_n = config.get("prefilter_top_n")  # BM25の事前フィルタで残す件数
+    prefilter_min_score = config.get("prefilter_min_score")  # BM25の事前フィルタのスコア下限
+    input_token_budget = config.get("input_token_budget")  # 1リクエストの入力トークン数の予算
+    output_tokens_per_paper = config.get("output_tokens_per_paper", 128)  # 論文1件あたりの出力トークン数
+    max_papers_per_prompt = config.get("max_papers_per_prompt", 16)  # 1リクエストの論文数の上限
+    debug_prompts = config.get("debug_prompts", False)  # 評価プロンプトの全文を出力する
+    structured_output = config.get("structured_output", False)  # JSONスキーマで評価結果を受け取る
+    max_scoring_attempts = config.get("max_scoring_attempts", 6)  # 失敗した評価リクエストを分割して再試行する最大回数
+    streaming_scoring = config.get("streaming_scoring", False)  # 評価をストリーミングで受け取り、要約を先に始める
+    triage_model = config.get("triage_model")  # カスケード評価で最初に全論文を評価する安価なモデル
+    escalation_band = config.get("escalation_band", 1)  # evaluation_modelで評価し直す閾値からのスコアの幅
+    two_phase_scoring = config.get("two_phase_scoring", False)  # スコアだけを先に評価し、閾値以上の論文だけ理由を生成する
+    usage_prices = config.get("usage_prices")  # 使用量の集計に概算料金を含めるためのモデルごとの料金表
+    usage_report_discord = config.get("usage_report_discord", False)  # 使用量の集計をDiscord（Webhook）にも投稿する
+    score_cache = None
+    if config.get("score_cache", False):  # 評価済みスコアのキャッシュ
+        score_cache = ScoreCache(
+            ttl_days=config.get("score_cache_ttl_days", DEFAULT_TTL_DAYS),
+            max_entries=config.get("score_cache_max_entries", DEFAULT_MAX_ENTRIES),
+        )
+        print(f"Score cache: evicted {score_cache.evict()} entries")
+    # 各段階の出力を data/runs/{日付}-{設定ハッシュ}/ に保存する（--resume で完了済みの段階を飛ばす）
+    checkpoint = RunCheckpoint.for_run(config, resume=args.resume)
+    print(f"Run checkpoint: {checkpoint.run_dir}{' (resuming)' if args.resume else ''}")
     discord_webhook = os.environ.get("DISCORD_WEBHOOK_URL")
     discord_bot_token = os.environ.get("DISCORD_BOT_TOKEN")
     discord_forum_channel_id = os.environ.get("DISCORD_FORUM_CHANNEL_ID")
     
     try:
         print(f"\n[DEBUG] Starting generate_body...")
-        body, papers, hallucination = generate_body(categories, interest, threshold, max_papers, evaluation_model, summary_model)
+        body, papers, hallucination = generate_body(categories, interest, threshold, max_papers, evaluation_model, summary_model, download_workers, listing_parser, llm_workers, score_cache, scoring_mode, batch_poll_interval, prefilter_top_n, prefilter_min_score, input_token_budget, output_tokens_per_paper, max_papers_per_prompt, debug_prompts, structured_output, max_scoring_attempts, checkpoint, streaming_scoring, triage_model, escalation_band, two_phase_scoring)
         print(f"[DEBUG] generate_body completed")
         print(f"[DEBUG] papers type: {type(papers)}")
         print(f"[DEBUG] papers length: {len(papers) if papers else 0}")
@@ -467,7 +656,10 @@ if __name__ == "__main__":
         
         # Discord通知（要約は既に生成済み）
         # フォーラムモード優先、次にWebhook
-        if discord_bot_token and discord_forum_channel_id and papers:
+        usage_ledger.start_stage("notify")
+        if checkpoint.load_stage("discord") is not None:
+            print("\nAlready posted to Discord in this run. Skipping Discord notification.")
+        elif discord_bot_token and discord_forum_channel_id and papers:
             print("\nPosting to Discord Forum...")
             from discord_notifier import send_to_discord_forum
             # トピック名を自動検出
@@ -478,7 +670,7 @@ if __name__ == "__main__":
             # カテゴリごとの最大投稿数を計算
             max_per_category = config.get("max_total_papers", 12) // len(categories) if categories else 2
             
-            send_to_discord_forum(
+            posted = send_to_discord_forum(
                 bot_token=discord_bot_token,
                 forum_channel_id=discord_forum_channel_id,
                 papers_html=body,
@@ -488,6 +680,8 @@ if __name__ == "__main__":
                 papers_with_summary=papers if interest else None,
                 max_per_category=max_per_category
             )
+            if posted:
+                checkpoint.save_stage("discord", {"mode": "forum"})
         elif discord_webhook and papers:
             print("\nPosting to Discord (Webhook mode)...")
             # トピック名を自動検出
@@ -495,7 +689,7 @@ if __name__ == "__main__":
             topic_names = list(topic_abbreviations.values())
             topic_display = ", ".join(topic_names) if len(topic_names) > 1 else topic_names[0]
             
-            send_to_discord(
+            posted = send_to_discord(
                 webhook_url=discord_webhook,
                 papers_html=body,
                 topic=topic_display,
@@ -503,6 +697,8 @@ if __name__ == "__main__":
                 threshold=threshold,
                 papers_with_summary=papers if interest else None
             )
+            if posted:
+                checkpoint.save_stage("discord", {"mode": "webhook"})
         elif (discord_bot_token and discord_forum_channel_id) or discord_webhook:
             print("\nNo papers found. Skipping Discord notification.")
         else:
@@ -510,7 +706,9 @@ if __name__ == "__main__":
         
         # Email notification
         print(f"\n[DEBUG] Email check - SENDGRID_API_KEY: {bool(os.environ.get('SENDGRID_API_KEY'))}, from_email: {from_email}, to_email: {to_email}")
-        if os.environ.get("SENDGRID_API_KEY") and from_email and to_email:
+        if checkpoint.load_stage("email") is not None:
+            print("Already sent the email in this run. Skipping email.")
+        elif os.environ.get("SENDGRID_API_KEY") and from_email and to_email:
             try:
                 sg = SendGridAPIClient(api_key=os.environ.get("SENDGRID_API_KEY"))
                 from_email_obj = Email(from_email)  # Change to your verified sender
@@ -524,6 +722,7 @@ if __name__ == "__main__":
                 response = sg.client.mail.send.post(request_body=mail_json)
                 if response.status_code >= 200 and response.status_code <= 300:
                     print("Send email: Success!")
+                    checkpoint.save_stage("email", {"status_code": response.status_code})
                 else:
                     print(f"Send email: Failure ({response.status_code}, {response.text})")
             except Exception as email_error:
@@ -540,3 +739,10 @@ if __name__ == "__main__":
         if discord_webhook:
             send_error_to_discord(discord_webhook, error_msg)
         raise
+    finally:
+        # OpenAIの使用量を段階ごとに集計し、実行ディレクトリに書き出す（--resume の実行ではその実行の分だけ）
+        usage = usage_ledger.get_ledger().write(os.path.join(checkpoint.run_dir, "usage.json"), prices=usage_prices)
+        usage_text = usage_ledger.format_summary(usage)
+        print(f"\n{usage_text}\nWrote usage summary to {os.path.join(checkpoint.run_dir, 'usage.json')}")
+        if usage_report_discord and discord_webhook:
+            send_usage_to_discord(discord_webhook, usage_text)
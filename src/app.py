@@ -1,7 +1,10 @@
+import itertools
+
 import gradio as gr
-from download_new_papers import get_papers
+from download_new_papers import iter_papers
 import utils
-from relevancy import generate_relevance_score, process_subject_fields
+from relevancy import generate_relevance_score
+from subjects import matches_any
 from sendgrid.helpers.mail import Mail, Email, To, Content
 import sendgrid
 import os
@@ -58,6 +61,15 @@ categories_map = {
 }
 
 
+def preview_papers(abbr, categories, count=4):
+    """プレビュー用に先頭から条件に合う論文をcount件だけ読み出す"""
+    papers = iter_papers(abbr)
+    if categories:
+        category_set = frozenset(categories)
+        papers = (t for t in papers if matches_any(t, category_set))
+    return list(itertools.islice(papers, count))
+
+
 def sample(email, topic, physics_topic, categories, interest):
     if not topic:
         raise gr.Error("You must choose a topic.")
@@ -68,13 +80,7 @@ def sample(email, topic, physics_topic, categories, interest):
         abbr = physics_topics[topic]
     else:
         abbr = topics[topic]
-    if categories:
-        papers = get_papers(abbr)
-        papers = [
-            t for t in papers
-            if bool(set(process_subject_fields(t['subjects'])) & set(categories))][:4]
-    else:
-        papers = get_papers(abbr, limit=4)
+    papers = preview_papers(abbr, categories)
     if interest:
         if not openai.api_key: raise gr.Error("Set your OpenAI api key on the left first")
         relevancy, _ = generate_relevance_score(
@@ -114,13 +120,7 @@ def test(email, topic, physics_topic, categories, interest, key):
         abbr = physics_topics[topic]
     else:
         abbr = topics[topic]
-    if categories:
-        papers = get_papers(abbr)
-        papers = [
-            t for t in papers
-            if bool(set(process_subject_fields(t['subjects'])) & set(categories))][:4]
-    else:
-        papers = get_papers(abbr, limit=4)
+    papers = preview_papers(abbr, categories)
     if interest:
         if not openai.api_key: raise gr.Error("Set your OpenAI api key on the left first")
         relevancy, hallucination = generate_relevance_score(
@@ -0,0 +1,298 @@
+"""
+過去日付のバックフィル
+
+指定した日付範囲の論文を、OAI-PMH（arXivメタデータ形式）または保存済みの
+ListRecordsレスポンス（XMLファイルのディレクトリ）から取り込み、論文ストアに
+チャンク単位で書き込む。ページ毎に進捗をチェックポイントに保存するため、
+中断しても同じコマンドで続きから再開できる。XMLは逐次パースし、処理済みの
+要素は破棄するので、日付範囲の大きさに関わらずメモリ使用量は一定。
+
+使い方:
+    python src/backfill.py --from 2025-10-01 --until 2025-10-07 --set cs
+    python src/backfill.py --from 2025-10-01 --until 2025-10-07 --source dir --dir ./oai_responses
+"""
+import argparse
+import glob
+import json
+import os
+import xml.etree.ElementTree as ET
+
+from download_new_papers import ARXIV_BASE, REQUEST_TIMEOUT, create_session
+from paper_store import DEFAULT_DB_PATH, PaperStore
+from subjects import attach_subjects, format_subjects
+
+
+OAI_ENDPOINT = "https://oaipmh.arxiv.org/oai"
+OAI_NS = "{http://www.openarchives.org/OAI/2.0/}"
+ARXIV_NS = "{http://arxiv.org/OAI/arXiv/}"
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CHECKPOINT_DIR = "./data/backfill"
+
+
+def _text(element, tag):
+    child = element.find(tag)
+    return " ".join(child.text.split()) if child is not None and child.text else ""
+
+
+def _record_to_paper(record):
+    """OAI-PMHの<record>要素を論文dictに変換する（削除済みレコードはNone）"""
+    header = record.find(OAI_NS + "header")
+    if header is None or header.get("status") == "deleted":
+        return None
+    metadata = record.find(f"{OAI_NS}metadata/{ARXIV_NS}arXiv")
+    if metadata is None:
+        return None
+
+    arxiv_id = _text(metadata, ARXIV_NS + "id")
+    authors = []
+    for author in metadata.iter(ARXIV_NS + "author"):
+        name = " ".join(filter(None, [_text(author, ARXIV_NS + "forenames"), _text(author, ARXIV_NS + "keyname")]))
+        if name:
+            authors.append(name)
+    codes = _text(metadata, ARXIV_NS + "categories").split()
+
+    paper = {
+        "main_page": ARXIV_BASE + arxiv_id,
+        "pdf": ARXIV_BASE.replace("abs", "pdf") + arxiv_id,
+        "title": _text(metadata, ARXIV_NS + "title"),
+        "authors": ", ".join(authors),
+        "subjects": format_subjects(codes),
+        "abstract": _text(metadata, ARXIV_NS + "abstract"),
+        "date": _text(header, OAI_NS + "datestamp"),
+        "topic": codes[0].split(".")[0] if codes else "",
+    }
+    return attach_subjects(paper)
+
+
+class ListRecordsPage:
+    """
+    ListRecordsレスポンス1ページ分
+
+    records() でレコードを逐次yieldし、読み終えた時点で next_state
+    （次ページの再開位置。最終ページならNone）が確定する。
+    resumable=Trueなら、next_stateはレスポンス中のresumptionTokenになる（OAI-PMH用）。
+    """
+
+    def __init__(self, fileobj, next_state=None, resumable=False):
+        self.fileobj = fileobj
+        self.next_state = next_state
+        self.resumable = resumable
+        self.resumption_token = None
+
+    def records(self):
+        for _, element in ET.iterparse(self.fileobj, events=("end",)):
+            if element.tag == OAI_NS + "record":
+                paper = _record_to_paper(element)
+                element.clear()
+                if paper is not None:
+                    yield paper
+            elif element.tag == OAI_NS + "resumptionToken":
+                self.resumption_token = (element.text or "").strip() or None
+            elif element.tag == OAI_NS + "error":
+                if element.get("code") == "noRecordsMatch":
+                    return
+                raise RuntimeError(f"OAI-PMH error {element.get('code')}: {element.text}")
+        # XMLを読み終えてからでないとresumptionToken（ページの末尾にある）は分からない
+        if self.resumable:
+            self.next_state = self.resumption_token
+
+
+class OAIPMHSource:
+    """arXivのOAI-PMHエンドポイントからListRecordsでページ毎に取得するソース"""
+
+    def __init__(self, set_spec, from_date, until_date, endpoint=OAI_ENDPOINT, session=None):
+        self.set_spec = set_spec
+        self.from_date = from_date
+        self.until_date = until_date
+        self.endpoint = endpoint
+        self.session = session or create_session(pool_size=1)
+
+    @property
+    def name(self):
+        return f"oai_{self.set_spec}"
+
+    def pages(self, state=None):
+        """
+        Args:
+            state: 前回のチェックポイント（resumptionToken）。Noneなら先頭から
+        """
+        token = state
+        while True:
+            if token:
+                params = {"verb": "ListRecords", "resumptionToken": token}
+            else:
+                params = {
+                    "verb": "ListRecords",
+                    "metadataPrefix": "arXiv",
+                    "set": self.set_spec,
+                    "from": self.from_date,
+                    "until": self.until_date,
+                }
+            response = self.session.get(self.endpoint, params=params, timeout=REQUEST_TIMEOUT, stream=True)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            page = ListRecordsPage(response.raw, resumable=True)
+            try:
+                yield page
+            finally:
+                response.close()
+            token = page.next_state
+            if not token:
+                return
+
+
+class LocalDirectorySource:
+    """保存済みのListRecordsレスポンス（*.xml）をファイル名順に読むオフライン用ソース"""
+
+    def __init__(self, directory, from_date=None, until_date=None):
+        self.directory = directory
+        self.from_date = from_date
+        self.until_date = until_date
+        self.files = sorted(glob.glob(os.path.join(directory, "*.xml")))
+
+    @property
+    def name(self):
+        return "dir_" + os.path.basename(os.path.normpath(self.directory))
+
+    def pages(self, state=None):
+        """
+        Args:
+            state: 前回のチェックポイント（次に読むファイルの番号）。Noneなら先頭から
+        """
+        for index in range(state or 0, len(self.files)):
+            with open(self.files[index], "rb") as f:
+                page = ListRecordsPage(f, next_state=index + 1 if index + 1 < len(self.files) else None)
+                yield _DateFilteredPage(page, self.from_date, self.until_date)
+
+
+class _DateFilteredPage:
+    """サーバ側で日付を絞り込めないソース用に、範囲外のレコードを読み飛ばす"""
+
+    def __init__(self, page, from_date, until_date):
+        self._page = page
+        self.from_date = from_date
+        self.until_date = until_date
+
+    @property
+    def next_state(self):
+        return self._page.next_state
+
+    def records(self):
+        for paper in self._page.records():
+            if self.from_date and paper["date"] < self.from_date:
+                continue
+            if self.until_date and paper["date"] > self.until_date:
+                continue
+            yield paper
+
+
+class Checkpoint:
+    """バックフィルの進捗（次ページの再開位置と取り込み件数）を保存するJSONファイル"""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = None
+        self.ingested = 0
+        self.done = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.state = data.get("state")
+            self.ingested = data.get("ingested", 0)
+            self.done = data.get("done", False)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"state": self.state, "ingested": self.ingested, "done": self.done}, f)
+        os.replace(tmp_path, self.path)
+
+
+def _flush(store, chunk):
+    """チャンクをトピック毎に論文ストアへ書き込み、追加件数を返す"""
+    added = 0
+    by_topic = {}
+    for paper in chunk:
+        by_topic.setdefault(paper["topic"], []).append(paper)
+    for topic, papers in by_topic.items():
+        added += store.append_papers(topic, papers)
+    return added
+
+
+def backfill(source, store, checkpoint, chunk_size=DEFAULT_CHUNK_SIZE, topic=None):
+    """
+    ソースのレコードをチャンク単位で論文ストアに取り込む
+
+    Args:
+        source: OAIPMHSource または LocalDirectorySource
+        store: PaperStore
+        checkpoint: Checkpoint（ページを読み終える毎に保存する）
+        chunk_size: 一度に書き込むレコード数（メモリ上に保持する最大件数）
+        topic: リスティングのトピック（Noneなら各論文の主カテゴリから決める）
+
+    Returns:
+        これまでに取り込んだ論文数（再開前の分を含む）
+    """
+    if checkpoint.done:
+        print(f"Backfill already completed ({checkpoint.ingested} papers), nothing to do")
+        return checkpoint.ingested
+    if checkpoint.state is not None:
+        print(f"Resuming backfill from checkpoint (state={checkpoint.state}, {checkpoint.ingested} papers so far)")
+
+    for page in source.pages(checkpoint.state):
+        chunk = []
+        for paper in page.records():
+            if topic:
+                paper["topic"] = topic
+            chunk.append(paper)
+            if len(chunk) >= chunk_size:
+                checkpoint.ingested += _flush(store, chunk)
+                chunk = []
+        if chunk:
+            checkpoint.ingested += _flush(store, chunk)
+        checkpoint.state = page.next_state
+        checkpoint.done = page.next_state is None
+        checkpoint.save()
+        print(f"  {checkpoint.ingested} papers ingested")
+        if checkpoint.done:
+            break
+
+    checkpoint.done = True
+    checkpoint.save()
+    return checkpoint.ingested
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--from", dest="from_date", required=True, help="開始日 (YYYY-MM-DD)")
+    parser.add_argument("--until", dest="until_date", required=True, help="終了日 (YYYY-MM-DD)")
+    parser.add_argument("--source", choices=["oai", "dir"], default="oai")
+    parser.add_argument("--set", dest="set_spec", default="cs", help="OAI-PMHのセット（例: cs, eess, physics:astro-ph）")
+    parser.add_argument("--dir", help="--source dir の場合の保存済みレスポンスのディレクトリ")
+    parser.add_argument("--topic", help="リスティングのトピック（省略時は各論文の主カテゴリ）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--checkpoint", help="チェックポイントファイル（省略時は data/backfill/ 以下に自動作成）")
+    parser.add_argument("--restart", action="store_true", help="チェックポイントを無視して最初からやり直す")
+    args = parser.parse_args()
+
+    if args.source == "oai":
+        source = OAIPMHSource(args.set_spec, args.from_date, args.until_date)
+    else:
+        if not args.dir:
+            parser.error("--dir is required with --source dir")
+        source = LocalDirectorySource(args.dir, args.from_date, args.until_date)
+
+    checkpoint_path = args.checkpoint or os.path.join(
+        DEFAULT_CHECKPOINT_DIR, f"{source.name}_{args.from_date}_{args.until_date}.json"
+    )
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    with PaperStore(args.db) as store:
+        total = backfill(source, store, Checkpoint(checkpoint_path), chunk_size=args.chunk_size, topic=args.topic)
+    print(f"Backfill finished: {total} papers from {args.from_date} to {args.until_date}")
@@ -0,0 +1,174 @@
+"""
+Batch APIによる関連度評価
+
+夜間のダイジェスト作成は時間に余裕があるため、同期のchat.completionsの代わりに
+OpenAIのBatch API（料金が半額で、通常のレート制限の対象外）で評価できるようにする。
+
+    1. encode_promptで作った全プロンプトをバッチ入力JSONL（data/batches/）に書き出す
+    2. ファイルをアップロードしてバッチを作成する
+    3. 完了するまでポーリングする
+    4. 出力JSONLをcustom_idでプロンプトに対応付けて返す
+
+openai 1.3.0にはbatchesリソースがないため、/batches は共有クライアントの
+汎用のpost/getで呼ぶ（接続プール・リトライは同期評価と同じものを使う）。
+オフラインでの動作確認には tools/fake_batch_server.py を使う。
+"""
+import datetime
+import json
+import os
+import time
+from typing import Any, Dict
+
+import openai
+
+import usage_ledger
+from openai_client import get_client
+from utils import OpenAIDecodingArguments, chat_completion_body, usage_cached_tokens
+
+
+DEFAULT_BATCH_DIR = "./data/batches"
+DEFAULT_POLL_INTERVAL = 60
+DEFAULT_COMPLETION_WINDOW = "24h"
+
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+
+# これらの状態になったらポーリングを終える
+_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def write_batch_file(path, prompts, decoding_args, model_name, **decoding_kwargs):
+    """
+    プロンプトのリストをバッチ入力JSONLに書き出す
+
+    custom_id はプロンプトの位置（"prompt-0", "prompt-1", ...）。
+    decoding_argsはプロンプトごとのリストでもよい。
+    """
+    if isinstance(decoding_args, OpenAIDecodingArguments):
+        decoding_args = [decoding_args] * len(prompts)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for idx, (prompt, args) in enumerate(zip(prompts, decoding_args)):
+            request = {
+                "custom_id": f"prompt-{idx}",
+                "method": "POST",
+                "url": CHAT_COMPLETIONS_ENDPOINT,
+                "body": chat_completion_body(prompt, args, model_name, decoding_kwargs),
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return path
+
+
+def submit_batch(path, completion_window=DEFAULT_COMPLETION_WINDOW):
+    """バッチ入力JSONLをアップロードしてバッチを作成し、バッチのdictを返す"""
+    client = get_client()
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=(os.path.basename(path), f), purpose="batch")
+    return client.post(
+        "/batches",
+        cast_to=Dict[str, Any],
+        body={
+            "input_file_id": input_file.id,
+            "endpoint": CHAT_COMPLETIONS_ENDPOINT,
+            "completion_window": completion_window,
+        },
+    )
+
+
+def wait_for_batch(batch_id, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+    """
+    バッチが終了状態になるまでポーリングし、最後のバッチのdictを返す
+
+    Raises:
+        TimeoutError: timeout秒を過ぎても終了しなかった場合
+    """
+    client = get_client()
+    start = time.time()
+    while True:
+        batch = client.get(f"/batches/{batch_id}", cast_to=Dict[str, Any])
+        counts = batch.get("request_counts") or {}
+        print(f"Batch {batch_id}: {batch['status']} "
+              f"({counts.get('completed', 0)}/{counts.get('total', 0)} completed, {counts.get('failed', 0)} failed)")
+        if batch["status"] in _FINAL_STATUSES:
+            return batch
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError(f"Batch {batch_id} did not finish within {timeout} seconds")
+        time.sleep(poll_interval)
+
+
+def read_batch_output(batch, stage=None):
+    """
+    バッチの出力JSONLを読み、custom_idごとの応答テキストを返す
+
+    失敗したリクエスト（エラーファイル側にあるもの・status_codeが200以外のもの・
+    出力トークン数の上限で打ち切られたもの）は含まない。
+    各応答のusageはusage_ledgerの段階stageに記録する（応答時間はバッチ全体のため記録しない）。
+    """
+    contents = {}
+    if not batch.get("output_file_id"):
+        return contents
+    text = get_client().files.content(batch["output_file_id"]).text
+    prompt_tokens = cached_tokens = 0
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            print(f"Batch request {result['custom_id']} failed: {result.get('error') or response}")
+            usage_ledger.record((response.get("body") or {}).get("model", "batch"), stage=stage, failed=True)
+            continue
+        body = response["body"]
+        choice = body["choices"][0]
+        if choice.get("finish_reason") == "length":
+            print(f"Batch request {result['custom_id']} hit the output length limit")
+        else:
+            contents[result["custom_id"]] = choice["message"]["content"]
+        usage = body.get("usage") or {}
+        usage_ledger.record(body.get("model", "batch"), usage, stage=stage)
+        prompt_tokens += usage.get("prompt_tokens", 0)
+        cached_tokens += usage_cached_tokens(usage)
+    print(f"Batch prompt tokens: {prompt_tokens} (cached: {cached_tokens})")
+    return contents
+
+
+def run_batch(prompts, decoding_args, model_name, batch_dir=DEFAULT_BATCH_DIR,
+              poll_interval=DEFAULT_POLL_INTERVAL, timeout=None, batch_id=None, on_submitted=None,
+              stage=None, **decoding_kwargs):
+    """
+    プロンプトのリストをBatch APIで評価し、応答テキストのリストを返す
+
+    Args:
+        batch_id: 前回の実行で提出済みのバッチID（同じプロンプトのもの）。指定した場合は
+            再提出せずにそのバッチの完了を待つ（完了しなかったバッチは提出し直す）
+        on_submitted: バッチを提出したときにバッチIDを渡して呼ぶ関数（チェックポイント用）
+        stage: usage_ledgerに記録する段階（Noneなら台帳の現在の段階）
+
+    Returns:
+        promptsと同じ順序のリスト（失敗したプロンプトはNone）
+    """
+    batch = None
+    if batch_id is not None:
+        print(f"Resuming batch {batch_id} with {len(prompts)} requests")
+        try:
+            batch = wait_for_batch(batch_id, poll_interval=poll_interval, timeout=timeout)
+        except openai.NotFoundError:
+            print(f"Batch {batch_id} not found, submitting a new batch")
+        if batch is not None and batch["status"] != "completed":
+            print(f"Batch {batch_id} ended with status {batch['status']}, submitting a new batch")
+            batch = None
+    if batch is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = write_batch_file(
+            os.path.join(batch_dir, f"relevancy-{stamp}.jsonl"), prompts, decoding_args, model_name, **decoding_kwargs
+        )
+        batch = submit_batch(path)
+        print(f"Submitted batch {batch['id']} with {len(prompts)} requests ({path})")
+        if on_submitted is not None:
+            on_submitted(batch["id"])
+        batch = wait_for_batch(batch["id"], poll_interval=poll_interval, timeout=timeout)
+    if batch["status"] != "completed":
+        raise RuntimeError(f"Batch {batch['id']} ended with status {batch['status']}")
+    contents = read_batch_output(batch, stage)
+    return [contents.get(f"prompt-{idx}") for idx in range(len(prompts))]
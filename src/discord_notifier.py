@@ -114,18 +114,13 @@ def send_to_discord(webhook_url, papers_html, topic, categories, threshold, pape
         # 要約付き論文がある場合は個別投稿（カテゴリ毎に上位2件）
         if papers_with_summary:
             import time
-            from relevancy import process_subject_fields
+            from subjects import first_matching_category
             
             # カテゴリ毎に論文を分類
             papers_by_category = {}
             for paper in papers_with_summary:
-                processed_subjects = process_subject_fields(paper.get('subjects', ''))
                 # 指定カテゴリに該当するものを分類
-                matched_category = None
-                for cat in categories:
-                    if cat in processed_subjects:
-                        matched_category = cat
-                        break
+                matched_category = first_matching_category(paper, categories)
                 
                 if matched_category:
                     if matched_category not in papers_by_category:
@@ -322,17 +317,12 @@ def send_to_discord_forum(bot_token, forum_channel_id, papers_html, topic, categ
         
         # 論文を投稿
         if papers_with_summary and len(papers_with_summary) > 0:
-            from relevancy import process_subject_fields
+            from subjects import first_matching_category
             
             # カテゴリ毎に論文を分類
             papers_by_category = {}
             for paper in papers_with_summary:
-                processed_subjects = process_subject_fields(paper.get('subjects', ''))
-                matched_category = None
-                for cat in categories:
-                    if cat in processed_subjects:
-                        matched_category = cat
-                        break
+                matched_category = first_matching_category(paper, categories)
                 
                 if matched_category:
                     if matched_category not in papers_by_category:
@@ -406,6 +396,26 @@ def send_to_discord_forum(bot_token, forum_channel_id, papers_html, topic, categ
         return False
 
 
+def send_usage_to_discord(webhook_url, usage_text):
+    """
+    OpenAIの使用量の集計（usage_ledger.format_summaryのテキスト）をDiscordに投稿
+    """
+    if not webhook_url:
+        return False
+    
+    try:
+        today = date.today().strftime('%Y年%m月%d日')
+        chunks = split_message(f"📊 **ArxivDigest 使用量 - {today}**\n```\n{usage_text}\n```", max_length=1990)
+        ok = True
+        for chunk in chunks:
+            response = requests.post(webhook_url, json={"content": chunk, "username": "ArxivDigest Bot"})
+            ok = ok and response.status_code in [200, 204]
+        return ok
+    except Exception as e:
+        print(f"使用量のDiscord投稿に失敗: {e}")
+        return False
+
+
 def send_error_to_discord(webhook_url, error_message):
     """
     エラーメッセージをDiscordに投稿
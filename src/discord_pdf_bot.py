@@ -9,7 +9,6 @@ from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor
 
 import openai
-from openai import OpenAI
 import discord
 from discord.ext import commands
 
@@ -22,8 +21,14 @@ except Exception:
     except Exception:
         PdfReader = None
 
+import usage_ledger
+from rate_limit import create_chat_completion
+
 load_dotenv()
 
+# 常駐するので、使用量の台帳にはリクエストごとの記録を残さず集計だけを持つ
+usage_ledger.set_max_requests(0)
+
 LOGGER = logging.getLogger("discord_pdf_bot")
 logging.basicConfig(level=logging.INFO)
 
@@ -139,12 +144,18 @@ Paper text (first 100k chars):\n
 {text[:100000]}
 """
     
-    # OpenAI 1.3.0を使用
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
+    # 共有クライアントでレート制限のガバナを通して送信（リアクションごとに接続を張り直さない）
+    response = create_chat_completion(
+        api_key=OPENAI_API_KEY,
+        stage="pdf_bot",
         model=PDF_ANALYSIS_MODEL,
         messages=[{"role": "user", "content": prompt}],
     )
+    # このリクエストの使用量だけを出す（累計は台帳の集計にある）
+    usage = response.usage
+    if usage is not None:
+        print(f"OpenAI usage for {paper_id}: {usage.prompt_tokens:,} prompt tokens "
+              f"({usage_ledger.usage_cached_tokens(usage):,} cached), {usage.completion_tokens:,} completion tokens")
     
     content = response.choices[0].message.content
     
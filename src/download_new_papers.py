@@ -1,97 +1,440 @@
 # encoding: utf-8
-import os
+import codecs
 import tqdm
 from bs4 import BeautifulSoup as bs
-import urllib.request
-import json
-import datetime
-import pytz
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def _download_new_papers(field_abbr):
-    NEW_SUB_URL = f'https://arxiv.org/list/{field_abbr}/new'  # https://arxiv.org/list/cs/new
-    page = urllib.request.urlopen(NEW_SUB_URL)
+from listing_cache import ListingCache, hash_page
+from paper_store import PaperStore, arxiv_id_from_url, today_et
+from subjects import attach_subjects
+
+# arXivへのリクエスト設定 (接続タイムアウト, 読み込みタイムアウト) 秒
+REQUEST_TIMEOUT = (10, 60)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 1.0
+DEFAULT_MAX_WORKERS = 4
+
+
+def create_session(pool_size=DEFAULT_MAX_WORKERS, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
+    """
+    arXiv取得用のHTTPセッションを作成（keep-alive / gzip / リトライ付き）
+
+    Args:
+        pool_size: コネクションプールの最大接続数（並列数以上を指定）
+        max_retries: 接続エラー・5xx・429時の最大リトライ回数
+        backoff_factor: 指数バックオフの係数（1.0なら 1s, 2s, 4s...）
+
+    Returns:
+        requests.Session
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "User-Agent": "ArxivDigest (https://github.com/AutoLLM/ArxivDigest)",
+    })
+    return session
+
+
+# 論文ページのベースURL
+ARXIV_BASE = "https://arxiv.org/abs/"
+
+# 利用可能なリスティングパーサ
+LISTING_PARSERS = ("bs4", "stream")
+
+# 終了タグを持たないHTML要素（ストリーミングパーサの深さ管理で無視する）
+_VOID_TAGS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+])
+
+
+def _paper_number_from_dt(abstract_href, dt_text):
+    """dt要素のAbstractリンク（なければテキスト）からarXiv IDを抽出"""
+    if abstract_href is not None:
+        return abstract_href.split('/')[-1]
+    # フォールバック: テキストから抽出
+    dt_text = dt_text.strip()
+    return dt_text.split(" ")[2].split(":")[-1] if len(dt_text.split(" ")) > 2 else ""
+
+
+def _build_paper(paper_number, title_text, authors_text, subjects_text, abstract_text):
+    """各要素のテキストから論文dictを組み立てる（両パーサ共通の整形処理）"""
+    paper = {}
+    paper['main_page'] = ARXIV_BASE + paper_number
+    paper['pdf'] = ARXIV_BASE.replace('abs', 'pdf') + paper_number
+    paper['title'] = title_text.replace("Title: ", "").strip()
+    paper['authors'] = authors_text.replace("Authors:\n", "").replace("\n", "").strip()
+    paper['subjects'] = subjects_text.replace("Subjects:\n", "").replace("Subjects: ", "").strip()
+    paper['abstract'] = abstract_text.replace("\n", " ").strip()
+    return attach_subjects(paper)
+
+
+def _parse_listing_bs4(page):
+    """BeautifulSoupで全体のツリーを構築してリスティングをパースする"""
     soup = bs(page)
     content = soup.body.find("div", {'id': 'content'})
 
-    # find the first h3 element in content
-    h3 = content.find("h3").text   # e.g: New submissions for Wed, 10 May 23
-    date = h3.replace("New submissions for", "").strip()
-
     dt_list = content.dl.find_all("dt")
     dd_list = content.dl.find_all("dd")
-    arxiv_base = "https://arxiv.org/abs/"
 
     assert len(dt_list) == len(dd_list)
     new_paper_list = []
     for i in tqdm.tqdm(range(len(dt_list))):
-        paper = {}
-        
         # arXiv IDの抽出方法を改善
         # dt要素からarXivリンクを直接取得
         arxiv_link = dt_list[i].find('a', {'title': 'Abstract'})
         if arxiv_link and 'href' in arxiv_link.attrs:
-            paper_number = arxiv_link['href'].split('/')[-1]
+            paper_number = _paper_number_from_dt(arxiv_link['href'], "")
+        else:
+            paper_number = _paper_number_from_dt(None, dt_list[i].text)
+
+        new_paper_list.append(_build_paper(
+            paper_number,
+            dd_list[i].find("div", {"class": "list-title mathjax"}).text,
+            dd_list[i].find("div", {"class": "list-authors"}).text,
+            dd_list[i].find("div", {"class": "list-subjects"}).text,
+            dd_list[i].find("p", {"class": "mathjax"}).text,
+        ))
+    return new_paper_list
+
+
+class ListingStreamParser(HTMLParser):
+    """
+    arXivリスティングHTMLを逐次パースするイベント駆動パーサ
+
+    div#content内の最初の<dl>だけを走査し、<dd>が閉じるたびに論文dictを
+    self.papers に追加する。ツリーを構築しないため、BeautifulSoupより
+    CPU・メモリ消費が小さい。出力は _parse_listing_bs4 と同一。
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.papers = []
+        self._stack = []
+        self._content_depth = None
+        self._dl_depth = None
+        self._dl_done = False
+        self._captures = []   # [key, depth, parts] のリスト（入れ子で同時に収集する）
+        self._pending_dts = []
+        self._dt = None
+        self._dd = None
+
+    def _start_capture(self, key):
+        self._captures.append([key, len(self._stack), []])
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            return
+        self._stack.append(tag)
+        if self._dl_done:
+            return
+        attrs = dict(attrs)
+        if self._content_depth is None:
+            if tag == "div" and attrs.get("id") == "content":
+                self._content_depth = len(self._stack)
+            return
+        if self._dl_depth is None:
+            if tag == "dl":
+                self._dl_depth = len(self._stack)
+            return
+
+        classes = (attrs.get("class") or "").split()
+        if tag == "dt":
+            self._dt = {"href": None, "seen_link": False}
+            self._start_capture("dt")
+        elif tag == "a" and self._dt is not None and not self._dt["seen_link"]:
+            if attrs.get("title") == "Abstract":
+                # find()と同様に最初のAbstractリンクだけを見る
+                self._dt["seen_link"] = True
+                self._dt["href"] = attrs.get("href")
+        elif tag == "dd":
+            self._dd = {}
+        elif self._dd is not None:
+            if tag == "div":
+                for key in ("list-title", "list-authors", "list-subjects"):
+                    if key in classes and key not in self._dd:
+                        self._dd[key] = None
+                        self._start_capture(key)
+            elif tag == "p" and "mathjax" in classes and "abstract" not in self._dd:
+                self._dd["abstract"] = None
+                self._start_capture("abstract")
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS or tag not in self._stack:
+            return
+        while self._stack:
+            popped = self._stack.pop()
+            self._close(popped)
+            if popped == tag:
+                break
+
+    def _close(self, tag):
+        depth = len(self._stack)
+        while self._captures and self._captures[-1][1] > depth:
+            key, _, parts = self._captures.pop()
+            text = "".join(parts)
+            if key == "dt":
+                self._pending_dts.append(self._dt_to_number(text))
+                self._dt = None
+            elif self._dd is not None:
+                self._dd[key] = text
+        if self._dl_depth is not None and not self._dl_done:
+            if tag == "dd" and self._dd is not None:
+                self._emit()
+            elif tag == "dl" and depth < self._dl_depth:
+                self._dl_done = True
+
+    def _dt_to_number(self, dt_text):
+        if self._dt["seen_link"] and self._dt["href"] is not None:
+            return _paper_number_from_dt(self._dt["href"], "")
+        return _paper_number_from_dt(None, dt_text)
+
+    def _emit(self):
+        dd, self._dd = self._dd, None
+        paper_number = self._pending_dts.pop(0) if self._pending_dts else ""
+        self.papers.append(_build_paper(
+            paper_number,
+            dd.get("list-title") or "",
+            dd.get("list-authors") or "",
+            dd.get("list-subjects") or "",
+            dd.get("abstract") or "",
+        ))
+
+    def handle_data(self, data):
+        for capture in self._captures:
+            capture[2].append(data)
+
+
+def iter_listing_papers(chunks):
+    """
+    リスティングHTMLのチャンク列を逐次パースし、論文dictを順次yieldする
+
+    Args:
+        chunks: bytesまたはstrのイテラブル（レスポンスのiter_contentなど）
+
+    Yields:
+        論文dict（_download_new_papers が保存する形式と同じ）
+    """
+    parser = ListingStreamParser()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        parser.feed(chunk)
+        while parser.papers:
+            yield parser.papers.pop(0)
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    yield from parser.papers
+
+
+def parse_listing(page, parser="bs4"):
+    """
+    リスティングHTMLを論文dictのリストに変換する
+
+    Args:
+        page: HTML本文（bytesまたはstr）
+        parser: "bs4"（BeautifulSoupで全体パース）または "stream"（逐次パース）
+
+    Returns:
+        論文dictのリスト
+    """
+    if parser == "bs4":
+        return _parse_listing_bs4(page)
+    if parser == "stream":
+        return list(iter_listing_papers([page]))
+    raise ValueError(f"Unknown listing parser: {parser} (choose from {LISTING_PARSERS})")
+
+
+def _fetch_listing_page(field_abbr, session, timeout, cache):
+    """
+    リスティングページを条件付きGETで取得し、(本文, 内容ハッシュ) を返す
+    未更新（304）の場合はキャッシュ済みのHTMLを返す
+    """
+    NEW_SUB_URL = f'https://arxiv.org/list/{field_abbr}/new'  # https://arxiv.org/list/cs/new
+    response = session.get(NEW_SUB_URL, timeout=timeout, headers=cache.conditional_headers(field_abbr))
+    if response.status_code == 304:
+        print(f"  {field_abbr}: listing not modified, using cached page")
+        page = cache.load_page(field_abbr)
+        return page, cache.content_hash(field_abbr) or hash_page(page)
+    response.raise_for_status()
+    page = response.content
+    content_hash = cache.store_page(
+        field_abbr,
+        page,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+    return page, content_hash
+
+
+def _download_new_papers(field_abbr, store, session=None, timeout=REQUEST_TIMEOUT, parser="bs4", cache=None):
+    """
+    リスティングを取得・パースして論文ストアに保存する
+
+    カテゴリでの絞り込みは呼び出し側（generate_body）で行い、ここでは常にリスティング全体を保存する。
+    """
+    owns_session = session is None
+    if owns_session:
+        session = create_session(pool_size=1)
+    if cache is None:
+        cache = ListingCache()
+    try:
+        page, content_hash = _fetch_listing_page(field_abbr, session, timeout, cache)
+    finally:
+        if owns_session:
+            session.close()
+
+    date = today_et()
+
+    # 内容が前回と同じならパース済みのリスティングを再利用する
+    parsed_date = cache.parsed_date(field_abbr, content_hash)
+    if parsed_date is not None and store.copy_listing(field_abbr, parsed_date, date):
+        print(f"  {field_abbr}: listing unchanged, reusing parsed papers")
+        return
+
+    new_paper_list = parse_listing(page, parser=parser)
+    store.add_listing(field_abbr, date, new_paper_list)
+    cache.store_parsed(field_abbr, content_hash, date)
+
+
+def iter_papers(field_abbr, limit=None, fields=None, session=None, parser="bs4", cache=None, store=None):
+    """
+    今日（米国東部時間）のリスティングを論文ストアから1件ずつyieldする（未取得ならダウンロード）
+
+    必要な件数だけ読み出した時点でイテレーションを止めれば、残りは読み込まれない。
+
+    Args:
+        field_abbr: トピックの略称（例: "cs"）
+        limit: 返す論文数の上限（Noneの場合は全件）
+        fields: 返すキーのリスト（例: ["title", "abstract", "subjects"]、Noneなら全キー）
+        session: 共有のHTTPセッション
+        parser: リスティングのパーサ（"bs4" または "stream"）
+        cache: ListingCache（Noneの場合はデフォルトの場所）
+        store: PaperStore（Noneの場合はデフォルトの場所）
+
+    Yields:
+        論文dict（掲載順）
+    """
+    owns_store = store is None
+    if owns_store:
+        store = PaperStore()
+    try:
+        date = today_et()
+        if not store.has_listing(field_abbr, date):
+            _download_new_papers(field_abbr, store, session=session, parser=parser, cache=cache)
+        yield from store.iter_listing(field_abbr, date, limit=limit, fields=fields)
+    finally:
+        if owns_store:
+            store.close()
+
+
+def get_papers(field_abbr, limit=None, session=None, parser="bs4", cache=None, store=None, fields=None):
+    """
+    今日のリスティングを論文dictのリストで返す（iter_papersのリスト版）
+    """
+    return list(iter_papers(
+        field_abbr, limit=limit, fields=fields, session=session, parser=parser, cache=cache, store=store
+    ))
+
+
+def paper_id(paper):
+    """論文dictからarXiv ID（例: 2510.17814）を返す"""
+    return arxiv_id_from_url(paper['main_page'])
+
+
+def _merge_subjects(*subject_strings):
+    """複数の subjects 文字列を順序を保ったまま和集合にする"""
+    merged = []
+    for subjects in subject_strings:
+        for subject in subjects.split(";"):
+            subject = subject.strip()
+            if subject and subject not in merged:
+                merged.append(subject)
+    return "; ".join(merged)
+
+
+def dedupe_papers(papers):
+    """
+    クロスリストされた論文をarXiv IDで1件にまとめる
+
+    同じIDの論文が複数トピックに現れた場合は最初の1件を残し、
+    subjects を和集合にする。
+
+    Args:
+        papers: 論文dictのリスト
+
+    Returns:
+        (重複除去後のリスト, まとめた重複数)
+    """
+    unique = {}
+    for paper in papers:
+        key = paper_id(paper)
+        if key in unique:
+            kept = unique[key]
+            kept['subjects'] = _merge_subjects(kept['subjects'], paper['subjects'])
+            attach_subjects(kept)
         else:
-            # フォールバック: テキストから抽出
-            dt_text = dt_list[i].text.strip()
-            paper_number = dt_text.split(" ")[2].split(":")[-1] if len(dt_text.split(" ")) > 2 else ""
-        
-        paper['main_page'] = arxiv_base + paper_number
-        paper['pdf'] = arxiv_base.replace('abs', 'pdf') + paper_number
-
-        paper['title'] = dd_list[i].find("div", {"class": "list-title mathjax"}).text.replace("Title: ", "").strip()
-        paper['authors'] = dd_list[i].find("div", {"class": "list-authors"}).text \
-                            .replace("Authors:\n", "").replace("\n", "").strip()
-        paper['subjects'] = dd_list[i].find("div", {"class": "list-subjects"}).text.replace("Subjects:\n", "").replace("Subjects: ", "").strip()
-        paper['abstract'] = dd_list[i].find("p", {"class": "mathjax"}).text.replace("\n", " ").strip()
-        new_paper_list.append(paper)
-
-
-    #  check if ./data exist, if not, create it
-    if not os.path.exists("./data"):
-        os.makedirs("./data")
-
-    # save new_paper_list to a jsonl file, with each line as the element of a dictionary
-    date = datetime.date.fromtimestamp(datetime.datetime.now(tz=pytz.timezone("America/New_York")).timestamp())
-    date = date.strftime("%a, %d %b %y")
-    with open(f"./data/{field_abbr}_{date}.jsonl", "w") as f:
-        for paper in new_paper_list:
-            f.write(json.dumps(paper) + "\n")
-
-
-def get_papers(field_abbr, limit=None):
-    date = datetime.date.fromtimestamp(datetime.datetime.now(tz=pytz.timezone("America/New_York")).timestamp())
-    date = date.strftime("%a, %d %b %y")
-    if not os.path.exists(f"./data/{field_abbr}_{date}.jsonl"):
-        _download_new_papers(field_abbr)
-    results = []
-    with open(f"./data/{field_abbr}_{date}.jsonl", "r") as f:
-        for i, line in enumerate(f.readlines()):
-            if limit and i == limit:
-                return results
-            results.append(json.loads(line))
-    return results
-
-
-def get_papers_from_multiple_topics(topic_abbreviations, limit=None):
+            unique[key] = dict(paper)
+    return list(unique.values()), len(papers) - len(unique)
+
+
+def get_papers_from_multiple_topics(topic_abbreviations, limit=None, max_workers=DEFAULT_MAX_WORKERS, parser="bs4"):
     """
     複数のトピックから論文を取得し、統合したリストを返す
     
+    各トピックのリスティングは共有セッション（コネクションプール）を使って並列に取得するため、
+    全体の所要時間はおおよそ最も遅いトピック1件分になる。
+    
     Args:
         topic_abbreviations: dict of {abbreviation: topic_name}
         limit: 各トピックあたりの論文数制限（Noneの場合は全件取得）
+        max_workers: 同時に取得するトピック数の上限（1なら逐次取得）
+        parser: リスティングのパーサ（"bs4" または "stream"）
     
     Returns:
-        全トピックの論文を統合したリスト
+        全トピックの論文を統合したリスト（topic_abbreviationsの順序を保持）
+        クロスリストされた論文はarXiv IDで重複除去される
     """
     all_papers = []
+    if not topic_abbreviations:
+        return all_papers
     
+    max_workers = max(1, min(max_workers, len(topic_abbreviations)))
     for abbr, topic_name in topic_abbreviations.items():
         print(f"Downloading papers from {topic_name} ({abbr})...")
-        papers = get_papers(abbr, limit=limit)
-        print(f"  Retrieved {len(papers)} papers from {topic_name}")
-        all_papers.extend(papers)
     
-    print(f"\nTotal papers retrieved: {len(all_papers)}")
+    cache = ListingCache()
+    store = PaperStore()
+    with store, create_session(pool_size=max_workers) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            abbr: executor.submit(
+                get_papers, abbr, limit=limit, session=session, parser=parser, cache=cache, store=store
+            )
+            for abbr in topic_abbreviations
+        }
+        for abbr, topic_name in topic_abbreviations.items():
+            papers = futures[abbr].result()
+            print(f"  Retrieved {len(papers)} papers from {topic_name}")
+            all_papers.extend(papers)
+    
+    all_papers, num_duplicates = dedupe_papers(all_papers)
+    print(f"\nCollapsed {num_duplicates} cross-listed duplicates")
+    print(f"Total papers retrieved: {len(all_papers)}")
     return all_papers
@@ -0,0 +1,103 @@
+"""
+arXivリスティングページのHTTPキャッシュ
+
+トピック毎に生のHTML・ETag/Last-Modified・内容ハッシュを保存し、
+条件付きGETで未更新ならダウンロードを省略する。内容ハッシュが前回と
+同じ場合は論文ストアにあるパース済みのリスティングを再利用し、
+HTMLのパース自体も省略する。
+"""
+import hashlib
+import json
+import os
+
+
+DEFAULT_CACHE_DIR = "./data/http_cache"
+
+
+def hash_page(page):
+    """ページ本文（bytes）のSHA-256ハッシュを返す"""
+    return hashlib.sha256(page).hexdigest()
+
+
+class ListingCache:
+    """
+    トピック毎のリスティングページを保存するキャッシュ
+
+    ファイル構成（field_abbr毎）:
+        {abbr}.html   : 最後に取得した生のHTML
+        {abbr}.json   : ETag / Last-Modified / 内容ハッシュ /
+                        パース済みハッシュとその結果を保存した論文ストア上の日付
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, field_abbr, ext):
+        return os.path.join(self.cache_dir, f"{field_abbr}.{ext}")
+
+    def _write_atomic(self, path, data, mode="wb"):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load_meta(self, field_abbr):
+        try:
+            with open(self._path(field_abbr, "json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, field_abbr, meta):
+        self._write_atomic(self._path(field_abbr, "json"), json.dumps(meta), mode="w")
+
+    def conditional_headers(self, field_abbr):
+        """
+        条件付きGET用のヘッダを返す（キャッシュ済みHTMLがない場合は空）
+        """
+        if not os.path.exists(self._path(field_abbr, "html")):
+            return {}
+        meta = self.load_meta(field_abbr)
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def load_page(self, field_abbr):
+        with open(self._path(field_abbr, "html"), "rb") as f:
+            return f.read()
+
+    def store_page(self, field_abbr, page, etag=None, last_modified=None):
+        """
+        取得したHTMLと検証用ヘッダを保存し、内容ハッシュを返す
+        """
+        content_hash = hash_page(page)
+        meta = self.load_meta(field_abbr)
+        self._write_atomic(self._path(field_abbr, "html"), page)
+        meta.update({"etag": etag, "last_modified": last_modified, "content_hash": content_hash})
+        self._save_meta(field_abbr, meta)
+        return content_hash
+
+    def content_hash(self, field_abbr):
+        return self.load_meta(field_abbr).get("content_hash")
+
+    def parsed_date(self, field_abbr, content_hash):
+        """
+        content_hashの内容をパースして論文ストアに保存した日付を返す（なければNone）
+        """
+        meta = self.load_meta(field_abbr)
+        if meta.get("parsed_hash") == content_hash:
+            return meta.get("parsed_date")
+        return None
+
+    def store_parsed(self, field_abbr, content_hash, date):
+        """
+        content_hashの内容をパースした結果を、論文ストアのdateに保存したことを記録する
+        """
+        meta = self.load_meta(field_abbr)
+        meta["parsed_hash"] = content_hash
+        meta["parsed_date"] = date
+        self._save_meta(field_abbr, meta)
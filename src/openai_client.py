@@ -0,0 +1,88 @@
+"""
+共有OpenAIクライアント
+
+OpenAIクライアントとその下のHTTP接続プールをプロセス内で1つだけ持ち、
+relevancy（utils.openai_completion）・summarizer・discord_pdf_bot から共有する。
+リクエストごとにクライアントを作るとTCP/TLS接続を毎回張り直すことになるため、
+keep-aliveの接続プールを使い回してリクエストあたりのオーバーヘッドを減らす。
+
+接続プールとタイムアウトは環境変数で調整できる:
+    OPENAI_MAX_CONNECTIONS      同時接続数の上限（既定: 16）
+    OPENAI_MAX_KEEPALIVE        保持するkeep-alive接続数（既定: 16）
+    OPENAI_KEEPALIVE_EXPIRY     keep-alive接続を保持する秒数（既定: 30）
+    OPENAI_TIMEOUT              リクエストのタイムアウト秒数（既定: 120）
+    OPENAI_CONNECT_TIMEOUT      接続確立のタイムアウト秒数（既定: 10）
+    OPENAI_BASE_URL             APIのベースURL（openaiライブラリが直接読む）
+"""
+import os
+import threading
+
+import httpx
+import openai
+from openai import OpenAI
+
+
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_MAX_KEEPALIVE = 16
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+
+_lock = threading.Lock()
+_http_client = None
+_clients = {}
+
+
+def _env_number(name, default, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
+def create_http_client():
+    """環境変数の設定で、keep-alive接続プール付きのhttpx.Clientを作る"""
+    limits = httpx.Limits(
+        max_connections=_env_number("OPENAI_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS, int),
+        max_keepalive_connections=_env_number("OPENAI_MAX_KEEPALIVE", DEFAULT_MAX_KEEPALIVE, int),
+        keepalive_expiry=_env_number("OPENAI_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY),
+    )
+    timeout = httpx.Timeout(
+        _env_number("OPENAI_TIMEOUT", DEFAULT_TIMEOUT),
+        connect=_env_number("OPENAI_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+    )
+    return httpx.Client(limits=limits, timeout=timeout)
+
+
+def get_client(api_key=None, max_retries=None):
+    """
+    共有のOpenAIクライアントを返す（スレッドセーフ）
+
+    APIキーごとにクライアントを1つ作り、HTTP接続プールは全クライアントで共有する。
+    app.pyのようにopenai.api_keyを実行中に差し替えても、新しいキーのクライアントが使われる。
+
+    Args:
+        api_key: APIキー（Noneの場合はopenai.api_key、次に環境変数OPENAI_API_KEY）
+        max_retries: SDK側のリトライ回数（Noneならopenaiライブラリの既定。rate_limitのガバナは
+            自分で再送するため0を指定する）
+    """
+    global _http_client
+    if api_key is None:
+        api_key = openai.api_key or os.getenv("OPENAI_API_KEY")
+    with _lock:
+        client = _clients.get((api_key, max_retries))
+        if client is None:
+            if _http_client is None:
+                _http_client = create_http_client()
+            options = {} if max_retries is None else {"max_retries": max_retries}
+            client = OpenAI(api_key=api_key, http_client=_http_client, timeout=_http_client.timeout, **options)
+            _clients[api_key, max_retries] = client
+        return client
+
+
+def close_client():
+    """共有のHTTP接続プールを閉じる（次のget_clientで作り直される）"""
+    global _http_client
+    with _lock:
+        _clients.clear()
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
@@ -0,0 +1,287 @@
+"""
+論文アーカイブ（圧縮・メモリマップ形式）
+
+溜まった古いリスティングを1つのセグメントファイルにまとめる。
+各レコードはファイル内で学習した共有辞書（zdict）付きのzlibで個別に圧縮し、
+arXiv ID順のオフセットインデックスに日付・トピック・カテゴリコードを
+非圧縮で持たせる。ファイルはmmapで開き、
+
+  - arXiv IDでのランダムアクセス: インデックスを二分探索し、該当レコードだけ展開
+  - 日付・トピック・カテゴリでの走査: インデックスだけで絞り込み、該当レコードだけ展開
+
+となるため、関係のないレコードを展開・パースしない。
+
+古いデータのコンパクション:
+    python src/paper_archive.py compact --jsonl ./data ./src/data --out ./data/archive/2025-10.pda
+    python src/paper_archive.py compact --before 2025-10-01 --out ./data/archive/until-2025-09.pda
+"""
+import argparse
+import bisect
+import datetime
+import glob
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from paper_store import DEFAULT_DB_PATH, LEGACY_DATE_FORMAT, PaperStore, arxiv_id_from_url
+from subjects import attach_subjects, parse_subjects
+
+
+MAGIC = b"ADARCH01"
+
+# インデックス1件: arXiv ID, 日付(序数), レコード位置, レコード長, コード位置, コード長, トピック番号
+_ENTRY = struct.Struct("<16sIQIIHH")
+# フッタ: zdict, コード列, トピック表, インデックスの (位置, 長さ/件数), MAGIC
+_FOOTER = struct.Struct("<QIQIQIQI8s")
+
+# 共有辞書の学習に使う先頭レコード数と辞書サイズ
+_ZDICT_SAMPLE = 256
+_ZDICT_SIZE = 32 * 1024
+
+_RECORD_KEYS = ("main_page", "pdf", "title", "authors", "subjects", "abstract")
+
+
+def _encode_record(paper):
+    return json.dumps({key: paper[key] for key in _RECORD_KEYS}, ensure_ascii=False).encode("utf-8")
+
+
+def _train_zdict(sample):
+    """サンプルのレコードから共有辞書を作る（zlibは辞書の末尾ほど優先するため後ろを残す）"""
+    data = b"".join(_encode_record(paper) for paper in sample)
+    return data[-_ZDICT_SIZE:]
+
+
+def write_archive(path, papers):
+    """
+    論文を1つのアーカイブセグメントに書き出す
+
+    Args:
+        path: 出力ファイル
+        papers: 論文dictのイテラブル（"date"（ISO形式）と "topic" を含むこと）。
+                同じarXiv IDは最初の1件だけを保存する。
+
+    Returns:
+        保存した論文数
+    """
+    papers = iter(papers)
+    sample = []
+    for paper in papers:
+        sample.append(paper)
+        if len(sample) >= _ZDICT_SAMPLE:
+            break
+    zdict = _train_zdict(sample)
+
+    topics = []
+    topic_index = {}
+    codes_blob = bytearray()
+    entries = {}
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+
+        def write_record(paper):
+            arxiv_id = arxiv_id_from_url(paper["main_page"])
+            if arxiv_id in entries:
+                return
+            encoded_id = arxiv_id.encode("ascii")
+            if len(encoded_id) > 16:
+                raise ValueError(f"arXiv ID too long for archive index: {arxiv_id}")
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+            blob = compressor.compress(_encode_record(paper)) + compressor.flush()
+            offset = f.tell()
+            f.write(blob)
+
+            topic = paper["topic"]
+            if topic not in topic_index:
+                topic_index[topic] = len(topics)
+                topics.append(topic)
+            codes = " ".join(sorted(parse_subjects(paper["subjects"]).codes)).encode("ascii")
+            codes_offset = len(codes_blob)
+            codes_blob.extend(codes)
+            date = datetime.date.fromisoformat(paper["date"]).toordinal()
+            entries[arxiv_id] = (encoded_id, date, offset, len(blob), codes_offset, len(codes), topic_index[topic])
+
+        for paper in sample:
+            write_record(paper)
+        for paper in papers:
+            write_record(paper)
+
+        zdict_offset = f.tell()
+        f.write(zdict)
+        codes_offset = f.tell()
+        f.write(codes_blob)
+        topics_blob = json.dumps(topics).encode("utf-8")
+        topics_offset = f.tell()
+        f.write(topics_blob)
+        index_offset = f.tell()
+        for arxiv_id in sorted(entries):
+            f.write(_ENTRY.pack(*entries[arxiv_id]))
+        f.write(_FOOTER.pack(
+            zdict_offset, len(zdict),
+            codes_offset, len(codes_blob),
+            topics_offset, len(topics_blob),
+            index_offset, len(entries),
+            MAGIC,
+        ))
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+class PaperArchive:
+    """
+    アーカイブセグメントをmmapで開いて読むリーダ
+
+    インデックスはファイル上の固定長エントリをその都度unpackするため、
+    開くコストは件数に依存しない。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a paper archive: {path}")
+        (zdict_offset, zdict_len, self._codes_offset, _, topics_offset, topics_len,
+         self._index_offset, self._count, magic) = _FOOTER.unpack_from(self._mm, len(self._mm) - _FOOTER.size)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Corrupted paper archive footer: {path}")
+        self._zdict = self._mm[zdict_offset:zdict_offset + zdict_len]
+        self.topics = json.loads(self._mm[topics_offset:topics_offset + topics_len])
+
+    def close(self):
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._mm, self._index_offset + i * _ENTRY.size)
+
+    def _entry_id(self, i):
+        return self._entry(i)[0].rstrip(b"\0").decode("ascii")
+
+    def _codes(self, entry):
+        start = self._codes_offset + entry[4]
+        return frozenset(self._mm[start:start + entry[5]].decode("ascii").split())
+
+    def _load(self, entry, fields=None):
+        decompressor = zlib.decompressobj(-15, zdict=self._zdict)
+        record = json.loads(decompressor.decompress(self._mm[entry[2]:entry[2] + entry[3]]))
+        record["date"] = datetime.date.fromordinal(entry[1]).isoformat()
+        record["topic"] = self.topics[entry[6]]
+        if fields:
+            record = {key: record[key] for key in fields}
+        if "subjects" in record:
+            attach_subjects(record)
+        return record
+
+    def get(self, arxiv_id, fields=None):
+        """arXiv IDでレコードを1件返す（なければNone）"""
+        ids = _IndexIds(self)
+        i = bisect.bisect_left(ids, arxiv_id)
+        if i < self._count and ids[i] == arxiv_id:
+            return self._load(self._entry(i), fields)
+        return None
+
+    def scan(self, date_from=None, date_to=None, topic=None, codes=None, fields=None):
+        """
+        条件に合うレコードを順にyieldする（条件はインデックスだけで判定する）
+
+        Args:
+            date_from / date_to: ISO形式の日付の範囲（両端を含む）
+            topic: トピックの略称
+            codes: カテゴリコード（例: {"cs.LG", "eess.AS"}）のいずれかを含むもの
+            fields: 返すキーのリスト（Noneなら全キー）
+        """
+        lo = datetime.date.fromisoformat(date_from).toordinal() if date_from else None
+        hi = datetime.date.fromisoformat(date_to).toordinal() if date_to else None
+        topic_idx = self.topics.index(topic) if topic in self.topics else None
+        if topic is not None and topic_idx is None:
+            return
+        codes = frozenset(codes) if codes else None
+        for i in range(self._count):
+            entry = self._entry(i)
+            if lo is not None and entry[1] < lo:
+                continue
+            if hi is not None and entry[1] > hi:
+                continue
+            if topic_idx is not None and entry[6] != topic_idx:
+                continue
+            if codes is not None and codes.isdisjoint(self._codes(entry)):
+                continue
+            yield self._load(entry, fields)
+
+
+class _IndexIds:
+    """bisect用に、インデックスのarXiv IDを遅延で読むシーケンス"""
+
+    def __init__(self, archive):
+        self._archive = archive
+
+    def __len__(self):
+        return len(self._archive)
+
+    def __getitem__(self, i):
+        return self._archive._entry_id(i)
+
+
+def iter_jsonl_papers(paths):
+    """旧形式の {topic}_{date}.jsonl から、date・topic付きの論文を順に読む"""
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        topic, _, file_date = name.partition("_")
+        date = datetime.datetime.strptime(file_date, LEGACY_DATE_FORMAT).date().isoformat()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    paper = json.loads(line)
+                    paper["date"] = date
+                    paper["topic"] = topic
+                    yield paper
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="compact old listings into an archive segment")
+    compact_parser.add_argument("--out", required=True, help="出力するアーカイブファイル")
+    compact_parser.add_argument("--jsonl", nargs="+", help="旧形式JSONLのディレクトリ（指定しない場合は論文ストアから）")
+    compact_parser.add_argument("--before", help="論文ストアからこの日付（ISO形式）より前のリスティングを移す")
+    compact_parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    compact_parser.add_argument("--delete", action="store_true", help="アーカイブ後に元のデータを削除する")
+    args = parser.parse_args()
+
+    if args.jsonl:
+        paths = sorted(p for d in args.jsonl for p in glob.glob(os.path.join(d, "*_*.jsonl")))
+        count = write_archive(args.out, iter_jsonl_papers(paths))
+        print(f"Archived {count} papers from {len(paths)} JSONL files into {args.out}")
+        if args.delete:
+            for path in paths:
+                os.remove(path)
+            print(f"Deleted {len(paths)} JSONL files")
+    else:
+        if not args.before:
+            parser.error("--before is required when compacting from the paper store")
+        with PaperStore(args.db) as store:
+            count = write_archive(args.out, store.iter_listed_papers(before=args.before))
+            print(f"Archived {count} papers listed before {args.before} into {args.out}")
+            if args.delete:
+                removed = store.delete_listings_before(args.before)
+                print(f"Removed {removed} papers from {args.db}")
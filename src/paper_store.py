@@ -0,0 +1,417 @@
+"""
+論文ストア（SQLite）
+
+arXiv IDをキーに論文を1件ずつ保存し、日付・トピック・サブジェクト・IDで
+インデックス検索できるようにする。日毎・トピック毎のJSONLファイルを
+毎回読み直す代わりに使用する。
+
+既存の data/*.jsonl の取り込み:
+    python src/paper_store.py import ./data ./src/data
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import sqlite3
+import threading
+
+import pytz
+
+from subjects import attach_subjects, parse_subjects
+
+
+DEFAULT_DB_PATH = "./data/papers.sqlite"
+
+# 旧JSONLファイル名の日付形式（例: "Wed, 22 Oct 25"）
+LEGACY_DATE_FORMAT = "%a, %d %b %y"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    arxiv_id  TEXT PRIMARY KEY,
+    date      TEXT NOT NULL,
+    topic     TEXT NOT NULL,
+    title     TEXT NOT NULL,
+    authors   TEXT NOT NULL,
+    abstract  TEXT NOT NULL,
+    subjects  TEXT NOT NULL,
+    main_page TEXT NOT NULL,
+    pdf       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_papers_date ON papers(date);
+
+CREATE TABLE IF NOT EXISTS paper_subjects (
+    arxiv_id TEXT NOT NULL,
+    subject  TEXT NOT NULL,
+    PRIMARY KEY (arxiv_id, subject)
+);
+CREATE INDEX IF NOT EXISTS idx_paper_subjects_subject ON paper_subjects(subject);
+
+CREATE TABLE IF NOT EXISTS listings (
+    date     TEXT NOT NULL,
+    topic    TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    arxiv_id TEXT NOT NULL,
+    PRIMARY KEY (date, topic, position)
+);
+CREATE INDEX IF NOT EXISTS idx_listings_arxiv_id ON listings(arxiv_id);
+
+CREATE TABLE IF NOT EXISTS fetches (
+    date       TEXT NOT NULL,
+    topic      TEXT NOT NULL,
+    num_papers INTEGER NOT NULL,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (date, topic)
+);
+"""
+
+_PAPER_COLUMNS = ("main_page", "pdf", "title", "authors", "subjects", "abstract")
+
+# iter_listingでカーソルから一度に取り出す行数
+_FETCH_SIZE = 64
+
+
+def today_et():
+    """arXivの基準である米国東部時間での今日の日付（ISO形式）"""
+    now = datetime.datetime.now(tz=pytz.timezone("America/New_York"))
+    return now.date().isoformat()
+
+
+def arxiv_id_from_url(url):
+    """論文ページURLからarXiv ID（例: 2510.17814）を返す（IDのないURLなら空文字列）"""
+    path = url.rstrip('/')
+    if path.endswith(("/abs", "/pdf")) or "/" not in path:
+        return ""
+    return path.split('/')[-1]
+
+
+class PaperStore:
+    """
+    arXiv IDをキーにした論文ストア
+
+    papers         : 論文本体（最初に掲載された日付・トピックを保持）
+    paper_subjects : 論文毎のサブジェクト名（サブジェクトでの検索用）
+    listings       : 日付・トピック毎の掲載順
+    fetches        : 取得済みの日付・トピック（リスティングが揃っているかの判定用）
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # ThreadPoolExecutorでの並列取得から共有するため、ロックで直列化する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _row_to_paper(row, fields=_PAPER_COLUMNS):
+        paper = {key: row[key] for key in fields}
+        if "subjects" in paper:
+            attach_subjects(paper)
+        return paper
+
+    def _insert_papers(self, papers, topic, date):
+        self._conn.executemany(
+            "INSERT INTO papers (arxiv_id, date, topic, title, authors, abstract, subjects, main_page, pdf) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(arxiv_id) DO UPDATE SET "
+            "title=excluded.title, authors=excluded.authors, abstract=excluded.abstract, subjects=excluded.subjects",
+            [
+                (arxiv_id_from_url(p["main_page"]), date, topic, p["title"], p["authors"],
+                 p["abstract"], p["subjects"], p["main_page"], p["pdf"])
+                for p in papers
+            ],
+        )
+        # 再掲載でサブジェクトが変わった場合に古いサブジェクトが残らないよう、入れ直す
+        self._conn.executemany(
+            "DELETE FROM paper_subjects WHERE arxiv_id = ?",
+            [(arxiv_id_from_url(p["main_page"]),) for p in papers],
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO paper_subjects (arxiv_id, subject) VALUES (?, ?)",
+            [
+                (arxiv_id_from_url(p["main_page"]), subject)
+                for p in papers
+                for subject in parse_subjects(p["subjects"]).names
+            ],
+        )
+
+    def add_listing(self, topic, date, papers):
+        """
+        1日分・1トピック分のリスティングを保存する（同じ日付・トピックは置き換え）
+
+        Args:
+            topic: トピックの略称（例: "cs"）
+            date: ISO形式の日付（例: "2025-10-22"）
+            papers: 論文dictのリスト（掲載順）
+        """
+        with self._lock, self._conn:
+            self._insert_papers(papers, topic, date)
+            self._conn.execute("DELETE FROM listings WHERE date = ? AND topic = ?", (date, topic))
+            self._conn.executemany(
+                "INSERT INTO listings (date, topic, position, arxiv_id) VALUES (?, ?, ?, ?)",
+                [(date, topic, i, arxiv_id_from_url(p["main_page"])) for i, p in enumerate(papers)],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fetches (date, topic, num_papers, fetched_at) VALUES (?, ?, ?, ?)",
+                (date, topic, len(papers), datetime.datetime.utcnow().isoformat()),
+            )
+
+    def append_papers(self, topic, papers):
+        """
+        論文を各自の日付（paper["date"]）のリスティング末尾に追加する（バックフィル用）
+
+        すでに同じ日付・トピックに掲載済みの論文は追加しないため、
+        同じチャンクを再投入しても結果は変わらない。取得済み（fetches）には記録しない。
+
+        Returns:
+            新たにリスティングへ追加した論文数
+        """
+        with self._lock, self._conn:
+            for date in sorted({p["date"] for p in papers}):
+                self._insert_papers([p for p in papers if p["date"] == date], topic, date)
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT INTO listings (date, topic, position, arxiv_id) "
+                "SELECT ?1, ?2, (SELECT COALESCE(MAX(position), -1) + 1 FROM listings WHERE date = ?1 AND topic = ?2), ?3 "
+                "WHERE NOT EXISTS (SELECT 1 FROM listings WHERE date = ?1 AND topic = ?2 AND arxiv_id = ?3)",
+                [(p["date"], topic, arxiv_id_from_url(p["main_page"])) for p in papers],
+            )
+            return self._conn.total_changes - before
+
+    def copy_listing(self, topic, src_date, dst_date):
+        """
+        既存のリスティングを別の日付に複製する（内容が変わっていない場合の再利用）
+
+        Returns:
+            複製できた場合はTrue（src_dateのリスティングがなければFalse）
+        """
+        if not self.has_listing(topic, src_date):
+            return False
+        if src_date == dst_date:
+            return True
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM listings WHERE date = ? AND topic = ?", (dst_date, topic))
+            self._conn.execute(
+                "INSERT INTO listings (date, topic, position, arxiv_id) "
+                "SELECT ?, topic, position, arxiv_id FROM listings WHERE date = ? AND topic = ?",
+                (dst_date, src_date, topic),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fetches (date, topic, num_papers, fetched_at) "
+                "SELECT ?, topic, num_papers, ? FROM fetches WHERE date = ? AND topic = ?",
+                (dst_date, datetime.datetime.utcnow().isoformat(), src_date, topic),
+            )
+        return True
+
+    def has_listing(self, topic, date):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM fetches WHERE date = ? AND topic = ?", (date, topic)
+            ).fetchone()
+        return row is not None
+
+    def has_listings_on(self, date):
+        """指定日のリスティングがいずれかのトピックで保存されているか"""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM listings WHERE date = ? LIMIT 1", (date,)).fetchone()
+        return row is not None
+
+    def iter_listing(self, topic, date, limit=None, fields=None):
+        """
+        日付・トピックのリスティングを掲載順に1件ずつyieldする
+
+        カーソルから少しずつ読み出すため、全件をメモリに載せない。
+        途中でイテレーションを止めれば残りの行は読まれない。
+
+        Args:
+            topic: トピックの略称
+            date: ISO形式の日付
+            limit: 返す論文数の上限
+            fields: 返すキーのリスト（例: ["title", "abstract", "subjects"]、Noneなら全キー）
+        """
+        fields = tuple(fields) if fields else _PAPER_COLUMNS
+        unknown = set(fields) - set(_PAPER_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown paper fields: {sorted(unknown)}")
+        query = (
+            "SELECT %s FROM listings l JOIN papers p ON p.arxiv_id = l.arxiv_id "
+            "WHERE l.date = ? AND l.topic = ? ORDER BY l.position"
+        ) % ", ".join("p." + field for field in fields)
+        params = [date, topic]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            cursor = self._conn.execute(query, params)
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(_FETCH_SIZE)
+                if not rows:
+                    return
+                for row in rows:
+                    yield self._row_to_paper(row, fields)
+        finally:
+            with self._lock:
+                cursor.close()
+
+    def get_listing(self, topic, date, limit=None, fields=None):
+        """日付・トピックのリスティングを掲載順のリストで返す"""
+        return list(self.iter_listing(topic, date, limit=limit, fields=fields))
+
+    def get_paper(self, arxiv_id):
+        """arXiv IDで論文を1件返す（なければNone）"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM papers WHERE arxiv_id = ?", (arxiv_id,)).fetchone()
+        return self._row_to_paper(row) if row else None
+
+    def get_papers_by_date(self, date, subjects=None):
+        """
+        指定日に掲載された論文を返す（全トピック、arXiv IDで重複なし）
+
+        Args:
+            date: ISO形式の日付
+            subjects: サブジェクト名のリスト（指定した場合はいずれかに該当する論文のみ）
+        """
+        query = (
+            "SELECT p.* FROM papers p WHERE p.arxiv_id IN "
+            "(SELECT arxiv_id FROM listings WHERE date = ?)"
+        )
+        params = [date]
+        if subjects:
+            query += (
+                " AND p.arxiv_id IN (SELECT arxiv_id FROM paper_subjects WHERE subject IN (%s))"
+                % ",".join("?" * len(subjects))
+            )
+            params.extend(subjects)
+        query += " ORDER BY p.arxiv_id"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_paper(row) for row in rows]
+
+    def get_papers_by_subject(self, subject, since=None):
+        """サブジェクト名に該当する論文を返す（sinceはISO形式の日付の下限）"""
+        query = (
+            "SELECT p.* FROM paper_subjects s JOIN papers p ON p.arxiv_id = s.arxiv_id "
+            "WHERE s.subject = ?"
+        )
+        params = [subject]
+        if since:
+            query += " AND p.date >= ?"
+            params.append(since)
+        query += " ORDER BY p.date, p.arxiv_id"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_paper(row) for row in rows]
+
+    def iter_listed_papers(self, before):
+        """
+        指定日より前に掲載された論文を、掲載日・トピック付きで日付順にyieldする（アーカイブ用）
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT p.*, l.date AS listed_date, l.topic AS listed_topic "
+                "FROM listings l JOIN papers p ON p.arxiv_id = l.arxiv_id "
+                "WHERE l.date < ? ORDER BY l.date, l.topic, l.position",
+                (before,),
+            )
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(_FETCH_SIZE)
+                if not rows:
+                    return
+                for row in rows:
+                    paper = self._row_to_paper(row)
+                    paper["date"] = row["listed_date"]
+                    paper["topic"] = row["listed_topic"]
+                    yield paper
+        finally:
+            with self._lock:
+                cursor.close()
+
+    def delete_listings_before(self, before):
+        """
+        指定日より前のリスティングを削除し、どのリスティングからも参照されなくなった論文も削除する
+
+        Returns:
+            削除した論文数
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM listings WHERE date < ?", (before,))
+                self._conn.execute("DELETE FROM fetches WHERE date < ?", (before,))
+                removed = self._conn.execute(
+                    "DELETE FROM papers WHERE arxiv_id NOT IN (SELECT arxiv_id FROM listings)"
+                ).rowcount
+                self._conn.execute(
+                    "DELETE FROM paper_subjects WHERE arxiv_id NOT IN (SELECT arxiv_id FROM papers)"
+                )
+            self._conn.execute("VACUUM")
+        return removed
+
+    def import_jsonl(self, path, topic=None, date=None):
+        """
+        旧形式のJSONLファイル（{topic}_{date}.jsonl）を取り込む
+
+        IDを取り出せない論文（古いパーサで main_page が "https://arxiv.org/abs/" になったものなど）は
+        1行にまとまってしまうため取り込まない。
+
+        Returns:
+            取り込んだ論文数
+        """
+        if topic is None or date is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+            file_topic, _, file_date = name.partition("_")
+            topic = topic or file_topic
+            date = date or datetime.datetime.strptime(file_date, LEGACY_DATE_FORMAT).date().isoformat()
+        with open(path, "r", encoding="utf-8") as f:
+            papers = [json.loads(line) for line in f if line.strip()]
+        valid = [p for p in papers if arxiv_id_from_url(p.get("main_page", ""))]
+        if len(valid) < len(papers):
+            print(f"  Skipped {len(papers) - len(valid)} papers without an arXiv ID in {path}")
+        if not valid:
+            return 0
+        self.add_listing(topic, date, valid)
+        return len(valid)
+
+    def import_jsonl_dir(self, data_dir):
+        """ディレクトリ内の旧形式JSONLファイルをすべて取り込む"""
+        total = 0
+        for path in sorted(glob.glob(os.path.join(data_dir, "*_*.jsonl"))):
+            try:
+                count = self.import_jsonl(path)
+            except ValueError as e:
+                print(f"  Skipped {path}: {e}")
+                continue
+            print(f"  Imported {count} papers from {path}")
+            total += count
+        return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="import legacy data/*.jsonl files")
+    import_parser.add_argument("dirs", nargs="+", help="directories containing {topic}_{date}.jsonl")
+    import_parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    args = parser.parse_args()
+
+    with PaperStore(args.db) as store:
+        total = sum(store.import_jsonl_dir(d) for d in args.dirs)
+    print(f"Imported {total} papers into {args.db}")
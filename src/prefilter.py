@@ -0,0 +1,187 @@
+"""
+LLM評価前の語彙ベースの事前フィルタ（BM25、NumPyでベクトル化）
+
+カテゴリで絞り込んだその日の論文（タイトル＋アブストラクト）を、config.yaml の
+interest をクエリとしてBM25でランク付けし、上位N件（またはスコアが下限以上のもの）
+だけをgenerate_relevance_scoreに渡す。明らかに関心と無関係な論文をLLMに送らないため、
+1回の実行あたりのトークン消費が減る。
+
+BM25は否定（"Lower Priority" の項目など）を扱えないため、最終的な判定は従来どおりLLMが行う。
+カットオフはスコアキャッシュに残っているLLMのスコアに対する再現率を見て調整する:
+    python src/prefilter.py recall --date 2025-10-22
+"""
+import argparse
+import re
+
+import numpy as np
+
+from paper_store import DEFAULT_DB_PATH, PaperStore, today_et
+
+
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+# 関心領域の記述に頻出するが、論文の内容を区別しない語
+_STOPWORDS = frozenset("""
+a an and are as at be by e eg etc for from g in into is it its of on or our over that the their this to
+via vs we with without based using use new novel paper papers method methods approach approaches result results
+high low priority general criteria prefer preferred area areas including include
+""".split())
+
+
+def tokenize(text):
+    """小文字化して英数字の語に分割し、ストップワードを除いて末尾の複数形の "s" を落とす"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if len(token) < 2 or token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def paper_text(paper):
+    return paper["title"] + " " + paper["abstract"]
+
+
+def bm25_scores(query, documents, k1=DEFAULT_K1, b=DEFAULT_B):
+    """
+    クエリに対する各文書のBM25スコアを返す
+
+    語彙はクエリに現れる語だけに絞り、(文書数 × クエリ語数) の出現回数行列を
+    bincountで一度に作ってからスコアを行列演算で計算する。
+
+    Args:
+        query: クエリのテキスト
+        documents: 文書テキストのリスト
+
+    Returns:
+        文書ごとのスコア（np.ndarray, shape=(len(documents),)）
+    """
+    vocabulary = {term: i for i, term in enumerate(dict.fromkeys(tokenize(query)))}
+    num_docs, num_terms = len(documents), len(vocabulary)
+    if num_docs == 0 or num_terms == 0:
+        return np.zeros(num_docs)
+
+    doc_lengths = np.empty(num_docs)
+    flat_ids = []
+    for doc_idx, document in enumerate(documents):
+        tokens = tokenize(document)
+        doc_lengths[doc_idx] = len(tokens)
+        offset = doc_idx * num_terms
+        flat_ids.extend(offset + vocabulary[t] for t in tokens if t in vocabulary)
+    tf = np.bincount(np.asarray(flat_ids, dtype=np.int64), minlength=num_docs * num_terms)
+    tf = tf.reshape(num_docs, num_terms).astype(np.float64)
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((num_docs - df + 0.5) / (df + 0.5))
+    avgdl = doc_lengths.mean() or 1.0
+    norm = k1 * (1.0 - b + b * doc_lengths / avgdl)
+    return (tf * (k1 + 1.0) / (tf + norm[:, None])) @ idf
+
+
+def select_indices(scores, top_n=None, min_score=None):
+    """
+    スコアの上位top_n件かつmin_score以上の位置を、元の順序で返す
+
+    top_n・min_scoreのどちらもNoneなら全件を返す
+    """
+    keep = np.ones(len(scores), dtype=bool)
+    if min_score is not None:
+        keep &= scores >= min_score
+    if top_n is not None and top_n < len(scores):
+        top = np.zeros(len(scores), dtype=bool)
+        top[np.argsort(-scores, kind="stable")[:top_n]] = True
+        keep &= top
+    return np.flatnonzero(keep)
+
+
+def prefilter_papers(papers, interest, top_n=None, min_score=None):
+    """
+    interestに対するBM25スコアで論文を絞り込む
+
+    Returns:
+        (残った論文のリスト（元の順序）, 全論文のスコア)
+    """
+    scores = bm25_scores(interest, [paper_text(p) for p in papers])
+    return [papers[i] for i in select_indices(scores, top_n, min_score)], scores
+
+
+def recall_at_cutoffs(scores, relevant, cutoffs):
+    """
+    カットオフ（上位N件）ごとに、LLMが閾値以上と判定した論文のうち事前フィルタを通る割合を返す
+
+    Args:
+        scores: BM25スコア
+        relevant: 論文ごとのbool（LLMのスコアが閾値以上か）
+        cutoffs: 上位N件のNのリスト
+
+    Returns:
+        [(N, 再現率), ...]（閾値以上の論文がない場合の再現率はNone）
+    """
+    relevant = np.asarray(relevant, dtype=bool)
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    total = relevant.sum()
+    found = np.cumsum(relevant[order])
+    results = []
+    for n in cutoffs:
+        n = min(n, len(order))
+        results.append((n, float(found[n - 1] / total) if total and n else None))
+    return results
+
+
+if __name__ == "__main__":
+    import yaml
+
+    from relevancy import cache_context, item_score
+    from score_cache import DEFAULT_SCORE_CACHE_PATH, ScoreCache
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    recall_parser = subparsers.add_parser("recall", help="report prefilter recall against cached LLM scores")
+    recall_parser.add_argument("--date", default=None, help="評価する日付（ISO形式、既定は今日）")
+    recall_parser.add_argument("--config", default="config.yaml")
+    recall_parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    recall_parser.add_argument("--score-cache", default=DEFAULT_SCORE_CACHE_PATH)
+    recall_parser.add_argument("--cutoffs", type=int, nargs="+", default=[25, 50, 100, 150, 200, 300])
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    date = args.date or today_et()
+    with PaperStore(args.db) as store:
+        if not store.has_listings_on(date):
+            raise SystemExit(f"No listings for {date} in {args.db}; run action.py for that date first")
+        papers = store.get_papers_by_date(date, subjects=config["categories"])
+    # action.pyの評価と同じキー（モデル・指示文）でキャッシュを引く
+    evaluation_model = config.get("evaluation_model", "gpt-4o-mini")
+    triage_model = config.get("triage_model")
+    structured_output = config.get("structured_output", False)
+    phase = "score" if config.get("two_phase_scoring", False) else None
+    # 評価のための参照でキャッシュの追い出し順（used_at）を変えない
+    with ScoreCache(args.score_cache) as cache:
+        cached = cache.peek_many(papers, cache_context(config["interest"], evaluation_model, structured_output, phase))
+        if triage_model and triage_model != evaluation_model:
+            # カスケード評価では、境界の論文以外はトリアージのスコアで判定される
+            triaged = cache.peek_many(papers, cache_context(config["interest"], triage_model, structured_output, phase))
+            cached = [inst if inst is not None else triage for inst, triage in zip(cached, triaged)]
+
+    num_labeled = sum(inst is not None for inst in cached)
+    print(f"{date}: {len(papers)} papers in categories, {num_labeled} with cached LLM scores, "
+          f"{len(papers) - num_labeled} unlabeled")
+    if not num_labeled:
+        raise SystemExit("No cached scores for this date; run action.py with score_cache: true first")
+    if num_labeled < len(papers):
+        # 前回の実行でprefilter_top_nなどにより評価されなかった論文。順位には含め、再現率の分母には含めない
+        print("Unlabeled papers are ranked but not counted as relevant; recall covers the labeled papers only")
+
+    # action.pyと同じく、カテゴリで絞り込んだ全論文に対してBM25で順位を付ける
+    scores = bm25_scores(config["interest"], [paper_text(paper) for paper in papers])
+    relevant = [inst is not None and item_score(inst) >= config["threshold"] for inst in cached]
+    print(f"{sum(relevant)} papers scored >= {config['threshold']} by the LLM")
+    print(f"{'top_n':>6} {'kept':>6} {'recall':>7}")
+    for n, recall in recall_at_cutoffs(scores, relevant, args.cutoffs):
+        print(f"{n:>6} {n / len(papers):>6.0%} {'-' if recall is None else f'{recall:.0%}':>7}")
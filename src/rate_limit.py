@@ -0,0 +1,292 @@
+"""
+OpenAIのレート制限ガバナ
+
+固定のsleepで間隔を空ける代わりに、応答ヘッダのレート制限情報に合わせて送信を調整する。
+モデルごとに1つのガバナをプロセス内で共有し（制限はモデル単位）、relevancy・summarizer・
+discord_pdf_bot の全リクエストが送信前にacquireで許可を得る。
+
+    x-ratelimit-remaining-requests / x-ratelimit-reset-requests   RPMの残りとリセットまでの時間
+    x-ratelimit-remaining-tokens   / x-ratelimit-reset-tokens     TPMの残りとリセットまでの時間
+    retry-after-ms / retry-after                                  429・5xxのときに待つ時間
+
+残りがない（送信中のリクエストの分を含めて）ときはリセットまで待ち、429・5xx・接続エラーでは
+Retry-Afterに従うか、指数バックオフ（ジッタ付き）でモデルの全リクエストを止めてから再送する。
+SDK側のリトライ（max_retries）はガバナと二重にならないよう0にしたクライアントを使う。
+各リクエストのトークン数・応答時間・再送回数は usage_ledger に記録する。
+
+バックオフは環境変数で調整できる:
+    OPENAI_MAX_RETRIES        再送の最大回数（既定: 6）
+    OPENAI_BACKOFF_BASE       バックオフの初期値（秒、既定: 1）
+    OPENAI_BACKOFF_MAX        バックオフの上限（秒、既定: 60）
+"""
+import email.utils
+import os
+import random
+import re
+import threading
+import time
+
+import openai
+
+import usage_ledger
+from openai_client import get_client
+
+
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 60.0
+
+# リセット時間がヘッダにない場合に仮定する秒数
+_DEFAULT_RESET = 1.0
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+_lock = threading.Lock()
+_governors = {}
+
+
+def _env_number(name, default, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
+def parse_duration(value):
+    """"6m0s"・"1.5s"・"20ms" などのリセット時間を秒に変換する（解釈できなければNone）"""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers):
+    """retry-after-ms または retry-after（秒数かHTTP日付）を秒に変換する（なければNone）"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+def estimate_request_tokens(messages, max_tokens=None):
+    """TPMに数えられるトークン数の概算（入力は4文字で1トークン、出力はmax_tokensまで）"""
+    num_chars = sum(len(message.get("content") or "") for message in messages)
+    return num_chars // 4 + (max_tokens or 0)
+
+
+class RateLimitGovernor:
+    """
+    1つのモデルのRPM・TPMの残りを追跡し、送信の許可を出す（スレッドセーフ）
+
+    waits / waited_seconds に、許可を待った回数と合計時間を数える。
+    """
+
+    def __init__(self, backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX):
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+        self.blocked_until = 0.0
+        self.in_flight_requests = 0
+        self.in_flight_tokens = 0
+        self.waits = 0
+        self.waited_seconds = 0.0
+        self._cond = threading.Condition()
+
+    def _wait_time(self, tokens, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        # 最後の応答の後に送ったリクエストの分も残りから差し引く
+        if (self.remaining_requests is not None and now < self.requests_reset_at
+                and self.remaining_requests - self.in_flight_requests <= 0):
+            return self.requests_reset_at - now
+        if (self.remaining_tokens is not None and now < self.tokens_reset_at
+                and self.remaining_tokens - self.in_flight_tokens < tokens):
+            return self.tokens_reset_at - now
+        return 0.0
+
+    def acquire(self, tokens=0):
+        """送信の許可を得る（残りがなければリセットまで待つ）。送信後は必ずreleaseを呼ぶ"""
+        with self._cond:
+            start = time.monotonic()
+            waited = False
+            while True:
+                wait = self._wait_time(tokens, time.monotonic())
+                if wait <= 0:
+                    break
+                waited = True
+                self._cond.wait(wait)
+            if waited:
+                self.waits += 1
+                self.waited_seconds += time.monotonic() - start
+            self.in_flight_requests += 1
+            self.in_flight_tokens += tokens
+
+    def release(self, tokens=0, headers=None):
+        """acquireした送信が終わったことを伝え、応答ヘッダがあれば残りを更新する"""
+        with self._cond:
+            self.in_flight_requests -= 1
+            self.in_flight_tokens -= tokens
+            if headers is not None:
+                self._update(headers, time.monotonic())
+            self._cond.notify_all()
+
+    def _update(self, headers, now):
+        self.remaining_requests, self.requests_reset_at = self._merge(
+            self.remaining_requests, self.requests_reset_at, now,
+            headers.get("x-ratelimit-remaining-requests"), headers.get("x-ratelimit-reset-requests"),
+        )
+        self.remaining_tokens, self.tokens_reset_at = self._merge(
+            self.remaining_tokens, self.tokens_reset_at, now,
+            headers.get("x-ratelimit-remaining-tokens"), headers.get("x-ratelimit-reset-tokens"),
+        )
+
+    @staticmethod
+    def _merge(remaining, reset_at, now, header_remaining, header_reset):
+        """ヘッダの残りで更新する（同じ時間枠の応答が前後して届いた場合は少ない方を残す）"""
+        if header_remaining is None:
+            return remaining, reset_at
+        reset = parse_duration(header_reset)
+        header_reset_at = now + (_DEFAULT_RESET if reset is None else reset)
+        if remaining is not None and now < reset_at and header_reset_at <= reset_at + _DEFAULT_RESET:
+            return min(remaining, int(header_remaining)), reset_at
+        return int(header_remaining), header_reset_at
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        attempt回目の失敗の後、モデルの全リクエストを止める時間を決めて返す
+
+        retry_afterがあればそれに従い、なければ指数バックオフの後半をランダムにする
+        （同時に失敗したリクエストが一斉に再送しないように）。
+        """
+        if retry_after is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        else:
+            delay = retry_after
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self._cond.notify_all()
+        return delay
+
+
+def get_governor(model_name):
+    """モデルごとの共有ガバナを返す"""
+    with _lock:
+        governor = _governors.get(model_name)
+        if governor is None:
+            governor = RateLimitGovernor(
+                backoff_base=_env_number("OPENAI_BACKOFF_BASE", DEFAULT_BACKOFF_BASE),
+                backoff_max=_env_number("OPENAI_BACKOFF_MAX", DEFAULT_BACKOFF_MAX),
+            )
+            _governors[model_name] = governor
+        return governor
+
+
+def _retryable(error):
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.RateLimitError):
+        # クォータ切れは待っても回復しない
+        return error.code != "insufficient_quota"
+    return isinstance(error, openai.APIStatusError) and (error.status_code >= 500 or error.status_code == 408)
+
+
+def _send(api_key, max_retries, body, stage=None):
+    """
+    ガバナの許可を得てリクエストを送り、(with_raw_responseの応答, 再送した回数) を返す
+
+    再送しても失敗したリクエストは、送出する前に usage_ledger に失敗として記録する。
+    """
+    if max_retries is None:
+        max_retries = _env_number("OPENAI_MAX_RETRIES", DEFAULT_MAX_RETRIES, int)
+    governor = get_governor(body["model"])
+    tokens = estimate_request_tokens(
+        body["messages"], body.get("max_tokens") or body.get("max_completion_tokens")
+    )
+    client = get_client(api_key, max_retries=0)
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        governor.acquire(tokens)
+        try:
+            raw = client.chat.completions.with_raw_response.create(**body)
+        except openai.APIError as e:
+            headers = getattr(getattr(e, "response", None), "headers", None)
+            governor.release(tokens, headers)
+            if attempt >= max_retries or not _retryable(e):
+                usage_ledger.record(body["model"], latency=time.monotonic() - start, retries=attempt,
+                                    stage=stage, failed=True)
+                raise
+            delay = governor.backoff(attempt, parse_retry_after(headers))
+            print(f"OpenAI request failed ({e.__class__.__name__}), retrying in {delay:.1f}s "
+                  f"({attempt + 1}/{max_retries})")
+            attempt += 1
+            continue
+        except BaseException:
+            governor.release(tokens)
+            raise
+        governor.release(tokens, raw.headers)
+        return raw, attempt
+
+
+def create_chat_completion(api_key=None, max_retries=None, stage=None, **body):
+    """
+    ガバナの許可を得てchat.completions.createを呼び、応答を返す
+
+    with_raw_responseで応答ヘッダを読み、ガバナのRPM・TPMの残りを更新する。
+    429・5xx・接続エラーはmax_retries回まで再送する（それ以外のエラーはそのまま送出する）。
+
+    Args:
+        api_key: get_clientに渡すAPIキー
+        stage: usage_ledgerに記録する段階（Noneなら台帳の現在の段階）
+        body: chat.completions.createの引数（model・messagesなど）
+    """
+    start = time.monotonic()
+    raw, retries = _send(api_key, max_retries, body, stage)
+    response = raw.parse()
+    usage_ledger.record(body["model"], response.usage, time.monotonic() - start, retries, stage)
+    return response
+
+
+def stream_chat_completion(api_key=None, max_retries=None, stage=None, **body):
+    """
+    create_chat_completionのストリーミング版。生成されたテキストの断片を順に返すジェネレータ
+
+    再送するのはストリームが始まる前のエラーだけ（途中で切れた場合はそのまま送出する）。
+    出力トークン数の上限で打ち切られた場合も、そこまでの断片を返して終わる。
+    stream_options.include_usageを指定し、最後のチャンク（choicesが空）のusageをusage_ledgerに記録する。
+    """
+    start = time.monotonic()
+    extra_body = dict(body.pop("extra_body", None) or {}, stream_options={"include_usage": True})
+    raw, retries = _send(api_key, max_retries, dict(body, stream=True, extra_body=extra_body), stage)
+    usage = None
+    try:
+        for chunk in raw.parse():
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            # SDKのChatCompletionChunkにusageのフィールドはないが、追加のフィールドとして読める
+            usage = getattr(chunk, "usage", None) or usage
+    finally:
+        raw.http_response.close()
+        usage_ledger.record(body["model"], usage, time.monotonic() - start, retries, stage)
@@ -1,45 +1,217 @@
 """
 run:
 python -m relevancy run_all_day_paper \
-  --output_dir ./data \
+  --store_path ./data/papers.sqlite \
   --model_name="gpt-3.5-turbo-16k" \
 """
+import functools
+import hashlib
+import math
+import queue
 import time
 import json
 import os
 import random
 import re
 import string
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import tqdm
 import utils
+import batch_scoring
+import rate_limit
+from paper_store import DEFAULT_DB_PATH, PaperStore, arxiv_id_from_url, today_et
+from score_cache import score_context
 
 
-def encode_prompt(query, prompt_papers):
+RELEVANCY_PROMPT_PATH = "src/relevancy_prompt.txt"
+# structured_output=True の場合の指示文（arXiv IDをキーにしたJSONで回答させる）
+RELEVANCY_JSON_PROMPT_PATH = "src/relevancy_prompt_json.txt"
+
+# two_phase=True の場合の指示文: 1段目はスコアだけ（"ID: スコア" の行）、2段目は閾値以上の論文の理由だけを回答させる
+SCORE_ONLY_PROMPT_PATH = "src/relevancy_prompt_score.txt"
+REASONS_PROMPT_PATH = "src/relevancy_prompt_reasons.txt"
+_PHASE_PROMPT_PATHS = {"score": SCORE_ONLY_PROMPT_PATH, "reasons": REASONS_PROMPT_PATH}
+
+_SCORE_KEYS = ("Relevancy score", "Reasons for match", "Reasons for match (ja)")
+_REASON_KEYS = _SCORE_KEYS[1:]
+
+# スコアだけの応答（"2510.12345: 8" の1行）の論文1件あたりの出力トークン数
+SCORE_ONLY_TOKENS_PER_PAPER = 12
+_SCORE_LINE_RE = re.compile(r"([\w.\-/]+)\s*[:：]\s*(\d+)\s*$")
+
+# structured_output=True の場合に指定するJSONスキーマ（strictモード）
+STRUCTURED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "relevancy_scores",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "scores": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "string"},
+                            "Relevancy score": {"type": "integer"},
+                            "Reasons for match": {"type": "string"},
+                            "Reasons for match (ja)": {"type": "string"},
+                        },
+                        "required": ["id", *_SCORE_KEYS],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["scores"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+# structured_output=True の場合に理由の生成（two_phaseの2段目）で指定するJSONスキーマ
+REASONS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "relevancy_reasons",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "reasons": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "string"},
+                            "Reasons for match": {"type": "string"},
+                            "Reasons for match (ja)": {"type": "string"},
+                        },
+                        "required": ["id", *_REASON_KEYS],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["reasons"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+PROMPT_SUFFIX = "\n Generate response:\n1."
+STRUCTURED_PROMPT_SUFFIX = "\n Generate the JSON response:\n"
+SCORE_ONLY_PROMPT_SUFFIX = "\n Generate response:\n"
+
+
+@functools.lru_cache(maxsize=None)
+def load_prompt_template(path=RELEVANCY_PROMPT_PATH):
+    """指示文のテンプレートを読み込む（1回の実行で1度だけ読む）"""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _template_path(structured=False, phase=None):
+    if phase is not None:
+        return _PHASE_PROMPT_PATHS[phase]
+    return RELEVANCY_JSON_PROMPT_PATH if structured else RELEVANCY_PROMPT_PATH
+
+
+@functools.lru_cache(maxsize=8)
+def prompt_prefix(interest, structured=False, phase=None):
+    """
+    指示文＋関心領域の固定部分
+
+    全リクエストでバイト単位で同一にして先頭に置くことで、プロバイダ側の
+    プロンプトキャッシュ（先頭一致）が効くようにする。
+    phase（"score" または "reasons"）を指定した場合は二段階評価のその段階の指示文を使う。
+    """
+    return load_prompt_template(_template_path(structured, phase)) + "\n" + interest
+
+
+def _paper_block(idx, task_dict, structured=False):
+    (title, authors, abstract) = task_dict["title"], task_dict["authors"], task_dict["abstract"]
+    if not title:
+        raise
+    number = idx + 1
+    if structured:
+        arxiv_id = arxiv_id_from_url(task_dict["main_page"])
+        return (f"###\n{number}. ID: {arxiv_id}\n{number}. Title: {title}\n"
+                f"{number}. Authors: {authors}\n{number}. Abstract: {abstract}\n")
+    return f"###\n{number}. Title: {title}\n{number}. Authors: {authors}\n{number}. Abstract: {abstract}\n"
+
+
+def _build_prompt(query, prompt_papers, structured=False, phase=None):
+    parts = [prompt_prefix(query['interest'], structured, phase)]
+    # 二段階評価の応答はarXiv IDで論文に対応付けるため、IDを載せる
+    with_id = structured or phase is not None
+    parts.extend(_paper_block(idx, task_dict, with_id) for idx, task_dict in enumerate(prompt_papers))
+    if phase == "score":
+        parts.append(SCORE_ONLY_PROMPT_SUFFIX)
+    else:
+        parts.append(STRUCTURED_PROMPT_SUFFIX if with_id else PROMPT_SUFFIX)
+    return "".join(parts)
+
+
+def encode_prompt(query, prompt_papers, debug=False, structured=False, phase=None):
     """Encode multiple prompt instructions into a single string."""
-    with open("src/relevancy_prompt.txt", "r", encoding="utf-8") as f:
-        prompt = f.read() + "\n"
-    prompt += query['interest']
-
-    for idx, task_dict in enumerate(prompt_papers):
-        (title, authors, abstract) = task_dict["title"], task_dict["authors"], task_dict["abstract"]
-        if not title:
-            raise
-        prompt += f"###\n"
-        prompt += f"{idx + 1}. Title: {title}\n"
-        prompt += f"{idx + 1}. Authors: {authors}\n"
-        prompt += f"{idx + 1}. Abstract: {abstract}\n"
-    prompt += f"\n Generate response:\n1."
-    try:
-        print(prompt)
-    except UnicodeEncodeError:
-        print(f"Prompt length: {len(prompt)} characters (printing skipped due to encoding issue)")
+    prompt = _build_prompt(query, prompt_papers, structured, phase)
+    if debug:
+        try:
+            print(prompt)
+        except UnicodeEncodeError:
+            print(f"Prompt length: {len(prompt)} characters (printing skipped due to encoding issue)")
     return prompt
 
 
-def post_process_chat_gpt_response(paper_data, response, threshold_score=8):
+def estimate_tokens(text):
+    """トークン数の概算（ASCIIは4文字で1トークン、日本語などそれ以外は1文字1トークンとみなす）"""
+    num_ascii = len(text.encode("ascii", "ignore"))
+    return -(-num_ascii // 4) + (len(text) - num_ascii)
+
+
+def pack_papers(papers, query, input_token_budget, max_papers_per_prompt=None, structured=False, phase=None):
+    """
+    推定トークン数がinput_token_budgetに収まるように論文をプロンプトに詰める
+
+    固定部分（指示文＋関心領域）と論文ごとのブロックのトークン数を見積もり、
+    掲載順に詰めていく。1件だけで予算を超える論文は単独のプロンプトにする。
+
+    Args:
+        papers: 論文dictのリスト
+        query: {"interest": ...}
+        input_token_budget: 1リクエストの入力トークン数の上限
+        max_papers_per_prompt: 1リクエストに入れる論文数の上限（Noneなら無制限）
+
+    Returns:
+        論文dictのリストのリスト
+    """
+    prefix_tokens = estimate_tokens(_build_prompt(query, [], structured, phase))
+    chunks = []
+    chunk, chunk_tokens = [], prefix_tokens
+    for paper in papers:
+        # 番号の桁数による差は小さいため、2桁の番号で見積もる
+        paper_tokens = estimate_tokens(_paper_block(9, paper, structured or phase is not None))
+        full = max_papers_per_prompt is not None and len(chunk) >= max_papers_per_prompt
+        if chunk and (full or chunk_tokens + paper_tokens > input_token_budget):
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], prefix_tokens
+        chunk.append(paper)
+        chunk_tokens += paper_tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def post_process_chat_gpt_response(paper_data, response, threshold_score=8, on_scored=None):
+    """
+    レスポンスからスコアを取り出し、threshold_score以上の論文を返す
+
+    on_scoredを指定した場合は、閾値に関係なくスコアを得た論文ごとに on_scored(paper, inst) を呼ぶ
+    """
     selected_data = []
     if response is None:
         return []
@@ -109,13 +281,7 @@ def post_process_chat_gpt_response(paper_data, response, threshold_score=8):
             raise RuntimeError("failed")
     
     pprint.pprint(score_items)
-    scores = []
-    for item in score_items:
-        temp = item["Relevancy score"]
-        if isinstance(temp, str) and "/" in temp:
-            scores.append(int(temp.split("/")[0]))
-        else:
-            scores.append(int(temp))
+    scores = [item_score(item) for item in score_items]
     if len(score_items) != len(paper_data):
         score_items = score_items[:len(paper_data)]
         hallucination = True
@@ -123,29 +289,305 @@ def post_process_chat_gpt_response(paper_data, response, threshold_score=8):
         hallucination = False
 
     for idx, inst in enumerate(score_items):
+        if on_scored is not None:
+            on_scored(paper_data[idx], inst)
         # if the decoding stops due to length, the last example is likely truncated so we discard it
         if scores[idx] < threshold_score:
             continue
-        output_str = "Title: " + paper_data[idx]["title"] + "\n"
-        output_str += "Authors: " + paper_data[idx]["authors"] + "\n"
-        output_str += "Link: " + paper_data[idx]["main_page"] + "\n"
-        for key, value in inst.items():
-            paper_data[idx][key] = value
-            output_str += str(key) + ": " + str(value) + "\n"
-        paper_data[idx]['summarized_text'] = output_str
-        selected_data.append(paper_data[idx])
+        selected_data.append(apply_score_item(paper_data[idx], inst))
     return selected_data, hallucination
 
 
+def parse_structured_response(content):
+    """
+    structured_outputの応答（{"scores": [...]}）を1回のjson.loadsで検証し、arXiv IDごとのスコアのdictを返す
+
+    形式が不正な項目は捨てる（その論文は未評価として再リクエストの対象になる）
+    """
+    try:
+        entries = json.loads(content)["scores"]
+    except (TypeError, ValueError, KeyError) as e:
+        print(f"Structured response parse error: {e}")
+        return {}
+    items = {}
+    for entry in entries if isinstance(entries, list) else []:
+        parsed = _structured_entry(entry)
+        if parsed is not None:
+            items[parsed[0]] = parsed[1]
+    return items
+
+
+def _structured_entry(entry):
+    """structured_outputの1項目を検証し、(arXiv ID, スコアのdict) を返す（不正ならNone）"""
+    if not isinstance(entry, dict) or not all(key in entry for key in ("id", *_SCORE_KEYS)):
+        return None
+    try:
+        item_score(entry)
+    except (TypeError, ValueError):
+        return None
+    return str(entry["id"]).strip(), {key: entry[key] for key in _SCORE_KEYS}
+
+
+def parse_score_only_response(content):
+    """
+    スコアだけの応答（"2510.12345: 8" の行）から、arXiv IDごとのスコアのdictを返す
+
+    "ID: スコア" の形でない行は捨てる（その論文は未評価として再リクエストの対象になる）
+    """
+    items = {}
+    for line in content.splitlines():
+        match = _SCORE_LINE_RE.search(line.strip().strip("`"))
+        if match:
+            items[match.group(1)] = {"Relevancy score": int(match.group(2))}
+    return items
+
+
+def parse_reasons_response(content):
+    """
+    理由だけの応答（{"reasons": [...]}）から、arXiv IDごとの英語・日本語の理由のdictを返す
+
+    形式が不正な項目は捨てる（その論文は理由なしとして再リクエストの対象になる）
+    """
+    content = re.sub(r'```(?:json)?\s*', '', content)
+    try:
+        entries = json.loads(content)["reasons"]
+    except (TypeError, ValueError, KeyError) as e:
+        print(f"Reasons response parse error: {e}")
+        return {}
+    items = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if isinstance(entry, dict) and all(isinstance(entry.get(key), str) for key in ("id", *_REASON_KEYS)):
+            items[entry["id"].strip()] = {key: entry[key] for key in _REASON_KEYS}
+    return items
+
+
+def post_process_structured_response(paper_data, content, threshold_score=8, on_scored=None,
+                                     parse=parse_structured_response):
+    """
+    structured_outputの応答をarXiv IDで論文に対応付け、threshold_score以上の論文を返す
+
+    位置ではなくIDで対応付けるため、応答で論文が抜けても他の論文のスコアはずれない。
+    スコアだけの応答（score_only）はparse=parse_score_only_responseで同じように対応付ける。
+
+    Returns:
+        (閾値以上の論文のリスト, 応答に含まれなかった論文のリスト)
+    """
+    items = parse(content) if content else {}
+    selected_data = []
+    missing = []
+    for paper in paper_data:
+        inst = items.get(arxiv_id_from_url(paper["main_page"]))
+        if inst is None:
+            missing.append(paper)
+            continue
+        if on_scored is not None:
+            on_scored(paper, inst)
+        if item_score(inst) >= threshold_score:
+            selected_data.append(apply_score_item(paper, inst))
+    return selected_data, missing
+
+
+def apply_score_item(paper, inst):
+    """スコアのdict（"Relevancy score" など）を論文dictに書き込み、summarized_textを組み立てる"""
+    output_str = "Title: " + paper["title"] + "\n"
+    output_str += "Authors: " + paper["authors"] + "\n"
+    output_str += "Link: " + paper["main_page"] + "\n"
+    for key, value in inst.items():
+        paper[key] = value
+        output_str += str(key) + ": " + str(value) + "\n"
+    paper['summarized_text'] = output_str
+    return paper
+
+
+def item_score(inst):
+    temp = inst["Relevancy score"]
+    if isinstance(temp, str) and "/" in temp:
+        return int(temp.split("/")[0])
+    return int(temp)
+
+
 def find_word_in_string(w, s):
     return re.compile(r"\b({0})\b".format(w), flags=re.IGNORECASE).search(s)
 
 
 def process_subject_fields(subjects):
+    """subjects文字列からカテゴリ名のリストを返す（論文dictには取り込み時に解析済みの subject_names がある）"""
     all_subjects = subjects.split(";")
     all_subjects = [s.split(" (")[0].strip() for s in all_subjects]
     return all_subjects
 
+def _decoding_args(prompt_papers, temperature, top_p, output_tokens_per_paper):
+    # The response for each paper should be less than output_tokens_per_paper tokens.
+    return utils.OpenAIDecodingArguments(
+        temperature=temperature,
+        n=1,
+        max_tokens=output_tokens_per_paper*len(prompt_papers),
+        top_p=top_p,
+    )
+
+
+def _decoding_kwargs(structured=False, phase=None):
+    decoding_kwargs = {"logit_bias": {"100257": -100}}  # prevent the <|endoftext|> from being generated
+    if structured and phase is None:
+        decoding_kwargs["response_format"] = STRUCTURED_RESPONSE_FORMAT
+    elif structured and phase == "reasons":
+        decoding_kwargs["response_format"] = REASONS_RESPONSE_FORMAT
+    return decoding_kwargs
+
+
+def _request_contents(query, chunks, model_name, temperature, top_p, output_tokens_per_paper,
+                      scoring_mode="sync", max_workers=utils.DEFAULT_MAX_WORKERS,
+                      batch_poll_interval=batch_scoring.DEFAULT_POLL_INTERVAL, debug_prompts=False, structured=False,
+                      checkpoint=None, phase=None):
+    """
+    チャンクごとにプロンプトを作って評価をリクエストし、応答テキストのリストを返す
+
+    phase（"score" または "reasons"）を指定した場合は二段階評価のその段階のプロンプトを使う。
+
+    checkpoint（RunCheckpoint）を指定した場合は、提出したバッチのIDを記録し、
+    同じプロンプトで再実行したときは再提出せずにそのバッチの結果を使う。
+
+    Returns:
+        chunksと同じ順序のリスト（リトライしても失敗したチャンク・出力が打ち切られたチャンクはNone）
+    """
+    prompts = [encode_prompt(query, prompt_papers, debug=debug_prompts, structured=structured, phase=phase)
+               for prompt_papers in chunks]
+    decoding_args = [_decoding_args(prompt_papers, temperature, top_p, output_tokens_per_paper) for prompt_papers in chunks]
+    decoding_kwargs = _decoding_kwargs(structured, phase)
+    # 理由の生成（二段階評価の2段目）は評価とは別の段階として使用量を記録する
+    stage = "reasons" if phase == "reasons" else None
+
+    request_start = time.time()
+    if scoring_mode == "batch":
+        batch_id = on_submitted = None
+        if checkpoint is not None:
+            key = hashlib.sha256("\n".join([model_name] + prompts).encode("utf-8")).hexdigest()[:16]
+            batch_id = checkpoint.load_records("batches").get(key, {}).get("batch_id")
+            on_submitted = lambda submitted_id: checkpoint.append_records(
+                "batches", [{"key": key, "batch_id": submitted_id}]
+            )
+        contents = batch_scoring.run_batch(
+            prompts,
+            decoding_args,
+            model_name,
+            poll_interval=batch_poll_interval,
+            batch_id=batch_id,
+            on_submitted=on_submitted,
+            stage=stage,
+            **decoding_kwargs,
+        )
+        print(f"Batch of {len(prompts)} requests took {time.time() - request_start:.2f}s")
+        return contents
+    if scoring_mode != "sync":
+        raise ValueError(f"Unknown scoring mode: {scoring_mode}")
+
+    responses = utils.openai_completion(
+        prompts=prompts,
+        model_name=model_name,
+        batch_size=1,
+        decoding_args=decoding_args,
+        max_workers=max_workers,
+        skip_failures=True,
+        stage=stage,
+        **decoding_kwargs,
+    )
+    print(f"{len(prompts)} requests took {time.time() - request_start:.2f}s (max_workers={max_workers})")
+    prompt_tokens = sum(getattr(response, 'prompt_tokens', 0) for response in responses)
+    cached_tokens = sum(getattr(response, 'cached_tokens', 0) for response in responses)
+    print(f"Prompt tokens: {prompt_tokens} (cached: {cached_tokens}"
+          f"{f', {cached_tokens / prompt_tokens:.0%}' if prompt_tokens else ''})")
+    contents = []
+    for response in responses:
+        if response is None:
+            contents.append(None)
+        elif getattr(response, 'finish_reason', None) == "length":
+            # 出力トークン数の上限で打ち切られた応答は最後の論文が欠けるため、失敗として扱う
+            print("Response hit the output length limit")
+            contents.append(None)
+        # OpenAI 1.3.0互換：attributeアクセスを試す
+        elif hasattr(response, 'message'):
+            contents.append(response.message.content)
+        elif hasattr(response, 'text'):
+            contents.append(response.text)
+        else:
+            print("Response attributes:", dir(response))
+            raise ValueError(f"Cannot extract content from response type {type(response)}")
+    return contents
+
+
+def _halves(prompt_papers):
+    """チャンクを半分に分ける（1件の場合はそのまま再リクエストする）"""
+    if len(prompt_papers) <= 1:
+        return [prompt_papers]
+    mid = len(prompt_papers) // 2
+    return [prompt_papers[:mid], prompt_papers[mid:]]
+
+
+def cache_context(interest, model_name, structured_output=False, phase=None):
+    """
+    スコアキャッシュのコンテキスト（評価と同じ指示文のテンプレートで作る）
+
+    phaseは二段階評価の段階（"score" または "reasons"、通常の評価ならNone）。
+    """
+    return score_context(interest, model_name, load_prompt_template(_template_path(structured_output, phase)))
+
+
+def _known_scores(all_papers, query, model_name, structured_output=False, score_cache=None, checkpoint=None,
+                  phase=None):
+    """
+    スコアキャッシュと実行チェックポイントから評価済みのスコアを探す
+
+    phase="reasons" の場合は、スコアの代わりに生成済みの理由を探す（キャッシュ・チェックポイントともスコアとは別）
+
+    Returns:
+        (評価済みの(論文, スコア)のリスト, そのうちスコアキャッシュに保存するもののリスト,
+         未評価の論文のリスト, スコアキャッシュのコンテキスト)
+    """
+    known = []
+    to_store = []
+    context = None
+    if score_cache is not None:
+        context = cache_context(query['interest'], model_name, structured_output, phase)
+        cached = score_cache.get_many(all_papers, context)
+        num_hits = sum(inst is not None for inst in cached)
+        print(f"Score cache: {num_hits} hits, {len(cached) - num_hits} misses")
+        known.extend((paper, inst) for paper, inst in zip(all_papers, cached) if inst is not None)
+        all_papers = [paper for paper, inst in zip(all_papers, cached) if inst is None]
+
+    if checkpoint is not None:
+        # 前回の実行で評価済みのチャンクのスコア（スコアキャッシュにはまだ保存されていない）
+        records = checkpoint.load_records(_records_name(phase))
+        remaining = []
+        for paper in all_papers:
+            record = records.get(paper["main_page"])
+            if record is None:
+                remaining.append(paper)
+                continue
+            known.append((paper, record["item"]))
+            to_store.append((paper, record["item"]))
+        if len(remaining) < len(all_papers):
+            print(f"Checkpoint: {len(all_papers) - len(remaining)} papers already scored")
+        all_papers = remaining
+    return known, to_store, all_papers, context
+
+
+def _records_name(phase=None):
+    """実行チェックポイントのレコード名（理由はスコアと別に記録する）"""
+    return "reasons" if phase == "reasons" else "scores"
+
+
+def _make_chunks(all_papers, query, num_paper_in_prompt, input_token_budget=None, structured_output=False,
+                 phase=None):
+    """論文をnum_paper_in_prompt件ずつ、またはinput_token_budgetまで詰めてチャンクに分ける"""
+    if input_token_budget is None:
+        return [all_papers[i:i + num_paper_in_prompt] for i in range(0, len(all_papers), num_paper_in_prompt)]
+    chunks = pack_papers(all_papers, query, input_token_budget, max_papers_per_prompt=num_paper_in_prompt,
+                         structured=structured_output, phase=phase)
+    print(f"Packed {len(all_papers)} papers into {len(chunks)} prompts "
+          f"(input budget {input_token_budget} tokens, up to {num_paper_in_prompt} papers each)")
+    return chunks
+
+
 def generate_relevance_score(
     all_papers,
     query,
@@ -154,70 +596,525 @@ def generate_relevance_score(
     num_paper_in_prompt=4,
     temperature=0.4,
     top_p=1.0,
-    sorting=True
+    sorting=True,
+    max_workers=utils.DEFAULT_MAX_WORKERS,
+    score_cache=None,
+    scoring_mode="sync",
+    batch_poll_interval=batch_scoring.DEFAULT_POLL_INTERVAL,
+    input_token_budget=None,
+    output_tokens_per_paper=128,
+    debug_prompts=False,
+    structured_output=False,
+    max_attempts=6,
+    checkpoint=None,
+    triage_model=None,
+    escalation_band=1,
+    score_only=False,
+    two_phase=False,
 ):
+    """
+    論文をnum_paper_in_prompt件ずつのチャンクに分け、全チャンクを同時に評価する
+
+    チャンクのプロンプトはまとめてutils.openai_completionに渡し、最大max_workers件を
+    並列に送信する。結果はチャンクの順に後処理する。
+
+    score_cache（ScoreCache）を指定した場合は、キャッシュ済みの論文はLLMに送らず
+    保存されたスコアを使い、新たに得たスコアはキャッシュに保存する。
+
+    scoring_mode="batch" の場合は、全プロンプトをBatch APIに投入し、完了まで
+    batch_poll_interval秒ごとにポーリングしてから同じ後処理を行う。
+
+    input_token_budgetを指定した場合は、件数固定のチャンクの代わりにpack_papersで
+    入力トークン数の予算まで論文を詰め（num_paper_in_promptは1プロンプトの件数の上限になる）、
+    各リクエストの出力トークン数をoutput_tokens_per_paper×論文数にする。
+
+    debug_promptsがTrueの場合は、各リクエストのプロンプト全文を出力する。
+
+    structured_outputがTrueの場合は、arXiv IDをキーにしたJSON（STRUCTURED_RESPONSE_FORMAT）で
+    回答させてIDで論文に対応付ける。応答に含まれなかった論文は1件ずつ再リクエストする。
+
+    応答が得られない・出力が打ち切られる・パースできないチャンクは、半分に分けて
+    失敗した部分だけを再リクエストする（最大max_attempts回）。それでも評価できなかった
+    論文は実行を止めずに未評価として扱う。
+
+    checkpoint（RunCheckpoint）を指定した場合は、評価できたチャンクのスコアを随時記録し、
+    途中で落ちた実行を再開したときは記録済みの論文をLLMに送らない。
+
+    triage_modelを指定した場合はカスケードで評価する: 全論文をまず安価なtriage_modelで評価し、
+    スコアが閾値の±escalation_band以内の論文だけをmodel_nameで評価し直す（_cascade_relevance_score）。
+
+    score_onlyがTrueの場合は、理由を書かせずに "arXiv ID: スコア" の行だけを回答させる
+    （出力トークン数は論文1件あたりSCORE_ONLY_TOKENS_PER_PAPER）。返す論文には理由が入らない。
+
+    two_phaseがTrueの場合は二段階で評価する: まずscore_onlyで全論文のスコアだけを得て、
+    threshold_score以上の論文の理由だけをgenerate_match_reasonsでまとめて生成する。
+    大半の論文が閾値に届かない日は、理由の出力トークン（応答時間の大半を占める）がほぼなくなる。
+    """
+    options = dict(
+        num_paper_in_prompt=num_paper_in_prompt, temperature=temperature, top_p=top_p, max_workers=max_workers,
+        score_cache=score_cache, scoring_mode=scoring_mode, batch_poll_interval=batch_poll_interval,
+        input_token_budget=input_token_budget, output_tokens_per_paper=output_tokens_per_paper,
+        debug_prompts=debug_prompts, structured_output=structured_output, max_attempts=max_attempts,
+        checkpoint=checkpoint,
+    )
+    if two_phase:
+        ans_data, hallucination = generate_relevance_score(
+            all_papers, query, model_name=model_name, threshold_score=threshold_score, sorting=False,
+            triage_model=triage_model, escalation_band=escalation_band, score_only=True, **options
+        )
+        generate_match_reasons(ans_data, query, model_name=model_name, **options)
+        if sorting:
+            ans_data = sorted(ans_data, key=lambda x: int(x["Relevancy score"]), reverse=True)
+        return ans_data, hallucination
+    if triage_model is not None and triage_model != model_name:
+        return _cascade_relevance_score(
+            all_papers, query, model_name, triage_model, threshold_score, escalation_band, sorting,
+            score_only=score_only, **options
+        )
+
     ans_data = []
-    request_idx = 1
     hallucination = False
-    for id in tqdm.tqdm(range(0, len(all_papers), num_paper_in_prompt)):
-        prompt_papers = all_papers[id:id+num_paper_in_prompt]
-        # only sampling from the seed tasks
-        prompt = encode_prompt(query, prompt_papers)
-
-        decoding_args = utils.OpenAIDecodingArguments(
-            temperature=temperature,
-            n=1,
-            max_tokens=128*num_paper_in_prompt, # The response for each paper should be less than 128 tokens. 
-            top_p=top_p,
-        )
-        request_start = time.time()
-        response = None
+    phase = "score" if score_only else None
+
+    known, scored, all_papers, context = _known_scores(
+        all_papers, query, model_name, structured_output, score_cache, checkpoint, phase
+    )
+    for paper, inst in known:
+        if item_score(inst) >= threshold_score:
+            ans_data.append(apply_score_item(paper, inst))
+    chunks = _make_chunks(all_papers, query, num_paper_in_prompt, input_token_budget, structured_output, phase)
+
+    request_kwargs = dict(
+        model_name=model_name, temperature=temperature, top_p=top_p,
+        output_tokens_per_paper=SCORE_ONLY_TOKENS_PER_PAPER if score_only else output_tokens_per_paper,
+        max_workers=max_workers, debug_prompts=debug_prompts, structured=structured_output,
+        checkpoint=checkpoint, phase=phase,
+    )
+
+    def process(prompt_papers, content):
+        """チャンクの応答を後処理し、再リクエストするチャンクのリストを返す"""
+        nonlocal hallucination
+        if content is None:
+            return _halves(prompt_papers)
+        if structured_output or score_only:
+            batch_data, batch_missing = post_process_structured_response(
+                prompt_papers, content, threshold_score=threshold_score,
+                on_scored=lambda paper, inst: scored.append((paper, inst)),
+                parse=parse_score_only_response if score_only else parse_structured_response,
+            )
+            ans_data.extend(batch_data)
+            if len(batch_missing) == len(prompt_papers):
+                return _halves(prompt_papers)
+            # 応答から抜けた論文だけを1件ずつ再リクエストする
+            return [[paper] for paper in batch_missing]
+        # レスポンスを辞書形式に変換（後方互換性のため）
+        response_dict = {'message': {'content': content}}
+        batch_scored = []
         try:
-            response = utils.openai_completion(
-                prompts=prompt,
-                model_name=model_name,
-                batch_size=1,
-                decoding_args=decoding_args,
-                logit_bias={"100257": -100},  # prevent the <|endoftext|> from being generated
+            batch_data, hallu = post_process_chat_gpt_response(
+                prompt_papers, response_dict, threshold_score=threshold_score,
+                on_scored=lambda paper, inst: batch_scored.append((paper, inst)),
             )
-            print("Response type:", type(response))
-            # OpenAI 1.3.0互換：attributeアクセスを試す
-            if hasattr(response, 'message'):
-                print("Response has 'message' attribute")
-                content = response.message.content
-            elif hasattr(response, 'text'):
-                print("Response has 'text' attribute")
-                content = response.text
-            else:
-                print("Response attributes:", dir(response))
-                raise ValueError(f"Cannot extract content from response type {type(response)}")
-            print("response content", content)
         except Exception as e:
-            print(f"Error getting response: {e}")
-            if response:
-                print(f"Response object: {response}")
-            raise
-        request_duration = time.time() - request_start
-
-        process_start = time.time()
-        # レスポンスを辞書形式に変換（後方互換性のため）
-        response_dict = {'message': {'content': response.message.content if hasattr(response, 'message') else response.text}}
-        batch_data, hallu = post_process_chat_gpt_response(prompt_papers, response_dict, threshold_score=threshold_score)
+            print(f"Failed to parse the response for {len(prompt_papers)} papers: {e}")
+            return _halves(prompt_papers)
         hallucination = hallucination or hallu
         ans_data.extend(batch_data)
+        # 件数がずれた（hallucination）バッチのスコアは論文との対応が怪しいため保存しない
+        if not hallu:
+            scored.extend(batch_scored)
+        return []
+
+    process_start = time.time()
+    # 失敗したチャンク（応答なし・打ち切り・パース失敗）は半分に分けて、失敗した部分だけを
+    # 再リクエストする。max_attempts回で評価できなかった論文は未評価として残す
+    pending = chunks
+    mode = scoring_mode
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        if attempt:
+            print(f"Retry {attempt}/{max_attempts - 1}: re-requesting {sum(map(len, pending))} papers "
+                  f"in {len(pending)} prompts")
+        contents = _request_contents(
+            query, pending, scoring_mode=mode, batch_poll_interval=batch_poll_interval, **request_kwargs
+        )
+        retries = []
+        for chunk, content in zip(pending, contents):
+            num_scored = len(scored)
+            retries.extend(process(chunk, content))
+            if checkpoint is not None:
+                checkpoint.append_records(
+                    "scores", [{"key": paper["main_page"], "item": inst} for paper, inst in scored[num_scored:]]
+                )
+        pending = retries
+        # 再リクエストは件数が少ないため同期で行う
+        mode = "sync"
 
-        print(f"Request {request_idx+1} took {request_duration:.2f}s")
-        print(f"Post-processing took {time.time() - process_start:.2f}s")
+    unscored = [paper for chunk in pending for paper in chunk]
+    if unscored:
+        print(f"{len(unscored)} papers left unscored after {max_attempts} attempts:")
+        for paper in unscored:
+            print(f"  {paper['main_page']}: {' '.join(paper['title'].split())[:80]}")
+    print(f"Post-processing took {time.time() - process_start:.2f}s")
+
+    if score_cache is not None:
+        score_cache.put_many(scored, context)
 
     if sorting:
         ans_data = sorted(ans_data, key=lambda x: int(x["Relevancy score"]), reverse=True)
     
     return ans_data, hallucination
 
+
+def generate_match_reasons(
+    papers,
+    query,
+    model_name="gpt-3.5-turbo-16k",
+    num_paper_in_prompt=4,
+    temperature=0.4,
+    top_p=1.0,
+    max_workers=utils.DEFAULT_MAX_WORKERS,
+    score_cache=None,
+    scoring_mode="sync",
+    batch_poll_interval=batch_scoring.DEFAULT_POLL_INTERVAL,
+    input_token_budget=None,
+    output_tokens_per_paper=128,
+    debug_prompts=False,
+    structured_output=False,
+    max_attempts=6,
+    checkpoint=None,
+):
+    """
+    スコア済みの論文（two_phaseの1段目で閾値以上だった論文）の英語・日本語の理由だけを生成する
+
+    arXiv IDをキーにしたJSON（structured_outputならREASONS_RESPONSE_FORMAT）で回答させ、
+    論文dictの "Reasons for match" / "Reasons for match (ja)" と summarized_text を書き込む（スコアは変えない）。
+    応答が得られない・パースできないチャンクは半分に分けて、応答から抜けた論文は1件ずつ
+    再リクエストする（最大max_attempts回）。それでも理由を得られなかった論文は理由を空にする。
+    スコアキャッシュ・実行チェックポイントには、理由をスコアとは別に保存する。
+
+    Returns:
+        papers（理由を書き込んだもの）
+    """
+    if not papers:
+        return papers
+    known, generated, remaining, context = _known_scores(
+        papers, query, model_name, structured_output, score_cache, checkpoint, phase="reasons"
+    )
+    found = {paper["main_page"]: inst for paper, inst in known}
+    pending = _make_chunks(remaining, query, num_paper_in_prompt, input_token_budget, structured_output, "reasons")
+
+    process_start = time.time()
+    mode = scoring_mode
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        if attempt:
+            print(f"Retry {attempt}/{max_attempts - 1}: re-requesting reasons for {sum(map(len, pending))} papers "
+                  f"in {len(pending)} prompts")
+        contents = _request_contents(
+            query, pending, model_name, temperature, top_p, output_tokens_per_paper, scoring_mode=mode,
+            max_workers=max_workers, batch_poll_interval=batch_poll_interval, debug_prompts=debug_prompts,
+            structured=structured_output, checkpoint=checkpoint, phase="reasons",
+        )
+        retries = []
+        for chunk, content in zip(pending, contents):
+            items = parse_reasons_response(content) if content else {}
+            chunk_generated = []
+            missing = []
+            for paper in chunk:
+                inst = items.get(arxiv_id_from_url(paper["main_page"]))
+                if inst is None:
+                    missing.append(paper)
+                else:
+                    chunk_generated.append((paper, inst))
+                    found[paper["main_page"]] = inst
+            generated.extend(chunk_generated)
+            if checkpoint is not None:
+                checkpoint.append_records(
+                    "reasons", [{"key": paper["main_page"], "item": inst} for paper, inst in chunk_generated]
+                )
+            # 応答から抜けた論文だけを1件ずつ、全部抜けたチャンクは半分に分けて再リクエストする
+            retries.extend(_halves(chunk) if len(missing) == len(chunk) else [[paper] for paper in missing])
+        pending = retries
+        mode = "sync"
+
+    if score_cache is not None:
+        score_cache.put_many(generated, context)
+
+    no_reasons = dict.fromkeys(_REASON_KEYS, "")
+    for paper in papers:
+        apply_score_item(paper, {"Relevancy score": paper["Relevancy score"],
+                                 **found.get(paper["main_page"], no_reasons)})
+    print(f"Generated reasons for {len(found)} of {len(papers)} papers in {time.time() - process_start:.2f}s")
+    missing = [paper for paper in papers if paper["main_page"] not in found]
+    if missing:
+        print(f"{len(missing)} papers left without reasons after {max_attempts} attempts")
+    return papers
+
+
+def _without_scores(paper):
+    """評価結果（スコア・理由・summarized_text）を除いた論文dictのコピー"""
+    return {key: value for key, value in paper.items() if key not in _SCORE_KEYS and key != "summarized_text"}
+
+
+def _cascade_relevance_score(all_papers, query, model_name, triage_model, threshold_score, escalation_band,
+                             sorting=True, checkpoint=None, **kwargs):
+    """
+    カスケード評価: triage_modelで全論文を評価し、閾値付近の論文だけmodel_nameで評価し直す
+
+    |トリアージのスコア - threshold_score| <= escalation_band の論文を「境界の論文」として
+    model_nameに回し、そのスコアで置き換える。それ以外の論文はトリアージのスコアで判定する。
+    model_nameでも評価できなかった境界の論文はトリアージのスコアのまま残す。
+
+    Returns:
+        (threshold_score以上の論文のリスト, hallucination)
+    """
+    # 全論文のスコアが必要なため、閾値なしで評価する（チェックポイントは強いモデルの評価と分ける）
+    triaged, hallucination = generate_relevance_score(
+        all_papers, query, model_name=triage_model, threshold_score=-math.inf, sorting=False,
+        checkpoint=checkpoint.sub("triage") if checkpoint is not None else None, **kwargs
+    )
+    escalate = [paper for paper in triaged if abs(item_score(paper) - threshold_score) <= escalation_band]
+    ans_data = [
+        paper for paper in triaged
+        if abs(item_score(paper) - threshold_score) > escalation_band and item_score(paper) >= threshold_score
+    ]
+    print(f"Cascade: {len(escalate)} of {len(triaged)} triaged papers scored within ±{escalation_band} of "
+          f"{threshold_score} by {triage_model}, escalating to {model_name}")
+
+    if escalate:
+        rescored, hallu = generate_relevance_score(
+            [_without_scores(paper) for paper in escalate], query, model_name=model_name,
+            threshold_score=-math.inf, sorting=False, checkpoint=checkpoint, **kwargs
+        )
+        hallucination = hallucination or hallu
+        rescored_pages = {paper["main_page"] for paper in rescored}
+        fallback = [paper for paper in escalate if paper["main_page"] not in rescored_pages]
+        if fallback:
+            print(f"{len(fallback)} escalated papers keep their triage scores")
+        changed = sum(
+            (item_score(paper) >= threshold_score) != (item_score(triage) >= threshold_score)
+            for paper, triage in zip(sorted(rescored, key=lambda p: p["main_page"]),
+                                     sorted((p for p in escalate if p["main_page"] in rescored_pages),
+                                            key=lambda p: p["main_page"]))
+        )
+        print(f"Cascade: {model_name} changed the decision for {changed} of {len(rescored)} escalated papers")
+        ans_data.extend(paper for paper in rescored + fallback if item_score(paper) >= threshold_score)
+
+    if sorting:
+        ans_data = sorted(ans_data, key=lambda x: int(x["Relevancy score"]), reverse=True)
+    return ans_data, hallucination
+
+
+def iter_json_objects(fragments, depth=0):
+    """
+    テキストの断片から、入れ子の深さdepthで始まるJSONオブジェクト（{...}）の文字列を、閉じた順に返す
+
+    {}と[]の両方を1段として数え、文字列リテラル中の括弧は数えない。structured_outputの
+    {"scores": [{...}, ...]} の各項目はdepth=2、従来形式の "1. {...}" の各行はdepth=0で取り出せる。
+    """
+    level = 0
+    in_string = escaped = False
+    buffer = []
+    for fragment in fragments:
+        for char in fragment:
+            if buffer:
+                buffer.append(char)
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                continue
+            if char == '"':
+                in_string = True
+            elif char in "{[":
+                if char == "{" and level == depth and not buffer:
+                    buffer.append(char)
+                level += 1
+            elif char in "}]":
+                level -= 1
+                if char == "}" and level == depth and buffer:
+                    yield "".join(buffer)
+                    buffer = []
+
+
+class RelevanceScoreStream:
+    """
+    ストリーミングで関連度を評価し、threshold_score以上の論文を評価できた順に返すイテラブル
+
+    各チャンクを最大max_workers件並列にstreamで送信し、応答の論文1件分のJSONが閉じた時点で
+    パースして論文に対応付ける（structured_outputならarXiv ID、従来形式なら位置で対応付ける）。
+    チャンク全体の完了を待たずに返すため、呼び出し側は高スコアの論文の要約などを先に始められる。
+
+    ストリームで評価できなかった論文（応答から抜けた・途中で切れた・エラー）は、最後に
+    generate_relevance_score（同期・二分して再リクエスト）でまとめて評価して返す。
+    スコアキャッシュ・実行チェックポイントはgenerate_relevance_scoreと同じように使う。
+    チェックポイントには、チャンクの応答が終わって件数のずれがないと分かってから書く。
+
+    返し終わった後、hallucinationに従来形式で論文数より多い項目が返ったかどうかが入る。
+    """
+
+    def __init__(
+        self,
+        all_papers,
+        query,
+        model_name="gpt-3.5-turbo-16k",
+        threshold_score=8,
+        num_paper_in_prompt=4,
+        temperature=0.4,
+        top_p=1.0,
+        max_workers=utils.DEFAULT_MAX_WORKERS,
+        score_cache=None,
+        input_token_budget=None,
+        output_tokens_per_paper=128,
+        structured_output=False,
+        max_attempts=6,
+        checkpoint=None,
+    ):
+        self.all_papers = all_papers
+        self.query = query
+        self.model_name = model_name
+        self.threshold_score = threshold_score
+        self.num_paper_in_prompt = num_paper_in_prompt
+        self.temperature = temperature
+        self.top_p = top_p
+        self.max_workers = max_workers
+        self.score_cache = score_cache
+        self.input_token_budget = input_token_budget
+        self.output_tokens_per_paper = output_tokens_per_paper
+        self.structured_output = structured_output
+        self.max_attempts = max_attempts
+        self.checkpoint = checkpoint
+        self.hallucination = False
+
+    def _stream_chunk(self, index, prompt_papers, results):
+        """
+        index番目のチャンクをstreamで評価し、(index, 論文, スコア) をresultsに入れる
+
+        最後にチャンクの終わりとして (index, None, 論文数より多い項目が返ったか) を入れる。
+
+        Returns:
+            (評価できなかった論文のリスト, 論文数より多い項目が返ったか)
+        """
+        body = utils.chat_completion_body(
+            encode_prompt(self.query, prompt_papers, structured=self.structured_output),
+            _decoding_args(prompt_papers, self.temperature, self.top_p, self.output_tokens_per_paper),
+            self.model_name,
+            _decoding_kwargs(self.structured_output),
+        )
+        by_id = {arxiv_id_from_url(paper["main_page"]): paper for paper in prompt_papers}
+        unscored = {paper["main_page"]: paper for paper in prompt_papers}
+        position = 0
+        hallucination = False
+        try:
+            fragments = rate_limit.stream_chat_completion(**body)
+            for text in iter_json_objects(fragments, depth=2 if self.structured_output else 0):
+                try:
+                    entry = json.loads(text)
+                except ValueError:
+                    continue
+                if self.structured_output:
+                    parsed = _structured_entry(entry)
+                    if parsed is None:
+                        continue
+                    paper, inst = by_id.get(parsed[0]), parsed[1]
+                else:
+                    if not isinstance(entry, dict) or "Relevancy score" not in entry:
+                        continue
+                    if position >= len(prompt_papers):
+                        hallucination = True
+                        continue
+                    paper, inst = prompt_papers[position], entry
+                    position += 1
+                    try:
+                        item_score(inst)
+                    except (TypeError, ValueError):
+                        continue
+                if paper is None or unscored.pop(paper["main_page"], None) is None:
+                    continue
+                results.put((index, paper, inst))
+        except Exception as e:
+            print(f"Streaming request for {len(prompt_papers)} papers failed: {e}")
+        results.put((index, None, hallucination))
+        return list(unscored.values()), hallucination
+
+    def __iter__(self):
+        known, scored, all_papers, context = _known_scores(
+            self.all_papers, self.query, self.model_name, self.structured_output, self.score_cache, self.checkpoint
+        )
+        for paper, inst in known:
+            if item_score(inst) >= self.threshold_score:
+                yield apply_score_item(paper, inst)
+
+        chunks = _make_chunks(all_papers, self.query, self.num_paper_in_prompt, self.input_token_budget,
+                              self.structured_output)
+        results = queue.Queue()
+        leftovers = []
+        stream_start = time.time()
+        num_streamed = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(chunks)))) as executor:
+            futures = [executor.submit(self._stream_chunk, index, chunk, results)
+                       for index, chunk in enumerate(chunks)]
+            pending = set(futures)
+            # チャンクの終わりまでチェックポイントに書かずにおく記録（チャンクごと）
+            buffered = {}
+            suspect = set()
+            while pending or not results.empty():
+                try:
+                    index, paper, inst = results.get(timeout=0.1)
+                except queue.Empty:
+                    pending = {future for future in pending if not future.done()}
+                    continue
+                if paper is None:
+                    # 件数がずれた（hallucination）チャンクのスコアは論文との対応が怪しいため、
+                    # チェックポイントにもキャッシュにも残さない
+                    records = buffered.pop(index, [])
+                    if inst:
+                        self.hallucination = True
+                        suspect.update(paper["main_page"] for paper in chunks[index])
+                    elif records and self.checkpoint is not None:
+                        self.checkpoint.append_records("scores", records)
+                    continue
+                num_streamed += 1
+                buffered.setdefault(index, []).append({"key": paper["main_page"], "item": inst})
+                scored.append((paper, inst))
+                if item_score(inst) >= self.threshold_score:
+                    yield apply_score_item(paper, inst)
+            for future in futures:
+                unscored, _ = future.result()
+                leftovers.extend(unscored)
+            scored = [(paper, inst) for paper, inst in scored if paper["main_page"] not in suspect]
+        print(f"Streamed scores for {num_streamed} papers in {len(chunks)} prompts "
+              f"({time.time() - stream_start:.2f}s, max_workers={self.max_workers})")
+
+        if self.score_cache is not None:
+            self.score_cache.put_many(scored, context)
+
+        if leftovers and self.max_attempts > 1:
+            print(f"{len(leftovers)} papers not scored by streaming, re-requesting")
+            data, hallucination = generate_relevance_score(
+                leftovers, self.query, model_name=self.model_name, threshold_score=self.threshold_score,
+                num_paper_in_prompt=self.num_paper_in_prompt, temperature=self.temperature, top_p=self.top_p,
+                sorting=False, max_workers=self.max_workers, score_cache=self.score_cache,
+                input_token_budget=self.input_token_budget, output_tokens_per_paper=self.output_tokens_per_paper,
+                structured_output=self.structured_output, max_attempts=self.max_attempts - 1,
+                checkpoint=self.checkpoint,
+            )
+            self.hallucination = self.hallucination or hallucination
+            yield from data
+        elif leftovers:
+            print(f"{len(leftovers)} papers left unscored after streaming")
+
+
 def run_all_day_paper(
     query={"interest":"", "subjects":["Computation and Language", "Artificial Intelligence"]},
     date=None,
-    data_dir="../data",
+    store_path=DEFAULT_DB_PATH,
     model_name="gpt-3.5-turbo-16k",
     threshold_score=8,
     num_paper_in_prompt=8,
@@ -225,17 +1122,12 @@ def run_all_day_paper(
     top_p=1.0
 ):
     if date is None:
-        date = datetime.today().strftime('%a, %d %b %y')
-        # string format such as Wed, 10 May 23
+        date = today_et()
+        # ISO format such as 2023-05-10
     print ("the date for the arxiv data is: ", date)
 
-    all_papers = [json.loads(l) for l in open(f"{data_dir}/{date}.jsonl", "r")]
-    print (f"We found {len(all_papers)}.")
-
-    all_papers_in_subjects = [
-        t for t in all_papers
-        if bool(set(process_subject_fields(t['subjects'])) & set(query['subjects']))
-    ]
+    with PaperStore(store_path) as store:
+        all_papers_in_subjects = store.get_papers_by_date(date, subjects=query['subjects'])
     print(f"After filtering subjects, we have {len(all_papers_in_subjects)} papers left.")
     ans_data = generate_relevance_score(all_papers_in_subjects, query, model_name, threshold_score, num_paper_in_prompt, temperature, top_p)
     utils.write_ans_to_file(ans_data, date, output_dir="../outputs")
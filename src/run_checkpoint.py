@@ -0,0 +1,110 @@
+"""
+generate_bodyの実行チェックポイント
+
+ダウンロード → フィルタ → 評価 → 要約 → レンダリングの各段階の出力を、日付と設定の
+ハッシュで決まる実行ディレクトリ（data/runs/{日付}-{設定ハッシュ}/）に保存する。
+要約やDiscord投稿で失敗しても、action.py --resume で再実行すれば完了済みの段階は
+保存した出力を読むだけで、LLMの呼び出しをやり直さない。
+
+    {段階}.json       段階の出力（完了した段階だけに存在する）
+    {レコード}.jsonl  段階の途中経過（評価済みチャンクのスコア・提出済みバッチのIDなど）
+
+設定を変えると設定ハッシュが変わり、別の実行ディレクトリになる。
+--resume なしで実行すると、同じ実行ディレクトリの古いチェックポイントを消してやり直す。
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from paper_store import today_et
+
+
+DEFAULT_RUNS_DIR = "./data/runs"
+
+
+def config_hash(config):
+    """設定（config.yamlの内容）のハッシュ"""
+    text = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+
+def _json_default(value):
+    # 論文dictの subject_names / subject_codes（frozenset）はリストとして保存する
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class RunCheckpoint:
+    """
+    1回の実行（日付・設定）の段階ごとの出力を保存・復元する
+
+    resume=Falseなら既存のチェックポイントを削除して新しく始める。
+    """
+
+    def __init__(self, run_dir, resume=False):
+        self.run_dir = run_dir
+        self.resume = resume
+        if not resume and os.path.isdir(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir, exist_ok=True)
+
+    @classmethod
+    def for_run(cls, config, date=None, runs_dir=DEFAULT_RUNS_DIR, resume=False):
+        """日付（既定は米国東部時間での今日）と設定から実行ディレクトリを決める"""
+        date = date or today_et()
+        return cls(os.path.join(runs_dir, f"{date}-{config_hash(config)}"), resume=resume)
+
+    def sub(self, name):
+        """同じ実行の中で別に記録する部分（カスケードのトリアージなど）のチェックポイント"""
+        return RunCheckpoint(os.path.join(self.run_dir, name), resume=True)
+
+    def _path(self, name, ext):
+        return os.path.join(self.run_dir, f"{name}.{ext}")
+
+    def load_stage(self, name):
+        """完了した段階の出力を返す（未完了ならNone）"""
+        path = self._path(name, "json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            value = json.load(f)
+        print(f"Checkpoint: loaded stage '{name}' from {path}")
+        return value
+
+    def save_stage(self, name, value):
+        """段階の出力を保存する（一時ファイルに書いてから置き換えるため、途中で落ちても壊れない）"""
+        path = self._path(name, "json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False, default=_json_default)
+        os.replace(tmp_path, path)
+
+    def load_records(self, name):
+        """
+        段階の途中経過を "key" ごとのdictで返す（同じkeyは後のレコードが優先）
+
+        最後の行が書きかけ（JSONとして不完全）の場合は読み飛ばす。
+        """
+        records = {}
+        path = self._path(name, "jsonl")
+        if not os.path.exists(path):
+            return records
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record["key"]] = record
+        return records
+
+    def append_records(self, name, records):
+        """段階の途中経過を追記する（各レコードは "key" を持つdict）"""
+        if not records:
+            return
+        with open(self._path(name, "jsonl"), "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=_json_default) + "\n")
+            f.flush()
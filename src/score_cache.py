@@ -0,0 +1,185 @@
+"""
+関連度スコアのキャッシュ（SQLite）
+
+LLMが返した論文ごとのスコア（"Relevancy score"・"Reasons for match" など）を保存し、
+同じ論文・同じ関心領域・同じモデル・同じプロンプトでの再評価を省略する。
+配信失敗後の再実行や、同じリスティングを見る週末の実行でLLMに送るのはキャッシュミスだけになる。
+
+キー:
+    arxiv_id     : arXiv ID
+    version      : タイトル・アブストラクトのハッシュ（リスティングにはvNが載らないため、
+                   内容が改訂された論文は別エントリとして再評価される）
+    interest     : 関心領域テキストのハッシュ
+    model        : 評価モデル名
+    prompt       : relevancy_prompt.txt のハッシュ
+
+エビクション:
+    ttl_days     : 評価から一定日数を過ぎたエントリを削除する
+    max_entries  : 件数が上限を超えたら、最後に使われたのが古い順に削除する
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from paper_store import arxiv_id_from_url
+
+
+DEFAULT_SCORE_CACHE_PATH = "./data/score_cache.sqlite"
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 50000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    arxiv_id  TEXT NOT NULL,
+    version   TEXT NOT NULL,
+    interest  TEXT NOT NULL,
+    model     TEXT NOT NULL,
+    prompt    TEXT NOT NULL,
+    item      TEXT NOT NULL,
+    scored_at REAL NOT NULL,
+    used_at   REAL NOT NULL,
+    PRIMARY KEY (arxiv_id, version, interest, model, prompt)
+);
+CREATE INDEX IF NOT EXISTS idx_scores_scored_at ON scores(scored_at);
+CREATE INDEX IF NOT EXISTS idx_scores_used_at ON scores(used_at);
+"""
+
+
+def _hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def paper_version(paper):
+    """論文の内容のハッシュ（タイトル・アブストラクトが改訂されたら変わる）"""
+    return _hash_text(paper["title"] + "\n" + paper["abstract"])
+
+
+def _cache_key(paper, context):
+    return (arxiv_id_from_url(paper["main_page"]), paper_version(paper)) + tuple(context)
+
+
+def score_context(interest, model_name, prompt):
+    """キャッシュキーのうち、論文に依存しない部分（関心領域・モデル・プロンプト）"""
+    return _hash_text(interest), model_name, _hash_text(prompt)
+
+
+class ScoreCache:
+    """
+    論文ごとの関連度スコアの永続キャッシュ
+
+    hits / misses に、このインスタンスでの参照結果の累計を数える。
+    """
+
+    def __init__(self, path=DEFAULT_SCORE_CACHE_PATH, ttl_days=DEFAULT_TTL_DAYS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl_days = ttl_days
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, papers, context):
+        """
+        論文ごとにキャッシュ済みのスコアを返す
+
+        Args:
+            papers: 論文dictのリスト
+            context: score_context() の戻り値
+
+        Returns:
+            papersと同じ長さのリスト（ヒットはスコアのdict、ミスはNone）
+        """
+        now = time.time()
+        results = []
+        with self._lock, self._conn:
+            for paper in papers:
+                key = _cache_key(paper, context)
+                row = self._select(key)
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._conn.execute(
+                    "UPDATE scores SET used_at = ? "
+                    "WHERE arxiv_id = ? AND version = ? AND interest = ? AND model = ? AND prompt = ?",
+                    (now,) + key,
+                )
+                results.append(json.loads(row[0]))
+        return results
+
+    def peek_many(self, papers, context):
+        """
+        get_manyと同じくキャッシュ済みのスコアを返すが、読み取りだけを行う
+
+        used_at（追い出しの順序）とhits / missesを更新しないので、評価用のツールなどで
+        キャッシュの中身を見るときに使う。
+        """
+        with self._lock:
+            rows = [self._select(_cache_key(paper, context)) for paper in papers]
+        return [None if row is None else json.loads(row[0]) for row in rows]
+
+    def _select(self, key):
+        return self._conn.execute(
+            "SELECT item FROM scores "
+            "WHERE arxiv_id = ? AND version = ? AND interest = ? AND model = ? AND prompt = ?",
+            key,
+        ).fetchone()
+
+    def put_many(self, scored, context):
+        """
+        スコアを保存する
+
+        Args:
+            scored: (論文dict, スコアのdict) のイテラブル
+            context: score_context() の戻り値
+        """
+        now = time.time()
+        rows = [
+            (arxiv_id_from_url(paper["main_page"]), paper_version(paper)) + tuple(context)
+            + (json.dumps(item, ensure_ascii=False), now, now)
+            for paper, item in scored
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scores (arxiv_id, version, interest, model, prompt, item, scored_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def evict(self):
+        """TTLを過ぎたエントリと、上限を超えた分のエントリを削除し、削除した件数を返す"""
+        removed = 0
+        with self._lock, self._conn:
+            if self.ttl_days:
+                cursor = self._conn.execute(
+                    "DELETE FROM scores WHERE scored_at < ?", (time.time() - self.ttl_days * 86400,)
+                )
+                removed += cursor.rowcount
+            if self.max_entries:
+                cursor = self._conn.execute(
+                    "DELETE FROM scores WHERE rowid IN "
+                    "(SELECT rowid FROM scores ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                removed += cursor.rowcount
+        return removed
@@ -0,0 +1,115 @@
+"""
+arXivサブジェクトの解析・照合
+
+subjects文字列（例: "Systems and Control (eess.SY); Artificial Intelligence (cs.AI)"）を
+論文の取り込み時に一度だけ解析し、カテゴリ名とarXivコードのfrozensetとして保持する。
+同じsubjects文字列は同じオブジェクトを共有し（インターン）、カテゴリによる
+フィルタや振り分けは集合演算だけで行える。解析結果のキャッシュは件数に上限があり、
+バックフィルのように大量の論文を取り込んでもメモリが増え続けない。
+"""
+import os
+import re
+import sys
+from functools import lru_cache
+from typing import FrozenSet, NamedTuple
+
+
+# arXivのカテゴリID・英語名の一覧（リポジトリ直下のMarkdown表）
+TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "arxiv_category_taxonomy_full_jp.md")
+
+# parse_subjectsのキャッシュの件数（1日分の新着に出てくるsubjects文字列は数百種類）
+PARSE_CACHE_SIZE = 4096
+
+_TAXONOMY_ROW_RE = re.compile(r"^\|\s*([a-z][a-z-]*(?:\.[A-Za-z-]+)?)\s*\|\s*([^|]+?)\s*\|")
+
+
+class Subjects(NamedTuple):
+    names: FrozenSet[str]   # 正規化したカテゴリ名（例: "Machine Learning"）
+    codes: FrozenSet[str]   # arXivコード（例: "cs.LG"）
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_subjects(subjects):
+    """
+    subjects文字列をカテゴリ名・コードの集合に変換する（同じ文字列は再解析しない）
+
+    Args:
+        subjects: 論文のsubjects文字列
+
+    Returns:
+        Subjects(names, codes)
+    """
+    names = []
+    codes = []
+    for subject in subjects.split(";"):
+        subject = subject.strip()
+        if not subject:
+            continue
+        name, _, code = subject.partition(" (")
+        names.append(sys.intern(name.strip()))
+        if code:
+            codes.append(sys.intern(code.rstrip(")").strip()))
+    return Subjects(frozenset(names), frozenset(codes))
+
+
+def attach_subjects(paper):
+    """
+    論文dictに解析済みの subject_names / subject_codes を付与して返す
+    """
+    parsed = parse_subjects(paper.get("subjects", ""))
+    paper["subject_names"] = parsed.names
+    paper["subject_codes"] = parsed.codes
+    return paper
+
+
+def subject_names(paper):
+    """論文のカテゴリ名の集合（取り込み時に解析済みならそれを使う）"""
+    names = paper.get("subject_names")
+    if names is None:
+        names = parse_subjects(paper.get("subjects", "")).names
+    return names
+
+
+def matches_any(paper, categories):
+    """
+    論文がいずれかのカテゴリに該当するか
+
+    Args:
+        paper: 論文dict
+        categories: カテゴリ名のfrozenset（呼び出し側で一度だけ作成する）
+    """
+    return not subject_names(paper).isdisjoint(categories)
+
+
+def first_matching_category(paper, categories):
+    """categories（順序付きリスト）のうち、論文が最初に該当するカテゴリを返す（なければNone）"""
+    names = subject_names(paper)
+    for cat in categories:
+        if cat in names:
+            return cat
+    return None
+
+
+@lru_cache(maxsize=8)
+def load_category_names(path=TAXONOMY_PATH):
+    """
+    カテゴリID → 英語カテゴリ名 の辞書をタクソノミー表から読み込む
+    （"(alias of ...)" の注記は取り除く）
+    """
+    names = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            match = _TAXONOMY_ROW_RE.match(line)
+            if match:
+                names[match.group(1)] = match.group(2).split(" (alias of")[0].strip()
+    return names
+
+
+def format_subjects(codes):
+    """
+    カテゴリIDのリストをarXivリスティングと同じsubjects文字列に変換する
+    例: ["eess.SY", "cs.AI"] -> "Systems and Control (eess.SY); Artificial Intelligence (cs.AI)"
+    """
+    names = load_category_names()
+    return "; ".join(f"{names.get(code, code)} ({code})" for code in codes)
@@ -1,13 +1,13 @@
 """
 論文要約生成機能
 """
-import openai
-from openai import OpenAI
 import os
 import time
 import sys
 import io
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
+
+from rate_limit import create_chat_completion
 
 # Windows環境でのUnicode出力対応
 if sys.platform == 'win32':
@@ -37,6 +37,9 @@ Abstract: {abstract}
 
 Generate the summary in JSON format:"""
 
+# 要約の生成に失敗した場合の要約（チェックポイントには保存せず、再実行時に生成し直す）
+FAILED_SUMMARY = {"summary_en": "(Summary generation failed)", "summary_ja": "（要約生成に失敗しました）"}
+
 
 def generate_summary(paper: Dict, model_name: str = "gpt-3.5-turbo") -> str:
     """
@@ -56,29 +59,17 @@ def generate_summary(paper: Dict, model_name: str = "gpt-3.5-turbo") -> str:
     )
     
     try:
-        # OpenAI 1.3.0互換処理
-        try:
-            response = openai.ChatCompletion.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful research assistant that summarizes academic papers in both English and Japanese."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=1200
-            )
-        except Exception:
-            # フォールバック：OpenAI 1.3.0直接使用
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful research assistant that summarizes academic papers in both English and Japanese."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=1200
-            )
+        # 共有クライアントでレート制限のガバナを通して送信（待機・再送はガバナが行う）
+        response = create_chat_completion(
+            stage="summaries",
+            model=model_name,
+            messages=[
+                {"role": "system", "content": "You are a helpful research assistant that summarizes academic papers in both English and Japanese."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=1200
+        )
         
         content = response.choices[0].message.content.strip()
         
@@ -100,16 +91,18 @@ def generate_summary(paper: Dict, model_name: str = "gpt-3.5-turbo") -> str:
             
     except Exception as e:
         print(f"要約生成エラー: {str(e)}")
-        return {"summary_en": "(Summary generation failed)", "summary_ja": "（要約生成に失敗しました）"}
+        return dict(FAILED_SUMMARY)
 
 
-def generate_summaries_batch(papers: List[Dict], model_name: str = "gpt-3.5-turbo") -> List[Dict]:
+def generate_summaries_batch(papers: List[Dict], model_name: str = "gpt-3.5-turbo",
+                             on_summarized: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
     """
     複数の論文の要約を一括生成
     
     Args:
         papers: 論文情報のリスト
         model_name: 使用するOpenAIモデル
+        on_summarized: 論文1件の要約を生成するたびに、その論文を渡して呼ぶ関数（チェックポイント用）
     
     Returns:
         List[Dict]: 要約付きの論文情報リスト
@@ -121,10 +114,8 @@ def generate_summaries_batch(papers: List[Dict], model_name: str = "gpt-3.5-turb
         
         summary = generate_summary(paper, model_name)
         paper['summary'] = summary
-        
-        # Rate limit対策
-        if idx < len(papers):
-            time.sleep(1)
+        if on_summarized is not None:
+            on_summarized(paper)
     
     print("Summary generation completed")
     return papers
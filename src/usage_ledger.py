@@ -0,0 +1,255 @@
+"""
+OpenAI APIの使用量の台帳
+
+rate_limit経由の全リクエスト（relevancy・summarizer・discord_pdf_bot）とBatch APIの応答ごとに、
+入力・出力・プロンプトキャッシュに当たったトークン数、応答時間、再送回数を記録し、段階（stage）と
+モデルごとに集計する。どの段階・どの設定変更が料金と実行時間を増やしているかを見るためのもの。
+
+段階はリクエストごとに指定するか（summarizerは "summaries"、discord_pdf_botは "pdf_bot"）、
+指定しなければstart_stageで始めた現在の段階に数える。start_stageは段階ごとの経過時間も数える。
+action.pyは実行の最後に集計を実行ディレクトリの usage.json に書き出す。
+
+集計は記録のたびに段階・モデルごとの合計に足し込むため、リクエストごとの記録を残さなくても取れる。
+常駐するdiscord_pdf_botのように記録が増え続けるプロセスでは、set_max_requestsで残す件数を制限する。
+
+料金表（モデルごとの100万トークンあたりのドル）を渡すと、集計に概算の料金を含める:
+    {"gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.6}}
+
+ストリーミングのリクエストはstream_options.include_usageで最後のチャンクにusageを含めさせる。
+それでもusageのない応答（途中で切れたストリームなど）はトークン数を数えず、
+requests_without_usageとして数える。
+"""
+import collections
+import datetime
+import json
+import os
+import threading
+import time
+
+
+DEFAULT_STAGE = "other"
+
+_TOKEN_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def _usage_value(usage, key):
+    if usage is None:
+        return 0
+    value = usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+    return value or 0
+
+
+def usage_cached_tokens(usage):
+    """usage（レスポンスのオブジェクトまたはdict）から、プロンプトキャッシュに当たった入力トークン数を返す"""
+    if usage is None:
+        return 0
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return 0
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+def request_cost(entry, prices):
+    """1リクエストの概算料金（ドル）。料金表にモデルがなければNone"""
+    price = (prices or {}).get(entry["model"])
+    if price is None:
+        return None
+    uncached = entry["prompt_tokens"] - entry["cached_tokens"]
+    return (uncached * price.get("input", 0)
+            + entry["cached_tokens"] * price.get("cached_input", price.get("input", 0))
+            + entry["completion_tokens"] * price.get("output", 0)) / 1_000_000
+
+
+def _empty_totals():
+    return {"requests": 0, "failed": 0, "retries": 0, **dict.fromkeys(_TOKEN_KEYS, 0),
+            "requests_without_usage": 0, "latency_seconds": 0.0, "max_latency_seconds": 0.0}
+
+
+def _add(totals, entry):
+    totals["requests"] += 1
+    totals["failed"] += entry["failed"]
+    totals["retries"] += entry["retries"]
+    for key in _TOKEN_KEYS:
+        totals[key] += entry[key]
+    if not entry["has_usage"] and not entry["failed"]:
+        totals["requests_without_usage"] += 1
+    if entry["latency"] is not None:
+        totals["latency_seconds"] += entry["latency"]
+        totals["max_latency_seconds"] = max(totals["max_latency_seconds"], entry["latency"])
+
+
+def _merge(totals, other):
+    for key, value in other.items():
+        if key == "max_latency_seconds":
+            totals[key] = max(totals[key], value)
+        elif key != "models":
+            totals[key] = totals.get(key, 0) + value
+
+
+class UsageLedger:
+    """リクエストごとの使用量を記録し、段階・モデルごとに集計する（スレッドセーフ）"""
+
+    def __init__(self, max_requests=None):
+        # リクエストごとの記録（max_requestsを超えたら古いものから捨てる）
+        self.requests = collections.deque(maxlen=max_requests)
+        # (段階, モデル) ごとの合計
+        self._totals = {}
+        self.stage_seconds = {}
+        self.current_stage = DEFAULT_STAGE
+        self.started_at = time.time()
+        self._start = self._stage_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start_stage(self, name):
+        """現在の段階を終えてnameの段階を始める（以後、段階を指定しないリクエストはnameに数える）"""
+        with self._lock:
+            now = time.monotonic()
+            self.stage_seconds[self.current_stage] = (
+                self.stage_seconds.get(self.current_stage, 0.0) + now - self._stage_start
+            )
+            self.current_stage = name
+            self._stage_start = now
+
+    def set_max_requests(self, max_requests):
+        """リクエストごとの記録を直近max_requests件までにする（Noneなら制限しない。集計には影響しない）"""
+        with self._lock:
+            self.requests = collections.deque(self.requests, maxlen=max_requests)
+
+    def record(self, model, usage=None, latency=None, retries=0, stage=None, failed=False):
+        """
+        1リクエストの使用量を記録する
+
+        Args:
+            model: モデル名
+            usage: レスポンスのusage（オブジェクトまたはdict。ストリーミングなどで無ければNone）
+            latency: 再送の待ち時間を含む応答時間（秒、Batch APIではNone）
+            retries: 再送した回数
+            stage: 段階（Noneなら現在の段階）
+            failed: 再送しても失敗したリクエストか
+        """
+        entry = {
+            "stage": stage or self.current_stage,
+            "model": model,
+            "prompt_tokens": _usage_value(usage, "prompt_tokens"),
+            "completion_tokens": _usage_value(usage, "completion_tokens"),
+            "cached_tokens": usage_cached_tokens(usage),
+            "has_usage": usage is not None,
+            "latency": None if latency is None else round(latency, 3),
+            "retries": retries,
+            "failed": failed,
+        }
+        with self._lock:
+            self.requests.append(entry)
+            _add(self._totals.setdefault((entry["stage"], model), _empty_totals()), entry)
+
+    def summary(self, prices=None):
+        """
+        段階ごと（その中はモデルごと）と全体の集計、リクエストごとの記録をdictで返す
+
+        pricesを渡した場合は、料金表にあるモデルのリクエストの概算料金（cost_usd）を含め、
+        料金表にないモデルをunpriced_modelsに挙げる。リクエストごとの記録はset_max_requestsで
+        制限していれば直近の分だけになるが、集計は全リクエストの分になる。
+        """
+        with self._lock:
+            requests = [dict(entry) for entry in self.requests]
+            groups = {key: dict(totals) for key, totals in self._totals.items()}
+            stage_seconds = dict(self.stage_seconds)
+            now = time.monotonic()
+            stage_seconds[self.current_stage] = stage_seconds.get(self.current_stage, 0.0) + now - self._stage_start
+            wall_seconds = now - self._start
+        unpriced = set()
+        totals = _empty_totals()
+        stages = {}
+        for (name, model), group in groups.items():
+            if prices is not None:
+                # 料金はトークン数に比例するので、モデルごとの合計から求めても同じになる
+                cost = request_cost(dict(group, model=model), prices)
+                if cost is None:
+                    unpriced.add(model)
+                else:
+                    group["cost_usd"] = cost
+            stage = stages.setdefault(name, {**_empty_totals(), "models": {}})
+            _merge(totals, group)
+            _merge(stage, group)
+            stage["models"][model] = group
+        for entry in requests:
+            cost = request_cost(entry, prices) if prices is not None else None
+            if cost is not None:
+                entry["cost_usd"] = cost
+        for name, stage in stages.items():
+            # start_stageで始めていない段階（理由の生成など、別の段階の中で行うもの）は経過時間を持たない
+            stage["wall_seconds"] = round(stage_seconds[name], 3) if name in stage_seconds else None
+        summary = {
+            "started_at": datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "wall_seconds": round(wall_seconds, 3),
+            "stage_wall_seconds": {name: round(seconds, 3) for name, seconds in stage_seconds.items()},
+            "totals": totals,
+            "stages": stages,
+            "requests": requests,
+        }
+        if prices is not None:
+            summary["unpriced_models"] = sorted(unpriced)
+        return summary
+
+    def write(self, path, prices=None):
+        """集計をJSONで書き出し、書き出した集計を返す"""
+        summary = self.summary(prices)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return summary
+
+
+def _format_totals(totals):
+    text = (f"{totals['requests']} requests, {totals['prompt_tokens']:,} prompt tokens "
+            f"({totals['cached_tokens']:,} cached), {totals['completion_tokens']:,} completion tokens, "
+            f"{totals['retries']} retries, {totals['failed']} failed")
+    if totals["requests_without_usage"]:
+        text += f", {totals['requests_without_usage']} without usage"
+    if "cost_usd" in totals:
+        text += f", ${totals['cost_usd']:.4f}"
+    return text
+
+
+def format_summary(summary):
+    """summary()の集計を、ログやDiscordに出す数行のテキストにする"""
+    lines = [f"OpenAI usage ({summary['wall_seconds']:.1f}s): {_format_totals(summary['totals'])}"]
+    for name, stage in summary["stages"].items():
+        wall = "" if stage["wall_seconds"] is None else f" ({stage['wall_seconds']:.1f}s)"
+        lines.append(f"  {name}{wall}: {_format_totals(stage)}")
+        for model, totals in stage["models"].items():
+            latency = totals["latency_seconds"] / totals["requests"] if totals["requests"] else 0.0
+            lines.append(f"    {model}: {_format_totals(totals)}, "
+                         f"avg latency {latency:.2f}s (max {totals['max_latency_seconds']:.2f}s)")
+    if summary.get("unpriced_models"):
+        lines.append(f"  no price for: {', '.join(summary['unpriced_models'])}")
+    return "\n".join(lines)
+
+
+_ledger = UsageLedger()
+
+
+def get_ledger():
+    """プロセスで共有する台帳を返す"""
+    return _ledger
+
+
+def record(model, usage=None, latency=None, retries=0, stage=None, failed=False):
+    """共有の台帳に1リクエストの使用量を記録する（UsageLedger.record）"""
+    _ledger.record(model, usage, latency, retries, stage, failed)
+
+
+def start_stage(name):
+    """共有の台帳で段階nameを始める（UsageLedger.start_stage）"""
+    _ledger.start_stage(name)
+
+
+def set_max_requests(max_requests):
+    """共有の台帳に残すリクエストごとの記録を制限する（UsageLedger.set_max_requests）"""
+    _ledger.set_max_requests(max_requests)
@@ -6,13 +6,16 @@ import io
 import sys
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Sequence, Union
 
 import openai
 import tqdm
-from openai import OpenAI
 import copy
 
+from rate_limit import create_chat_completion
+from usage_ledger import usage_cached_tokens
+
 # OpenAI 1.3.0互換性のため、シムを作成
 try:
     from openai import openai_object
@@ -40,31 +43,104 @@ class OpenAIDecodingArguments(object):
     # logprobs: Optional[int] = None
 
 
+DEFAULT_MAX_WORKERS = 8  # openai_completion の同時リクエスト数の既定値
+
+
+def _to_completion_choices(response):
+    """chat.completionsのレスポンスを、旧来の text / message.content を持つchoiceのリストに変換する"""
+    choices = []
+    for choice in response.choices:
+        choices.append(type('obj', (object,), {
+            'text': choice.message.content,
+            'message': type('obj', (object,), {
+                'content': choice.message.content
+            })(),
+            'finish_reason': choice.finish_reason,
+            'total_tokens': response.usage.total_tokens,
+            'prompt_tokens': response.usage.prompt_tokens,
+            'cached_tokens': usage_cached_tokens(response.usage),
+        })())
+    return choices
+
+
+def chat_completion_body(prompt, decoding_args, model_name, decoding_kwargs):
+    """1つのプロンプトに対するchat.completionsのリクエストボディ（モデルごとの差異を吸収する）"""
+    # gpt-5シリーズはmax_completion_tokensを使用
+    body = dict(
+        model=model_name,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        **decoding_args.__dict__,
+        **decoding_kwargs,
+    )
+
+    # gpt-5シリーズの場合の調整
+    if "gpt-5" in model_name:
+        # max_tokensをmax_completion_tokensに変更
+        if "max_tokens" in body:
+            body["max_completion_tokens"] = body.pop("max_tokens")
+        # gpt-5-nanoはtemperature, logit_biasをサポートしないため削除
+        if "nano" in model_name:
+            body.pop("temperature", None)
+            body.pop("logit_bias", None)
+    return body
+
+
+def _complete_prompt(prompt, decoding_args, model_name, decoding_kwargs, stage=None):
+    """1つのプロンプトを送信し、choiceのリストを返す（レート制限の待機・再送はrate_limitのガバナが行う）"""
+    batch_decoding_args = copy.deepcopy(decoding_args)  # cloning the decoding_args
+
+    while True:
+        try:
+            response = create_chat_completion(
+                stage=stage, **chat_completion_body(prompt, batch_decoding_args, model_name, decoding_kwargs)
+            )
+            return _to_completion_choices(response)
+        except openai.BadRequestError as e:
+            if "Please reduce your prompt" not in str(e):
+                raise
+            batch_decoding_args.max_tokens = int(batch_decoding_args.max_tokens * 0.8)
+            logging.warning(f"Reducing target length to {batch_decoding_args.max_tokens}, Retrying...")
+
+
 def openai_completion(
     prompts, #: Union[str, Sequence[str], Sequence[dict[str, str]], dict[str, str]],
-    decoding_args: OpenAIDecodingArguments,
+    decoding_args: Union[OpenAIDecodingArguments, Sequence[OpenAIDecodingArguments]],
     model_name="text-davinci-003",
     sleep_time=2,
     batch_size=1,
     max_instances=sys.maxsize,
     max_batches=sys.maxsize,
     return_text=False,
+    max_workers=DEFAULT_MAX_WORKERS,
+    skip_failures=False,
+    stage=None,
     **decoding_kwargs,
 ) -> Union[Union[StrOrOpenAIObject], Sequence[StrOrOpenAIObject], Sequence[Sequence[StrOrOpenAIObject]],]:
     """Decode with OpenAI API.
 
+    Prompts are sent concurrently (at most `max_workers` requests in flight), one request per prompt.
+    Results are returned in the same order as `prompts`.
+
     Args:
         prompts: A string or a list of strings to complete. If it is a chat model the strings should be formatted
             as explained here: https://github.com/openai/openai-python/blob/main/chatml.md. If it is a chat model
             it can also be a dictionary (or list thereof) as explained here:
             https://github.com/openai/openai-cookbook/blob/main/examples/How_to_format_inputs_to_ChatGPT_models.ipynb
-        decoding_args: Decoding arguments.
+        decoding_args: Decoding arguments, or a list with one entry per prompt.
         model_name: Model name. Can be either in the format of "org/model" or just "model".
-        sleep_time: Time to sleep once the rate-limit is hit.
-        batch_size: Number of prompts to send in a single request. Only for non chat model.
+        sleep_time: Deprecated. Waits and retries are decided by the rate-limit governor (rate_limit.py).
+        batch_size: Kept for compatibility. Chat models take one prompt per request, so every prompt is sent
+            as its own request regardless of this value.
         max_instances: Maximum number of prompts to decode.
         max_batches: Maximum number of batches to decode. This argument will be deprecated in the future.
         return_text: If True, return text instead of full completion object (which contains things like logprob).
+        max_workers: Maximum number of concurrent requests.
+        skip_failures: If True, a prompt that still fails after the retries yields None (one per generation)
+            instead of raising, so the other prompts' results are kept.
+        stage: Stage name recorded in the usage ledger (usage_ledger.py). None records under the current stage.
         decoding_kwargs: Additional decoding arguments. Pass in `best_of` and `logit_bias` if you need them.
 
     Returns:
@@ -74,7 +150,6 @@ def openai_completion(
             - an openai_object.OpenAIObject object (if return_text is False)
             - a list of objects of the above types (if decoding_args.n > 1)
     """
-    is_chat_model = "gpt" in model_name
     is_single_prompt = isinstance(prompts, (str, dict))
     if is_single_prompt:
         prompts = [prompts]
@@ -87,105 +162,32 @@ def openai_completion(
         max_instances = max_batches * batch_size
 
     prompts = prompts[:max_instances]
-    num_prompts = len(prompts)
-    prompt_batches = [
-        prompts[batch_id * batch_size : (batch_id + 1) * batch_size]
-        for batch_id in range(int(math.ceil(num_prompts / batch_size)))
-    ]
-
-    completions = []
-    for batch_id, prompt_batch in tqdm.tqdm(
-        enumerate(prompt_batches),
-        desc="prompt_batches",
-        total=len(prompt_batches),
-    ):
-        batch_decoding_args = copy.deepcopy(decoding_args)  # cloning the decoding_args
-
-        backoff = 3
-
-        while True:
-            try:
-                # gpt-5シリーズはmax_completion_tokensを使用
-                shared_kwargs = dict(
-                    model=model_name,
-                    **batch_decoding_args.__dict__,
-                    **decoding_kwargs,
-                )
-                
-                # gpt-5シリーズの場合の調整
-                if "gpt-5" in model_name:
-                    # max_tokensをmax_completion_tokensに変更
-                    if "max_tokens" in shared_kwargs:
-                        shared_kwargs["max_completion_tokens"] = shared_kwargs.pop("max_tokens")
-                    # gpt-5-nanoはtemperature, logit_biasをサポートしないため削除
-                    if "nano" in model_name:
-                        shared_kwargs.pop("temperature", None)
-                        shared_kwargs.pop("logit_bias", None)
-                
-                # OpenAI 1.3.0互換の処理
-                if is_chat_model:
-                    # OpenAI 1.3.0では、openai.ChatCompletion.createは非推奨だが、互換性シムがある
-                    # ただしhttpxのバージョン問題があるため、clientを直接使用
-                    client = OpenAI(api_key=openai.api_key, timeout=120)
-                    response = client.chat.completions.create(
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant."},
-                            {"role": "user", "content": prompt_batch[0]}
-                        ],
-                        **shared_kwargs
-                    )
-                    # 互換性のため、response.choicesをlistに変換
-                    # コンテンツ抽出用の新しい形式
-                    completion_batch = type('obj', (object,), {
-                        'choices': [type('obj', (object,), {
-                            'text': choice.message.content,
-                            'message': type('obj', (object,), {
-                                'content': choice.message.content
-                            })()
-                        })() for choice in response.choices],
-                        'usage': response.usage
-                    })()
-                else:
-                    client = OpenAI(api_key=openai.api_key, timeout=120)
-                    response = client.chat.completions.create(
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant."},
-                            {"role": "user", "content": prompt_batch[0]}
-                        ],
-                        **shared_kwargs
-                    )
-                    completion_batch = type('obj', (object,), {
-                        'choices': [type('obj', (object,), {
-                            'text': choice.message.content,
-                            'message': type('obj', (object,), {
-                                'content': choice.message.content
-                            })()
-                        })() for choice in response.choices],
-                        'usage': response.usage
-                    })()
-
-                choices = completion_batch.choices
-                
-                for choice in choices:
-                    choice.total_tokens = completion_batch.usage.total_tokens
-                completions.extend(choices)
-                break
-            except Exception as e:
-                logging.warning(f"OpenAIError: {e}.")
-                if "Please reduce your prompt" in str(e):
-
-                    batch_decoding_args.max_tokens = int(batch_decoding_args.max_tokens * 0.8)
-                    logging.warning(f"Reducing target length to {batch_decoding_args.max_tokens}, Retrying...")
-                elif not backoff:
-                    logging.error("Hit too many failures, exiting")
-                    raise e
-                else:
-                    backoff -= 1
-                    logging.warning("Hit request rate limit; retrying...")
-                    time.sleep(sleep_time)  # Annoying rate limit on requests.
+    # decoding_argsはプロンプトごとのリストでもよい（論文数に応じてmax_tokensを変える場合など）
+    if isinstance(decoding_args, OpenAIDecodingArguments):
+        prompt_decoding_args = [decoding_args] * len(prompts)
+    else:
+        prompt_decoding_args = list(decoding_args)[:len(prompts)]
+        decoding_args = prompt_decoding_args[0]
+
+    def complete(prompt, args):
+        try:
+            return _complete_prompt(prompt, args, model_name, decoding_kwargs, stage)
+        except Exception as e:
+            if not skip_failures:
+                raise
+            logging.warning(f"Giving up on a prompt: {e}")
+            return [None] * args.n
+
+    # executor.mapは入力順に結果を返すため、完了順に関係なく順序が保たれる
+    workers = max(1, min(max_workers, len(prompts)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        completions = []
+        results = executor.map(complete, prompts, prompt_decoding_args)
+        for choices in tqdm.tqdm(results, desc="prompts", total=len(prompts)):
+            completions.extend(choices)
 
     if return_text:
-        completions = [completion.text for completion in completions]
+        completions = [None if completion is None else completion.text for completion in completions]
     if decoding_args.n > 1:
         # make completions a nested list, where each entry is a consecutive decoding_args.n of original entries.
         completions = [completions[i : i + decoding_args.n] for i in range(0, len(completions), decoding_args.n)]
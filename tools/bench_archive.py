@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+論文アーカイブのベンチマーク: 生のJSONLと比較して
+ディスク使用量・全件走査・カテゴリ絞り込み走査・IDでのランダムアクセスを計測する
+
+使い方:
+    python tools/bench_archive.py [JSONLディレクトリ ...]
+    （省略時は ./data と ./src/data）
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'src')
+from paper_archive import PaperArchive, iter_jsonl_papers, write_archive
+from paper_store import arxiv_id_from_url
+from subjects import parse_subjects
+
+
+def timed(func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def jsonl_scan(paths, codes=None):
+    """アーカイブと同じく、同じarXiv IDは最初の1件だけを対象にする"""
+    results = []
+    seen = set()
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                paper = json.loads(line)
+                arxiv_id = arxiv_id_from_url(paper["main_page"])
+                if arxiv_id in seen:
+                    continue
+                seen.add(arxiv_id)
+                if codes is None or not codes.isdisjoint(parse_subjects(paper["subjects"]).codes):
+                    results.append(paper)
+    return results
+
+
+def jsonl_lookup(paths, arxiv_id):
+    for paper in jsonl_scan(paths):
+        if arxiv_id_from_url(paper["main_page"]) == arxiv_id:
+            return paper
+    return None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("dirs", nargs="*", default=["data", "src/data"])
+    arg_parser.add_argument("--codes", default="cs.SD,eess.AS", help="絞り込みに使うカテゴリコード（カンマ区切り）")
+    arg_parser.add_argument("--lookups", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    paths = sorted(p for d in args.dirs for p in glob.glob(os.path.join(d, "*_*.jsonl")))
+    raw_size = sum(os.path.getsize(p) for p in paths)
+    codes = frozenset(args.codes.split(","))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive_path = os.path.join(tmp, "bench.pda")
+        count, write_time = timed(lambda: write_archive(archive_path, iter_jsonl_papers(paths)))
+        archive_size = os.path.getsize(archive_path)
+        print(f"{len(paths)} JSONL files, {count} unique papers")
+        print(f"  disk: raw JSONL {raw_size / 1024:.0f} KB -> archive {archive_size / 1024:.0f} KB "
+              f"({archive_size / raw_size:.1%}), written in {write_time * 1000:.0f} ms")
+
+        with PaperArchive(archive_path) as archive:
+            _, jsonl_full = timed(lambda: jsonl_scan(paths), 3)
+            _, archive_full = timed(lambda: list(archive.scan()), 3)
+            print(f"  full scan: JSONL {jsonl_full * 1000:.1f} ms, archive {archive_full * 1000:.1f} ms")
+
+            jsonl_hits, jsonl_filtered = timed(lambda: jsonl_scan(paths, codes), 3)
+            archive_hits, archive_filtered = timed(lambda: list(archive.scan(codes=codes)), 3)
+            assert {arxiv_id_from_url(p["main_page"]) for p in jsonl_hits} == \
+                {arxiv_id_from_url(p["main_page"]) for p in archive_hits}
+            print(f"  scan {sorted(codes)} ({len(archive_hits)} hits): "
+                  f"JSONL {jsonl_filtered * 1000:.1f} ms, archive {archive_filtered * 1000:.1f} ms")
+
+            ids = [arxiv_id_from_url(p["main_page"]) for p in jsonl_scan(paths)]
+            sample = random.Random(0).sample(ids, min(args.lookups, len(ids)))
+            _, archive_lookup = timed(lambda: [archive.get(i) for i in sample])
+            _, jsonl_lookup_time = timed(lambda: jsonl_lookup(paths, sample[0]))
+            assert all(archive.get(i) is not None for i in sample)
+            print(f"  random access: archive {archive_lookup / len(sample) * 1e6:.0f} us/lookup, "
+                  f"JSONL {jsonl_lookup_time * 1e6:.0f} us/lookup (linear scan)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+リスティングパーサのベンチマーク: BeautifulSoup版とストリーミング版を
+保存済みのリスティングHTMLで比較し、出力が一致することを確認する
+
+使い方:
+    python tools/bench_listing_parser.py [HTMLファイル ...] [--repeat N]
+    （ファイル指定なしの場合は tools/fixtures/*.html を使用）
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, 'src')
+from download_new_papers import parse_listing, LISTING_PARSERS
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def run_parser(page, parser, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        papers = parse_listing(page, parser=parser)
+    elapsed = (time.perf_counter() - start) / repeat
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return papers, elapsed, peak
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("files", nargs="*", help="保存済みリスティングHTML")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html")))
+    if not files:
+        print("No listing HTML fixtures found")
+        return 1
+
+    for path in files:
+        with open(path, "rb") as f:
+            page = f.read()
+        print(f"\n=== {os.path.basename(path)} ({len(page) / 1024:.0f} KB) ===")
+        results = {}
+        for parser in LISTING_PARSERS:
+            papers, elapsed, peak = run_parser(page, parser, args.repeat)
+            results[parser] = papers
+            print(f"  {parser:>6}: {len(papers)} papers, {elapsed * 1000:.1f} ms/parse, peak {peak / 1024:.0f} KB")
+        assert results["bs4"] == results["stream"], f"Parser outputs differ for {path}"
+        print("  outputs identical: OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+OpenAIクライアント共有のベンチマーク
+
+ローカルに立てたスタブのChat Completions APIに対して、
+リクエストごとにOpenAIクライアントを作る従来の方式と、
+openai_client.get_client() の共有クライアント（keep-alive接続プール）で
+リクエストあたりの時間と新規TCP接続数を比較する。
+
+使い方:
+    python tools/bench_openai_client.py [--requests N] [--latency 秒]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+sys.path.insert(0, 'src')
+import openai_client
+
+
+RESPONSE = {
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "stub",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """/v1/chat/completions に固定のレスポンスを返すスタブ（HTTP/1.1 keep-alive対応）"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        body = json.dumps(RESPONSE).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(label, make_client, n):
+    StubHandler.connections = 0
+    start = time.perf_counter()
+    for _ in range(n):
+        make_client().chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}])
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / n * 1000:7.2f} ms/request  new_connections={StubHandler.connections}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="スタブの応答遅延（秒）")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["OPENAI_BASE_URL"] = base_url
+
+    def per_request_client():
+        # 従来の方式: リクエストのたびにクライアント（と接続プール）を作る
+        return OpenAI(api_key="stub", base_url=base_url, timeout=120)
+
+    def shared_client():
+        return openai_client.get_client("stub")
+
+    # ウォームアップ
+    run("warmup", shared_client, 5)
+    print()
+    per_request = run("per-request client", per_request_client, args.requests)
+    shared = run("shared client", shared_client, args.requests)
+    print(f"\nspeedup: {per_request / shared:.1f}x")
+
+    openai_client.close_client()
+    server.shutdown()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+サブジェクト照合のマイクロベンチマーク
+
+1日分のcsリスティングに対して、従来の方式（毎回 process_subject_fields で
+文字列を分割して set を作る）と、取り込み時に解析したfrozensetを使う方式で
+カテゴリフィルタ＋カテゴリ振り分けの時間を比較する。
+
+使い方:
+    python tools/bench_subjects.py [JSONLファイル] [--repeat N]
+"""
+import argparse
+import glob
+import json
+import sys
+import time
+
+import yaml
+
+sys.path.insert(0, 'src')
+from relevancy import process_subject_fields
+from subjects import attach_subjects, first_matching_category, matches_any, parse_subjects
+
+
+def legacy_filter_and_balance(papers, categories):
+    selected = [t for t in papers if bool(set(process_subject_fields(t["subjects"])) & set(categories))]
+    by_category = {cat: [] for cat in categories}
+    for paper in selected:
+        processed = process_subject_fields(paper["subjects"])
+        for cat in categories:
+            if cat in processed:
+                by_category[cat].append(paper)
+                break
+    return selected, by_category
+
+
+def interned_filter_and_balance(papers, categories):
+    category_set = frozenset(categories)
+    selected = [t for t in papers if matches_any(t, category_set)]
+    by_category = {cat: [] for cat in categories}
+    for paper in selected:
+        cat = first_matching_category(paper, categories)
+        if cat is not None:
+            by_category[cat].append(paper)
+    return selected, by_category
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("path", nargs="?", default=None, help="1日分のリスティング（JSONL）")
+    arg_parser.add_argument("--repeat", type=int, default=50)
+    arg_parser.add_argument("--config", default="config.yaml")
+    args = arg_parser.parse_args()
+
+    path = args.path or sorted(glob.glob("data/cs_*.jsonl"))[-1]
+    with open(path, "r", encoding="utf-8") as f:
+        raw_papers = [json.loads(line) for line in f]
+    with open(args.config, "r", encoding="utf-8") as f:
+        categories = yaml.safe_load(f)["categories"]
+    print(f"{path}: {len(raw_papers)} papers, {len(categories)} categories")
+
+    legacy, legacy_time = timed(lambda: legacy_filter_and_balance(raw_papers, categories), args.repeat)
+
+    parse_subjects.cache_clear()
+    papers, ingest_time = timed(lambda: [attach_subjects(dict(p)) for p in raw_papers], 1)
+    interned, interned_time = timed(lambda: interned_filter_and_balance(papers, categories), args.repeat)
+
+    assert [p["main_page"] for p in legacy[0]] == [p["main_page"] for p in interned[0]]
+    assert {c: len(v) for c, v in legacy[1].items()} == {c: len(v) for c, v in interned[1].items()}
+
+    print(f"  legacy split per call : {legacy_time * 1000:.3f} ms/run")
+    print(f"  parse once at ingest  : {ingest_time * 1000:.3f} ms (one-off, {parse_subjects.cache_info().currsize} distinct subject strings)")
+    print(f"  interned frozensets   : {interned_time * 1000:.3f} ms/run ({legacy_time / interned_time:.1f}x)")
+    print("  results identical: OK")
+
+
+if __name__ == "__main__":
+    main()
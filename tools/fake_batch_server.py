@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+OpenAI Batch APIのローカル代替サーバ（オフラインでのバッチ評価の動作確認用）
+
+実装しているエンドポイント:
+    POST /v1/files                  バッチ入力JSONLのアップロード（multipart）
+    GET  /v1/files/{id}/content     出力JSONLのダウンロード
+    POST /v1/batches                バッチの作成（--delay秒後に完了する）
+    GET  /v1/batches/{id}           バッチの状態
+    POST /v1/chat/completions       同期評価用（バッチと同じ応答を返す）
+
+応答は relevancy_prompt.txt の形式に合わせ、プロンプト中の論文数だけ
+"N. {"Relevancy score": ..., "Reasons for match": ...}" の行を返す（スコアはタイトルのハッシュ）。
+response_formatが指定された場合は relevancy_prompt_json.txt の形式（{"scores": [...]}）で返す。
+二段階評価のプロンプトには、relevancy_prompt_score.txt の形式（"ID: スコア" の行）と
+relevancy_prompt_reasons.txt の形式（{"reasons": [...]}）で返す。
+stream=Trueのリクエストには応答を16文字ずつのSSE（--token-delay秒間隔）で返す。
+--rpm を指定すると、chat.completionsに1分あたりのリクエスト数の制限をかけて x-ratelimit-* ヘッダを
+返し、超えたリクエストには429とretry-after-msを返す（rate_limit.pyのガバナの確認用）。
+
+使い方:
+    python tools/fake_batch_server.py --port 8765 --delay 5
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=dummy python src/action.py  # config.yaml の scoring_mode: "batch"
+"""
+import argparse
+import email.parser
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+_TITLE_RE = re.compile(r"^(\d+)\. Title: (.*?)\n\1\. Authors:", re.MULTILINE | re.DOTALL)
+
+
+def fake_scoring_content(prompt):
+    """プロンプト中の論文ごとに、タイトルから決まるスコアの行を返す"""
+    lines = []
+    for number, title in _TITLE_RE.findall(prompt):
+        title = " ".join(title.split())
+        score = int(hashlib.sha256(title.encode("utf-8")).hexdigest(), 16) % 11
+        item = {
+            "Relevancy score": score,
+            "Reasons for match": f"Stub reason {number}",
+            "Reasons for match (ja)": "スタブの理由",
+        }
+        lines.append(f"{number}. {json.dumps(item, ensure_ascii=False)}")
+    return "\n".join(lines)
+
+
+_ID_RE = re.compile(r"^(\d+)\. ID: (\S+)\n\1\. Title: (.*?)\n\1\. Authors:", re.MULTILINE | re.DOTALL)
+
+
+def _fake_entries(prompt, drop_every=0):
+    """arXiv ID付きのプロンプトの論文ごとの項目（drop_every件ごとに1件落とす）"""
+    entries = []
+    matches = _ID_RE.findall(prompt)
+    for number, arxiv_id, title in matches:
+        if drop_every and len(matches) > 1 and int(number) % drop_every == 0:
+            continue
+        title = " ".join(title.split())
+        entries.append({
+            "id": arxiv_id,
+            "Relevancy score": int(hashlib.sha256(title.encode("utf-8")).hexdigest(), 16) % 11,
+            "Reasons for match": f"Stub reason for {arxiv_id}",
+            "Reasons for match (ja)": "スタブの理由",
+        })
+    return entries
+
+
+def fake_structured_content(prompt, drop_every=0):
+    """structured_output用: arXiv IDをキーにした {"scores": [...]} を返す（drop_every件ごとに1件落とす）"""
+    return json.dumps({"scores": _fake_entries(prompt, drop_every)}, ensure_ascii=False)
+
+
+def fake_score_only_content(prompt, drop_every=0):
+    """二段階評価の1段目用: "ID: スコア" の行を返す"""
+    return "\n".join(f"{entry['id']}: {entry['Relevancy score']}" for entry in _fake_entries(prompt, drop_every))
+
+
+def fake_reasons_content(prompt, drop_every=0):
+    """二段階評価の2段目用: arXiv IDをキーにした {"reasons": [...]} を返す"""
+    reasons = [{key: entry[key] for key in ("id", "Reasons for match", "Reasons for match (ja)")}
+               for entry in _fake_entries(prompt, drop_every)]
+    return json.dumps({"reasons": reasons}, ensure_ascii=False)
+
+
+def fake_chat_completion(body, drop_every=0):
+    prompt = body["messages"][-1]["content"]
+    if "Reply with the scores only" in prompt:
+        content = fake_score_only_content(prompt, drop_every)
+    elif '{"reasons": [' in prompt:
+        content = fake_reasons_content(prompt, drop_every)
+    elif (body.get("response_format") or {}).get("type") in ("json_schema", "json_object"):
+        content = fake_structured_content(prompt, drop_every)
+    else:
+        content = fake_scoring_content(prompt)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                  "total_tokens": (len(prompt) + len(content)) // 4},
+    }
+
+
+class FakeBatchState:
+    def __init__(self, delay, drop_every=0, rpm=0, window=60.0, token_delay=0.0):
+        self.delay = delay
+        self.token_delay = token_delay
+        self.drop_every = drop_every
+        self.rpm = rpm
+        self.window = window
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.rate_limited = 0
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add_file(self, data, filename, purpose):
+        file_id = f"file-{next(self.ids)}"
+        self.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed", "status_details": None}
+
+    def take_request(self):
+        """rpmの枠を1つ使う。(許可されたか, レート制限ヘッダ) を返す"""
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            self.window_start, self.window_requests = now, 0
+        reset = self.window - (now - self.window_start)
+        allowed = self.window_requests < self.rpm
+        if allowed:
+            self.window_requests += 1
+        else:
+            self.rate_limited += 1
+        headers = {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(self.rpm - self.window_requests),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+        if not allowed:
+            headers["retry-after-ms"] = str(int(reset * 1000))
+        return allowed, headers
+
+    def create_batch(self, request):
+        batch_id = f"batch-{next(self.ids)}"
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+            "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+            "status": "validating", "output_file_id": None, "error_file_id": None,
+            "created_at": int(time.time()), "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self.batches[batch_id] = batch
+        threading.Timer(self.delay, self._run_batch, args=(batch,)).start()
+        batch["status"] = "in_progress"
+        return batch
+
+    def _run_batch(self, batch):
+        output = []
+        lines = self.files[batch["input_file_id"]].decode("utf-8").splitlines()
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output.append(json.dumps({
+                "id": f"batch_req-{next(self.ids)}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": fake_chat_completion(request["body"], self.drop_every)},
+                "error": None,
+            }, ensure_ascii=False))
+        with self.lock:
+            batch["output_file_id"] = self.add_file(("\n".join(output) + "\n").encode("utf-8"),
+                                                    "output.jsonl", "batch_output")["id"]
+            batch["request_counts"] = {"total": len(output), "completed": len(output), "failed": 0}
+            batch["status"] = "completed"
+
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state = None
+
+    def _send(self, status, payload, content_type="application/json", headers=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_stream(self, completion, headers=None, include_usage=False):
+        """chat.completionの応答をSSE（chat.completion.chunk）で少しずつ返す（include_usageなら最後にusageのチャンクを付ける）"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        content = completion["choices"][0]["message"]["content"]
+        pieces = [{"content": content[i:i + 16]} for i in range(0, len(content), 16)]
+        for idx, delta in enumerate(pieces + [{}]):
+            chunk = {
+                "id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+                "model": completion["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if delta else "stop"}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if delta and self.state.token_delay:
+                time.sleep(self.state.token_delay)
+        if include_usage:
+            chunk = {
+                "id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+                "model": completion["model"], "choices": [], "usage": completion["usage"],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_completion(self, request, headers=None):
+        completion = fake_chat_completion(request, self.state.drop_every)
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            self._send_stream(completion, headers, include_usage)
+        else:
+            self._send(200, completion, headers=headers)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path == "/v1/files":
+            message = email.parser.BytesParser().parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode("ascii") + b"\r\n\r\n" + body
+            )
+            fields = {}
+            for part in message.get_payload():
+                fields[part.get_param("name", header="content-disposition")] = (
+                    part.get_filename(), part.get_payload(decode=True)
+                )
+            filename, data = fields["file"]
+            purpose = fields["purpose"][1].decode("utf-8")
+            with self.state.lock:
+                self._send(200, self.state.add_file(data, filename, purpose))
+        elif self.path == "/v1/batches":
+            with self.state.lock:
+                self._send(200, self.state.create_batch(json.loads(body)))
+        elif self.path == "/v1/chat/completions":
+            if not self.state.rpm:
+                self._send_completion(json.loads(body))
+                return
+            with self.state.lock:
+                allowed, headers = self.state.take_request()
+            if allowed:
+                self._send_completion(json.loads(body), headers)
+            else:
+                self._send(429, {"error": {"message": "Rate limit reached for requests", "type": "requests",
+                                           "code": "rate_limit_exceeded"}}, headers=headers)
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        match = re.fullmatch(r"/v1/batches/([\w-]+)", self.path)
+        if match and match.group(1) in self.state.batches:
+            with self.state.lock:
+                self._send(200, self.state.batches[match.group(1)])
+            return
+        match = re.fullmatch(r"/v1/files/([\w-]+)/content", self.path)
+        if match and match.group(1) in self.state.files:
+            self._send(200, self.state.files[match.group(1)], "application/octet-stream")
+            return
+        self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def log_message(self, format, *args):
+        print(f"[fake-batch] {format % args}")
+
+
+def start_server(port=0, delay=1.0, drop_every=0, rpm=0, window=60.0, token_delay=0.0):
+    """サーバをバックグラウンドで起動し、(server, base_url) を返す（windowはrpmを数える秒数）"""
+    FakeBatchHandler.state = FakeBatchState(delay, drop_every, rpm, window, token_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeBatchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=5.0, help="バッチが完了するまでの秒数")
+    parser.add_argument("--drop-every", type=int, default=0,
+                        help="structured_outputの応答からN件ごとに1件落とす（再リクエストの確認用）")
+    parser.add_argument("--rpm", type=int, default=0,
+                        help="chat.completionsの1分あたりのリクエスト数の上限（0なら制限なし）")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="ストリーミング応答の断片（16文字）ごとの待ち時間（秒）")
+    args = parser.parse_args()
+    server, base_url = start_server(args.port, args.delay, args.drop_every, args.rpm, token_delay=args.token_delay)
+    print(f"Fake batch server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+OAI-PMHバックフィルが複数ページを最後まで取り込むかの確認（ネットワーク不要）
+
+3ページ分のListRecordsレスポンスを返すスタブのセッションで backfill を実行し、
+全ページの論文がストアに入り、チェックポイントが完了になることを確かめる。
+
+使い方:
+    python tools/test_backfill.py
+"""
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, 'src')
+from backfill import Checkpoint, OAIPMHSource, backfill
+from paper_store import PaperStore
+
+
+PAGES = 3
+RECORDS_PER_PAGE = 4
+
+
+def _page_xml(page):
+    records = []
+    for i in range(RECORDS_PER_PAGE):
+        arxiv_id = f"2510.{page:02d}{i:03d}"
+        records.append(f"""
+    <record>
+      <header><identifier>oai:arXiv.org:{arxiv_id}</identifier><datestamp>2025-10-0{page + 1}</datestamp></header>
+      <metadata>
+        <arXiv xmlns="http://arxiv.org/OAI/arXiv/">
+          <id>{arxiv_id}</id>
+          <authors><author><keyname>Doe</keyname><forenames>Jane</forenames></author></authors>
+          <title>Paper {page}-{i}</title>
+          <categories>cs.LG cs.AI</categories>
+          <abstract>Abstract {page}-{i}</abstract>
+        </arXiv>
+      </metadata>
+    </record>""")
+    token = f"token-{page + 1}" if page + 1 < PAGES else ""
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <ListRecords>{''.join(records)}
+    <resumptionToken>{token}</resumptionToken>
+  </ListRecords>
+</OAI-PMH>""".encode("utf-8")
+
+
+class _StubResponse:
+    def __init__(self, body):
+        self.raw = io.BytesIO(body)
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _StubSession:
+    """resumptionTokenに応じたページを返すセッション"""
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        self.requests.append(params)
+        token = params.get("resumptionToken")
+        page = int(token.split("-")[1]) if token else 0
+        return _StubResponse(_page_xml(page))
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    session = _StubSession()
+    source = OAIPMHSource("cs", "2025-10-01", "2025-10-03", session=session)
+    checkpoint = Checkpoint(os.path.join(tmp, "checkpoint.json"))
+    with PaperStore(os.path.join(tmp, "papers.sqlite")) as store:
+        total = backfill(source, store, checkpoint, chunk_size=3)
+        dates = [f"2025-10-0{page + 1}" for page in range(PAGES)]
+        stored = sum(len(store.get_papers_by_date(date)) for date in dates)
+
+    print(f"Requests: {len(session.requests)}, ingested: {total}, stored: {stored}, "
+          f"checkpoint: state={checkpoint.state} done={checkpoint.done}")
+    assert len(session.requests) == PAGES, session.requests
+    assert total == stored == PAGES * RECORDS_PER_PAGE
+    assert checkpoint.done and checkpoint.state is None
+
+    # 完了済みのチェックポイントでは何も取得しない
+    resumed = Checkpoint(os.path.join(tmp, "checkpoint.json"))
+    with PaperStore(os.path.join(tmp, "papers.sqlite")) as store:
+        assert backfill(source, store, resumed) == total
+    assert len(session.requests) == PAGES
+
+print("OK: all pages were ingested")
@@ -1,3 +1,8 @@
+import os
+import sys
+
+# src内のモジュールは互いにモジュール名だけでimportするため、srcもパスに入れる
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
 import src.utils
 
 # LLMレスポンスや論文データに含まれる可能性のある文字をテスト